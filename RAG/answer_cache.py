@@ -0,0 +1,100 @@
+"""semantic cache of final answers, keyed on the reformulated query embedding and the retrieved docs"""
+from __future__ import annotations
+import itertools
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+def doc_ids(docs:list[dict]) -> tuple:
+    """order independent key of the retrieved documents, primary keys are only unique per collection"""
+    return tuple(sorted(f"{doc.get('PMC_code') or doc.get('study_id')}:{doc['id']}" for doc in docs))
+
+
+class AnswerCache:
+    """
+    Reuses an answer when a new reformulated query is within threshold cosine similarity
+    of a cached one and retrieval returned exactly the same documents.
+
+    Args:
+        threshold: Minimum cosine similarity between query embeddings for a hit
+        ttl: Seconds an answer stays valid
+        max_size: Maximum number of cached answers, least recently used are evicted
+    """
+
+    def __init__(self, threshold:float=0.95, ttl:float=24 * 3600, max_size:int=512):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        # entry id -> (doc ids, query embedding, answer, created at), in LRU order
+        self._entries = OrderedDict()
+        # doc ids -> entry ids retrieved with exactly those docs
+        self._by_docs = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _remove(self, entry_id:int):
+        """caller holds the lock"""
+        docs = self._entries.pop(entry_id)[0]
+        group = self._by_docs[docs]
+        group.remove(entry_id)
+        if not group:
+            del self._by_docs[docs]
+
+    def get(self, query_embedding, docs:list[dict]) -> str | None:
+        """
+        Cached answer for a query embedding and retrieved docs.
+
+        Args:
+            query_embedding: Normalized embedding of the reformulated query
+            docs: Retrieved docs, each with an "id"
+
+        Returns:
+            Answer text, or None on a miss
+        """
+        key = doc_ids(docs)
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        now = time.monotonic()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._by_docs.get(key, ())):
+                _, embedding, _, created_at = self._entries[entry_id]
+                if now - created_at > self.ttl:
+                    self._remove(entry_id)
+                    self.expired += 1
+                    continue
+                score = float(embedding @ query_embedding)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][2]
+
+    def put(self, query_embedding, docs:list[dict], answer:str):
+        key = doc_ids(docs)
+        embedding = np.array(query_embedding, dtype=np.float32)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (key, embedding, answer, time.monotonic())
+            self._by_docs.setdefault(key, []).append(entry_id)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evicted += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "expired": self.expired,
+                    "evicted": self.evicted,
+                    "size": len(self._entries)}
@@ -0,0 +1,427 @@
+"""
+index / recall benchmark for the vector store collections.
+
+Ground truth is exact flat search over the stored embeddings. Every index config of
+the sweep (FLAT, IVF_FLAT, IVF_SQ8, IVF_PQ, HNSW with their nlist / nprobe / m / M / ef,
+quantized ones with and without exact rerank) is built on a scratch copy of the
+collection and scored on the same query set by recall@k, single query latency
+percentiles, QPS at several concurrency levels and the memory it keeps loaded.
+Results are written as json, --lock stores the fastest config that reaches the
+recall target in index_config.json under the benchmarked store kind, so a local run
+never changes what app.py and MilvusStore use for Milvus.
+
+usage: python benchmark_index.py publications --queries router_queries.jsonl
+       python benchmark_index.py osdr --store local --sample 500 --lock --min-recall 0.95
+       python benchmark_index.py osdr --store local --vector-dtypes float32 float16 int8
+       python benchmark_index.py osdr --store local --corpus ./data/corpus   # vectors from corpus embeddings
+"""
+from __future__ import annotations
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from vector_store import INDEX_CONFIG_PATH, LocalCollection, connect_to_milvus, load_index_configs, milvus_rerank
+
+RESULTS_DIR = "./data/benchmarks"
+CONCURRENCY = [1, 4, 16]
+NLISTS = [64, 128, 256, 1024]
+NPROBES = [1, 4, 10, 32, 64]
+HNSW_MS = [8, 16, 32]
+HNSW_EF_CONSTRUCTION = 200
+EFS = [16, 32, 64, 128, 256]
+PQ_MS = [16, 48, 96]
+PQ_NBITS = 8
+# candidates per result rescored with full precision vectors on quantized configs
+RERANK_FACTORS = [4]
+QUANTIZED_INDEXES = {"IVF_SQ8", "IVF_PQ"}
+
+
+def load_embeddings(collection_name:str, store_kind:str="milvus", local_dir:str="./data/vector_store",
+                    batch_size:int=1000, corpus_dir:str|None=None) -> tuple[np.ndarray, np.ndarray]:
+    """(primary keys, normalized float32 embeddings) of all live rows of a collection,
+    or (chunk ids, memory-mapped embeddings) of a corpus folder (see corpus.py)"""
+    if corpus_dir:
+        from corpus import CorpusStore
+        corpus = CorpusStore(corpus_dir)
+        vectors = corpus.embeddings(collection_name).array()
+        ids = corpus.live_chunk_ids(collection_name)
+        ids = ids[ids < len(vectors)]
+        # chunks of replaced doc records hold zero vectors, copy only when there are any
+        return ids, vectors if len(ids) == len(vectors) else np.asarray(vectors[ids])
+    if store_kind == "local":
+        collection = LocalCollection(os.path.join(local_dir, collection_name))
+        ids = np.array([i for i in range(collection.count) if i not in collection.deleted], dtype=np.int64)
+        if collection.full_vectors is not None:
+            return ids, np.asarray(collection.full_vectors[ids], dtype=np.float32)
+        return ids, collection.get_vectors(ids)
+
+    from pymilvus import Collection
+    connect_to_milvus()
+    collection = Collection(collection_name)
+    collection.load()
+    ids, vectors = [], []
+    iterator = collection.query_iterator(batch_size=batch_size, output_fields=["embedding"])
+    while True:
+        batch = iterator.next()
+        if not batch:
+            iterator.close()
+            break
+        ids.extend(row["id"] for row in batch)
+        vectors.extend(row["embedding"] for row in batch)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return np.asarray(ids, dtype=np.int64), vectors
+
+
+def load_queries(vectors:np.ndarray, queries_path:str|None=None, sample:int=200, seed:int=0,
+                 cache_path:str|None=None, model_name:str="multi-qa-MiniLM-L6-cos-v1") -> np.ndarray:
+    """
+    Query embeddings of the benchmark, saved to cache_path so later runs replay the same set.
+
+    Args:
+        vectors: Stored embeddings, sampled when there is no queries file
+        queries_path: JSONL file with a "query" text per line
+        sample: Number of stored embeddings to use as queries without a queries file
+        seed: Sampling seed
+        cache_path: .npy file with the query embeddings, loaded if it exists
+        model_name: Model to embed the queries file with, backend from EMBEDDING_BACKEND
+    """
+    if cache_path and os.path.exists(cache_path):
+        return np.load(cache_path)
+    if queries_path:
+        from encoders import load_embedding_model
+        with open(queries_path, "r", encoding="utf-8") as f:
+            texts = [json.loads(line)["query"] for line in f if line.strip()]
+        queries = load_embedding_model(model_name=model_name).encode(texts, normalize_embeddings=True)
+    else:
+        rng = np.random.default_rng(seed)
+        queries = vectors[rng.choice(len(vectors), min(sample, len(vectors)), replace=False)]
+    queries = np.asarray(queries, dtype=np.float32)
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        np.save(cache_path, queries)
+    return queries
+
+
+def ground_truth(ids:np.ndarray, vectors:np.ndarray, queries:np.ndarray, k:int, batch_size:int=256) -> np.ndarray:
+    """exact top k primary keys per query by brute force inner product"""
+    k = min(k, len(vectors))
+    result = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), batch_size):
+        scores = queries[start:start + batch_size] @ vectors.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        result[start:start + batch_size] = ids[np.take_along_axis(top, order, axis=1)]
+    return result
+
+
+def sweep_configs(n_vectors:int, dim:int, k:int, index_types:list[str],
+                  rerank:bool=False) -> list[tuple[dict, list[dict]]]:
+    """
+    (index params, search params to try on that index) of the sweep.
+
+    Args:
+        n_vectors: Number of stored vectors
+        dim: Embedding dimension
+        k: Results per query
+        index_types: Index types to sweep
+        rerank: Add exact rerank variants to every config, not only the quantized indexes
+    """
+    # more lists than ~vectors/39 leaves clusters too small to train on
+    nlists = [n for n in NLISTS if n <= max(n_vectors // 39, NLISTS[0])]
+    configs = []
+    for index_type in index_types:
+        if index_type == "FLAT":
+            configs.append(({"index_type": "FLAT", "metric_type": "COSINE", "params": {}}, [{}]))
+        elif index_type in ("IVF_FLAT", "IVF_SQ8"):
+            for nlist in nlists:
+                configs.append(({"index_type": index_type, "metric_type": "COSINE", "params": {"nlist": nlist}},
+                                [{"nprobe": nprobe} for nprobe in NPROBES if nprobe <= nlist]))
+        elif index_type == "IVF_PQ":
+            # m sub-quantizers must divide the dimension
+            for m in [m for m in PQ_MS if dim % m == 0]:
+                for nlist in nlists:
+                    configs.append(({"index_type": "IVF_PQ", "metric_type": "COSINE",
+                                     "params": {"nlist": nlist, "m": m, "nbits": PQ_NBITS}},
+                                    [{"nprobe": nprobe} for nprobe in NPROBES if nprobe <= nlist]))
+        elif index_type == "HNSW":
+            for m in HNSW_MS:
+                configs.append(({"index_type": "HNSW", "metric_type": "COSINE",
+                                 "params": {"M": m, "efConstruction": HNSW_EF_CONSTRUCTION}},
+                                [{"ef": ef} for ef in EFS if ef >= k]))
+        else:
+            raise ValueError(f"Unknown index type '{index_type}'")
+    for index_params, search_params_list in configs:
+        if rerank or index_params["index_type"] in QUANTIZED_INDEXES:
+            search_params_list += [{**params, "rerank": factor}
+                                   for params in list(search_params_list) for factor in RERANK_FACTORS]
+    return configs
+
+
+def index_memory_bytes(index_params:dict, n_vectors:int, dim:int) -> int:
+    """estimated memory a loaded Milvus index holds for n_vectors float32 vectors"""
+    index_type, params = index_params["index_type"], index_params["params"]
+    if index_type == "FLAT":
+        return n_vectors * dim * 4
+    if index_type == "HNSW":
+        # vectors plus ~2 * M neighbour ids per node on the base layer
+        return n_vectors * (dim * 4 + params["M"] * 2 * 4)
+    centroids = params["nlist"] * dim * 4
+    ids = n_vectors * 8
+    if index_type == "IVF_FLAT":
+        return n_vectors * dim * 4 + ids + centroids
+    if index_type == "IVF_SQ8":
+        return n_vectors * dim + ids + centroids
+    if index_type == "IVF_PQ":
+        codebooks = (2 ** params["nbits"]) * dim * 4
+        return n_vectors * params["m"] * params["nbits"] // 8 + ids + centroids + codebooks
+    raise ValueError(f"Unknown index type '{index_type}'")
+
+
+class MilvusBench:
+    """
+    Scratch Milvus collection holding a copy of the embeddings under their original
+    primary keys, so the served collection is never re-indexed by the benchmark.
+    """
+    index_types = ["FLAT", "IVF_FLAT", "IVF_SQ8", "IVF_PQ", "HNSW"]
+    vector_dtype = "float32"
+
+    def __init__(self, collection_name:str, ids:np.ndarray, vectors:np.ndarray, batch_size:int=1000):
+        from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, utility
+        connect_to_milvus()
+        self.name = f"bench_{collection_name}"
+        self.n_vectors, self.dim = vectors.shape
+        self.index_params = None
+        if utility.has_collection(self.name):
+            utility.drop_collection(self.name)
+        fields = [FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+                  FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=vectors.shape[1])]
+        self.collection = Collection(self.name, CollectionSchema(fields, description="index benchmark copy"))
+        for start in range(0, len(ids), batch_size):
+            self.collection.insert([ids[start:start + batch_size].tolist(),
+                                    vectors[start:start + batch_size].tolist()])
+        self.collection.flush()
+
+    def build(self, index_params:dict):
+        try:
+            self.collection.release()
+            self.collection.drop_index()
+        except Exception:
+            pass
+        self.collection.create_index(field_name="embedding", index_params=index_params)
+        self.collection.load()
+        self.index_params = index_params
+
+    def memory_bytes(self) -> int:
+        return index_memory_bytes(self.index_params, self.n_vectors, self.dim)
+
+    def search(self, query:np.ndarray, k:int, params:dict) -> list[int]:
+        params = dict(params)
+        rerank = params.pop("rerank", 0)
+        results = self.collection.search(data=[query.tolist()],
+                                         anns_field="embedding",
+                                         param={"metric_type": "COSINE", "params": params},
+                                         limit=k * rerank if rerank else k)
+        ids = [hit.id for hit in results[0]]
+        if rerank:
+            return [i for i, _ in milvus_rerank(self.collection, ids, query, k)]
+        return ids
+
+    def close(self):
+        from pymilvus import utility
+        utility.drop_collection(self.name)
+
+
+class LocalBench:
+    """
+    scratch LocalCollection, only FLAT and IVF_FLAT exist in the local store.
+    Compressed dtypes keep the float32 vectors on disk for the rerank variants.
+    """
+    index_types = ["FLAT", "IVF_FLAT"]
+
+    def __init__(self, collection_name:str, ids:np.ndarray, vectors:np.ndarray, vector_dtype:str="float32"):
+        self.folder_path = tempfile.mkdtemp(prefix=f"bench_{collection_name}_")
+        self.collection = LocalCollection(self.folder_path, vectors.shape[1], vector_dtype, keep_full=True)
+        self.collection.insert(vectors, [{} for _ in range(len(vectors))])
+        self.ids = ids
+        self.vector_dtype = vector_dtype
+
+    def build(self, index_params:dict):
+        if index_params["index_type"] == "IVF_FLAT":
+            self.collection.build_ivf(index_params["params"]["nlist"])
+        elif os.path.exists(self.collection.ivf_path):
+            os.remove(self.collection.ivf_path)
+            self.collection._ivf = None
+
+    def memory_bytes(self) -> int:
+        return self.collection.memory_bytes()
+
+    def search(self, query:np.ndarray, k:int, params:dict) -> list[int]:
+        row_ids, _ = self.collection.search(query, k, params.get("nprobe"), rerank=params.get("rerank", 0))
+        return self.ids[row_ids].tolist()
+
+    def close(self):
+        shutil.rmtree(self.folder_path, ignore_errors=True)
+
+
+def recall_at_k(results:list[list[int]], truth:np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(found[:k]) & set(expected)) / k for found, expected in zip(results, truth)]))
+
+
+def measure(bench, queries:np.ndarray, truth:np.ndarray, k:int, params:dict, concurrency:list[int]) -> dict:
+    """recall@k and latency percentiles of sequential queries, then QPS per concurrency level"""
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(bench.search(query, k, params))
+        latencies.append((time.perf_counter() - start) * 1000)
+    qps = {}
+    for workers in concurrency:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            start = time.perf_counter()
+            list(executor.map(lambda query: bench.search(query, k, params), queries))
+            qps[str(workers)] = len(queries) / (time.perf_counter() - start)
+    return {"recall": recall_at_k(results, truth),
+            "latency_ms_p50": float(np.percentile(latencies, 50)),
+            "latency_ms_p95": float(np.percentile(latencies, 95)),
+            "latency_ms_p99": float(np.percentile(latencies, 99)),
+            "qps": qps}
+
+
+def run_benchmark(collection_name:str, bench, ids:np.ndarray, vectors:np.ndarray, queries:np.ndarray,
+                  k:int=5, concurrency:list[int]=CONCURRENCY, index_types:list[str]|None=None) -> dict:
+    """
+    Sweep index configs on a benchmark backend.
+
+    Args:
+        collection_name: Collection the embeddings come from
+        bench: MilvusBench or LocalBench holding the embeddings
+        ids: Primary keys of the embeddings
+        vectors: Normalized embeddings
+        queries: Normalized query embeddings
+        k: Results per query
+        concurrency: Concurrent searchers for the QPS measurements
+        index_types: Subset of bench.index_types to sweep, all of them if None
+
+    Returns:
+        Report with one result per (index params, search params), memory_saved is
+        relative to the float32 vectors and recall_lost to exact search
+    """
+    truth = ground_truth(ids, vectors, queries, k)
+    raw_bytes = vectors.shape[0] * vectors.shape[1] * 4
+    index_types = [t for t in (index_types or bench.index_types) if t in bench.index_types]
+    report = {"collection": collection_name,
+              "backend": type(bench).__name__,
+              "vectors": int(len(vectors)),
+              "dim": int(vectors.shape[1]),
+              "queries": int(len(queries)),
+              "k": k,
+              "results": []}
+    configs = sweep_configs(len(vectors), vectors.shape[1], k, index_types,
+                            rerank=bench.vector_dtype != "float32")
+    for index_params, search_params_list in configs:
+        start = time.perf_counter()
+        bench.build(index_params)
+        build_s = time.perf_counter() - start
+        memory_bytes = bench.memory_bytes()
+        for search_params in search_params_list:
+            result = {"index": index_params,
+                      "search_params": search_params,
+                      "vector_dtype": bench.vector_dtype,
+                      "build_s": build_s,
+                      "memory_bytes": memory_bytes,
+                      "memory_saved": 1 - memory_bytes / raw_bytes,
+                      **measure(bench, queries, truth, k, search_params, concurrency)}
+            result["recall_lost"] = 1 - result["recall"]
+            report["results"].append(result)
+            print(f"{bench.vector_dtype:7} {index_params['index_type']:8} {json.dumps(index_params['params']):40} "
+                  f"{json.dumps(search_params):28} recall@{k}={result['recall']:.3f} "
+                  f"mem={memory_bytes / 2**20:.1f}MiB ({result['memory_saved']:+.0%} saved) "
+                  f"p50={result['latency_ms_p50']:.2f}ms p99={result['latency_ms_p99']:.2f}ms "
+                  f"qps={max(result['qps'].values()):.0f}")
+    return report
+
+
+def best_config(report:dict, min_recall:float=0.95) -> dict | None:
+    """config with the highest QPS at the top concurrency level among those reaching min_recall"""
+    candidates = [r for r in report["results"] if r["recall"] >= min_recall]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda r: (max(r["qps"].values()), r["recall"]))
+
+
+def lock_config(collection_name:str, result:dict, kind:str, path:str=INDEX_CONFIG_PATH):
+    """store index and search params of a benchmark result as the collection's config for
+    stores of this kind ("milvus" or "local"), configs of the other kind are left as they are"""
+    configs = load_index_configs(path)
+    configs.setdefault(kind, {})[collection_name] = {"index": result["index"],
+                                                     "search_params": result["search_params"],
+                                                     "vector_dtype": result["vector_dtype"],
+                                                     "recall": result["recall"],
+                                                     "memory_bytes": result["memory_bytes"],
+                                                     "latency_ms_p95": result["latency_ms_p95"]}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(configs, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="benchmark recall / latency / QPS of vector index configs")
+    parser.add_argument("collection")
+    parser.add_argument("--store", choices=["milvus", "local"], default=os.getenv("VECTOR_STORE", "milvus"))
+    parser.add_argument("--local-dir", default=os.getenv("LOCAL_STORE_DIR", "./data/vector_store"))
+    parser.add_argument("--corpus", default=None, help="read the vectors from this corpus folder instead of the store")
+    parser.add_argument("--queries", default=None, help="jsonl with a 'query' per line, default samples stored vectors")
+    parser.add_argument("--sample", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY)
+    parser.add_argument("--index-types", nargs="+", default=None)
+    parser.add_argument("--vector-dtypes", nargs="+", default=["float32"], choices=["float32", "float16", "int8"],
+                        help="local store only: vector dtypes to sweep")
+    parser.add_argument("--output-dir", default=RESULTS_DIR)
+    parser.add_argument("--min-recall", type=float, default=0.95)
+    parser.add_argument("--lock", action="store_true", help="write the best config to index_config.json")
+    args = parser.parse_args()
+
+    ids, vectors = load_embeddings(args.collection, args.store, args.local_dir, corpus_dir=args.corpus)
+    query_set = os.path.splitext(os.path.basename(args.queries))[0] if args.queries else f"sample{args.sample}_seed{args.seed}"
+    queries = load_queries(vectors, args.queries, args.sample, args.seed,
+                           cache_path=os.path.join(args.output_dir, f"{args.collection}_{query_set}.npy"))
+    print(f"Benchmarking '{args.collection}': {len(vectors)} vectors, {len(queries)} queries")
+
+    report = None
+    for vector_dtype in (args.vector_dtypes if args.store == "local" else ["float32"]):
+        bench = (LocalBench(args.collection, ids, vectors, vector_dtype) if args.store == "local"
+                 else MilvusBench(args.collection, ids, vectors))
+        try:
+            dtype_report = run_benchmark(args.collection, bench, ids, vectors, queries,
+                                         k=args.k, concurrency=args.concurrency, index_types=args.index_types)
+        finally:
+            bench.close()
+        if report is None:
+            report = dtype_report
+        else:
+            report["results"] += dtype_report["results"]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, f"{args.collection}_{args.store}.json")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Wrote {len(report['results'])} results to {output_path}")
+
+    best = best_config(report, args.min_recall)
+    if best is None:
+        print(f"No config reaches recall@{args.k} >= {args.min_recall}")
+    else:
+        print(f"Best config: {best['vector_dtype']} {best['index']} {best['search_params']} recall={best['recall']:.3f}")
+        if args.lock:
+            lock_config(args.collection, best, args.store)
+            print(f"Locked {args.store} config for '{args.collection}' in {INDEX_CONFIG_PATH}")
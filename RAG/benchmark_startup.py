@@ -0,0 +1,129 @@
+"""
+cold start benchmark of the app.
+
+Measures, each in a fresh interpreter, how long importing the RAG modules takes,
+how long the shared resources take to create and to look up again, and with
+streamlit's AppTest how long the first and the following reruns of app.py take.
+
+usage: python benchmark_startup.py
+       python benchmark_startup.py --skip-app --output ./data/benchmarks/startup.json
+"""
+from __future__ import annotations
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+
+RAG_DIR = os.path.dirname(os.path.abspath(__file__))
+MODULES = ["utils", "filters", "prompts", "llm", "conversation", "context_builder", "embedding_cache",
+           "answer_cache", "local_router", "vector_store", "resources", "ingest", "scrap_osdr"]
+
+IMPORT_SCRIPT = """
+import time, json, sys
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"s": elapsed, "selenium": "selenium" in sys.modules, "torch": "torch" in sys.modules}}))
+"""
+
+RESOURCES_SCRIPT = """
+import time, json
+import resources
+report = {}
+for resource in resources.RESOURCES:
+    start = time.perf_counter()
+    try:
+        resource.get()
+    except Exception as e:
+        report[resource.name] = {"error": str(e)}
+        continue
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    resource.get()
+    report[resource.name] = {"first_s": first, "again_s": time.perf_counter() - start}
+start = time.perf_counter()
+health = resources.check_health(max_age=0, block=True)
+report["health_check_s"] = time.perf_counter() - start
+report["health"] = {name: check["ok"] for name, check in health.items()}
+print(json.dumps(report))
+"""
+
+APP_SCRIPT = """
+import time, json
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("app.py", default_timeout={timeout})
+runs = []
+for _ in range({reruns}):
+    start = time.perf_counter()
+    app.run()
+    runs.append(time.perf_counter() - start)
+print(json.dumps({{"runs_s": runs, "exceptions": [str(e.value) for e in app.exception]}}))
+"""
+
+
+def run_script(script:str, timeout:float=600) -> dict:
+    """run a snippet in a fresh interpreter in the RAG folder, returns its json output"""
+    result = subprocess.run([sys.executable, "-c", script], cwd=RAG_DIR, capture_output=True,
+                            text=True, timeout=timeout)
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_times(modules:list[str]=MODULES, repeat:int=3) -> dict:
+    """median cold import time per module, and whether it pulled in selenium / torch"""
+    report = {}
+    for module in modules:
+        runs = [run_script(IMPORT_SCRIPT.format(module=module)) for _ in range(repeat)]
+        if any("error" in run for run in runs):
+            report[module] = {"error": next(run["error"] for run in runs if "error" in run)}
+            print(f"import {module:16} failed: {report[module]['error']}")
+            continue
+        report[module] = {"median_s": float(np.median([run["s"] for run in runs])),
+                          "selenium": runs[0]["selenium"],
+                          "torch": runs[0]["torch"]}
+        print(f"import {module:16} {report[module]['median_s'] * 1000:8.1f}ms "
+              f"selenium={report[module]['selenium']} torch={report[module]['torch']}")
+    return report
+
+
+def resource_times() -> dict:
+    """first creation and cached lookup time of every resource, plus one health check"""
+    report = run_script(RESOURCES_SCRIPT)
+    print(f"resources: {json.dumps(report)}")
+    return report
+
+
+def app_rerun_times(reruns:int=5, timeout:float=300) -> dict:
+    """first run (cold process) and following reruns of app.py in streamlit's AppTest"""
+    report = run_script(APP_SCRIPT.format(reruns=reruns, timeout=timeout), timeout=timeout * reruns)
+    if "runs_s" in report:
+        report["first_s"] = report["runs_s"][0]
+        report["rerun_median_s"] = float(np.median(report["runs_s"][1:])) if len(report["runs_s"]) > 1 else None
+        print(f"app first run {report['first_s']:.2f}s, reruns median {report['rerun_median_s']:.3f}s")
+    else:
+        print(f"app run failed: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="measure import, resource and rerun times of the app")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per import measurement")
+    parser.add_argument("--reruns", type=int, default=5)
+    parser.add_argument("--skip-resources", action="store_true", help="do not load the model / client / store")
+    parser.add_argument("--skip-app", action="store_true", help="do not run app.py")
+    parser.add_argument("--output", default=None, help="write the report as json")
+    args = parser.parse_args()
+
+    report = {"imports": import_times(repeat=args.repeat)}
+    if not args.skip_resources:
+        report["resources"] = resource_times()
+    if not args.skip_app:
+        report["app"] = app_rerun_times(args.reruns)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,324 @@
+"""
+bulk embedding of chunk texts for ingestion.
+
+Chunks whose vector is in the persistent cache (keyed by embedding model and a hash of
+the chunk text) are not encoded again, so re-chunking a corpus or switching the vector
+store only embeds text that changed. The rest are deduplicated, sorted by estimated
+token length and cut into batches under a padded token budget: the model pads every
+batch to its longest chunk, so short chunks batched together waste no compute and get
+bigger batches. Batches are spread over worker processes, each loading its own model
+with a share of the CPU threads.
+
+usage: python bulk_embed.py bench --corpus ./data/corpus --collection publications
+       python bulk_embed.py bench --texts chunks.txt --workers 1 2 4 --limit 5000
+"""
+from __future__ import annotations
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from embedding_cache import DiskEmbeddingStore
+
+BULK_CACHE_DIR = os.getenv("BULK_EMBEDDING_CACHE_DIR", "./data/embedding_cache/chunks")
+# padded tokens per batch (batch size x longest chunk in it) and a cap on chunks per batch
+TOKENS_PER_BATCH = 16384
+MAX_BATCH = 256
+# tokens the model sees at most, longer chunks are truncated
+MAX_SEQ_TOKENS = 512
+# ~4 characters per token, as context_builder.estimate_tokens
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text:str) -> int:
+    """wordpiece tokens of a chunk incl. [CLS] / [SEP], without running the tokenizer"""
+    return min(len(text) // CHARS_PER_TOKEN + 2, MAX_SEQ_TOKENS)
+
+
+def text_key(text:str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def plan_batches(lengths, tokens_per_batch:int=TOKENS_PER_BATCH, max_batch:int=MAX_BATCH,
+                 sort:bool=True) -> list[np.ndarray]:
+    """
+    Cut texts into batches whose padded size stays under the token budget.
+
+    Args:
+        lengths: Estimated tokens per text
+        tokens_per_batch: Budget of batch size x longest text in the batch
+        max_batch: Most texts in one batch
+        sort: Order texts by length first, otherwise batches follow the input order
+
+    Returns:
+        Index arrays into lengths, one per batch
+    """
+    lengths = np.asarray(lengths)
+    order = np.argsort(lengths, kind="stable") if sort else np.arange(len(lengths))
+    batches, start, longest = [], 0, 0
+    for end, i in enumerate(order):
+        longest = max(longest, int(lengths[i]))
+        if end > start and ((end - start + 1) * longest > tokens_per_batch or end - start >= max_batch):
+            batches.append(order[start:end])
+            start, longest = end, int(lengths[i])
+    if start < len(order):
+        batches.append(order[start:])
+    return batches
+
+
+def padding_efficiency(lengths, batches:list[np.ndarray]) -> float:
+    """share of the padded tokens that are real tokens, 1.0 means no padding"""
+    lengths = np.asarray(lengths)
+    padded = sum(len(batch) * int(lengths[batch].max()) for batch in batches)
+    return float(lengths.sum() / padded) if padded else 1.0
+
+
+_worker_model = None
+
+
+def _init_worker(load_model, threads:int|None):
+    """load the model once per worker process"""
+    global _worker_model
+    if threads:
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+    _worker_model = load_model()
+
+
+def _encode_batch(texts:list[str], model=None) -> np.ndarray:
+    model = _worker_model if model is None else model
+    return np.asarray(model.encode(texts, normalize_embeddings=True, batch_size=len(texts)), dtype=np.float32)
+
+
+def _worker_dim() -> int:
+    return _worker_model.get_sentence_embedding_dimension()
+
+
+class BulkEmbedder:
+    """
+    Embedding model for bulk ingestion with length bucketing, worker processes and a
+    persistent chunk cache. Has the encode / get_sentence_embedding_dimension surface of
+    SentenceTransformer, so ingest.ingest and corpus.embed_corpus take it as the model.
+
+    Args:
+        model_name: Embedding model id, names the cache files (encoders.embedding_model_id)
+        load_model: Picklable callable returning the model, called once per worker
+        workers: Worker processes, 1 encodes in this process
+        threads: CPU threads per worker, cores / workers if None
+        tokens_per_batch: Padded token budget per batch
+        max_batch: Most chunks per batch
+        cache_dir: Folder of the chunk cache, None disables it
+        sort: Bucket chunks by length, off only to compare in bench
+    """
+
+    def __init__(self, model_name:str, load_model, workers:int=1, threads:int|None=None,
+                 tokens_per_batch:int=TOKENS_PER_BATCH, max_batch:int=MAX_BATCH,
+                 cache_dir:str|None=BULK_CACHE_DIR, sort:bool=True):
+        self.model_name = model_name
+        self.workers = max(1, workers)
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.tokens_per_batch = tokens_per_batch
+        self.max_batch = max_batch
+        self.sort = sort
+        self.cache_dir = cache_dir
+        self.cache = None
+        self.totals = {"chunks": 0, "cached": 0, "encoded": 0, "seconds": 0.0}
+        self.last = {}
+        self._model = None
+        self._executor = None
+        if self.workers == 1:
+            self._model = load_model()
+            self.dim = self._model.get_sentence_embedding_dimension()
+        else:
+            self._executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                 initargs=(load_model, self.threads))
+            self.dim = self._executor.submit(_worker_dim).result()
+        if cache_dir:
+            self.cache = DiskEmbeddingStore(cache_dir, model_name, self.dim)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _run(self, batches:list[list[str]]):
+        """encoded batches in order, at most two batches queued per worker"""
+        if self._executor is None:
+            for texts in batches:
+                yield _encode_batch(texts, self._model)
+            return
+        from ingest import bounded_map
+        yield from bounded_map(self._executor, _encode_batch, ((texts,) for texts in batches), 2 * self.workers)
+
+    def encode(self, sentences, normalize_embeddings:bool=True, batch_size:int|None=None, **kwargs) -> np.ndarray:
+        """
+        Embed chunk texts, vectors come back in input order.
+
+        Args:
+            sentences: Text or list of texts
+            normalize_embeddings: Vectors are always unit length, kept for the SentenceTransformer signature
+            batch_size: Ignored, batches are sized by tokens_per_batch
+
+        Returns:
+            float32 array of shape (len(sentences), dim), or (dim,) for a single text
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        start = time.perf_counter()
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+
+        # identical chunks (boilerplate, repeated protocols) are looked up and encoded once
+        keys = [text_key(text) for text in texts]
+        unique = {}
+        for i, key in enumerate(keys):
+            unique.setdefault(key, i)
+        unique_keys = list(unique)
+        cached = 0
+        if self.cache is not None and unique_keys:
+            positions, found = self.cache.get_many(unique_keys)
+            cached = len(positions)
+            hits = {unique_keys[p]: vector for p, vector in zip(positions, found)}
+            unique_keys = [key for key in unique_keys if key not in hits]
+        else:
+            hits = {}
+
+        todo = [texts[unique[key]] for key in unique_keys]
+        lengths = [estimate_tokens(text) for text in todo]
+        batches = plan_batches(lengths, self.tokens_per_batch, self.max_batch, self.sort)
+        new = {}
+        for batch, encoded in zip(batches, self._run([[todo[i] for i in batch] for batch in batches])):
+            for i, vector in zip(batch, encoded):
+                new[unique_keys[i]] = vector
+        if self.cache is not None and new:
+            self.cache.put_many(list(new), np.stack(list(new.values())))
+
+        for i, key in enumerate(keys):
+            vector = new.get(key)
+            vectors[i] = vector if vector is not None else hits[key]
+
+        seconds = time.perf_counter() - start
+        self.last = {"chunks": len(texts), "unique": len(unique), "cached": cached, "encoded": len(todo),
+                     "batches": len(batches), "padding_efficiency": round(padding_efficiency(lengths, batches), 3),
+                     "seconds": round(seconds, 3), "chunks_per_s": round(len(texts) / seconds, 1) if seconds else 0.0}
+        for name in self.totals:
+            self.totals[name] += self.last[name]
+        return vectors[0] if single else vectors
+
+    def stats(self) -> dict:
+        seconds = self.totals["seconds"]
+        return {**self.totals, "seconds": round(seconds, 3),
+                "chunks_per_s": round(self.totals["chunks"] / seconds, 1) if seconds else 0.0,
+                "workers": self.workers, "threads": self.threads,
+                "cache_size": len(self.cache) if self.cache is not None else 0}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def bulk_embedder(backend:str|None=None, workers:int=1, threads:int|None=None,
+                  cache_dir:str|None=BULK_CACHE_DIR, **kwargs) -> BulkEmbedder:
+    """BulkEmbedder of the app's embedding model on the selected backend"""
+    from encoders import embedding_model_id, load_embedding_model
+    from ingest import EMBEDDING_MODEL_NAME
+    threads = threads or max(1, (os.cpu_count() or 1) // max(1, workers))
+    load_model = partial(load_embedding_model, backend, EMBEDDING_MODEL_NAME, threads=threads)
+    return BulkEmbedder(embedding_model_id(backend, EMBEDDING_MODEL_NAME), load_model, workers, threads,
+                        cache_dir=cache_dir, **kwargs)
+
+
+def load_texts(corpus_dir:str|None=None, collection_name:str="publications", texts_path:str|None=None,
+               limit:int|None=None) -> list[str]:
+    """chunk texts of a corpus collection, or the lines of a text file"""
+    texts = []
+    if texts_path:
+        with open(texts_path, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        from corpus import CorpusStore
+        from ingest import COLLECTIONS
+        text_field = COLLECTIONS[collection_name][2]
+        for _, row in CorpusStore(corpus_dir).iter_chunks(collection_name):
+            texts.append(row[text_field])
+            if limit and len(texts) >= limit:
+                break
+    return texts[:limit] if limit else texts
+
+
+def bench(texts:list[str], make_embedder, workers:list[int], threads:int|None=None) -> list[dict]:
+    """
+    chunks/s per configuration: every worker count sorted and unsorted with a cold cache,
+    then the best configuration again on its warm cache.
+
+    Args:
+        texts: Chunk texts
+        make_embedder: Callable (workers, threads, cache_dir, sort) -> BulkEmbedder
+        workers: Worker counts to try
+        threads: Threads per worker, cores / workers if None
+    """
+    results = []
+    best = None
+    for n_workers in workers:
+        for sort in (True, False):
+            cache_dir = tempfile.mkdtemp(prefix="bulk_embed_")
+            with make_embedder(n_workers, threads, cache_dir, sort) as embedder:
+                embedder.encode(texts)
+                result = {"workers": n_workers, "threads": embedder.threads, "sorted": sort, "cache": "cold",
+                          **embedder.last}
+            results.append(result)
+            print(result)
+            if best is None or result["chunks_per_s"] > best[0]["chunks_per_s"]:
+                if best is not None:
+                    shutil.rmtree(best[1], ignore_errors=True)
+                best = (result, cache_dir)
+            else:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+    if best is not None:
+        result, cache_dir = best
+        with make_embedder(result["workers"], threads, cache_dir, result["sorted"]) as embedder:
+            embedder.encode(texts)
+            warm = {"workers": result["workers"], "threads": embedder.threads, "sorted": result["sorted"],
+                    "cache": "warm", **embedder.last}
+        results.append(warm)
+        print(warm)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from corpus import CORPUS_DIR
+
+    parser = argparse.ArgumentParser(description="bulk chunk embedding")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench_parser = commands.add_parser("bench", help="chunks/s per worker count, bucketing and cache state")
+    bench_parser.add_argument("--corpus", default=CORPUS_DIR)
+    bench_parser.add_argument("--collection", default="publications")
+    bench_parser.add_argument("--texts", default=None, help="text file with one chunk per line instead of the corpus")
+    bench_parser.add_argument("--limit", type=int, default=2000)
+    bench_parser.add_argument("--backend", choices=["torch", "onnx"], default=os.getenv("EMBEDDING_BACKEND", "torch"))
+    bench_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    bench_parser.add_argument("--threads", type=int, default=None, help="threads per worker, cores / workers by default")
+    bench_parser.add_argument("--tokens-per-batch", type=int, default=TOKENS_PER_BATCH)
+    bench_parser.add_argument("--output", default=None, help="write the results as json")
+    args = parser.parse_args()
+
+    texts = load_texts(args.corpus, args.collection, args.texts, args.limit)
+    print(f"{len(texts)} chunks, {sum(estimate_tokens(text) for text in texts)} estimated tokens")
+
+    def make_embedder(workers, threads, cache_dir, sort):
+        return bulk_embedder(args.backend, workers, threads, cache_dir=cache_dir, sort=sort,
+                             tokens_per_batch=args.tokens_per_batch)
+
+    results = bench(texts, make_embedder, args.workers, args.threads)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,158 @@
+"""
+context assembly between run_search and the answer prompt.
+
+Hits are grouped per PMC article / OSDR study so metadata is written once, adjacent
+chunks of the same text are stitched back together without their chunk overlap,
+near duplicate passages are dropped and the rest is packed, best scoring first,
+into a token budget.
+"""
+from __future__ import annotations
+import re
+from ingest import CHUNK_OVERLAP
+
+CONTEXT_TOKEN_BUDGET = 3000
+# shortest suffix/prefix match that counts as chunk overlap
+MIN_OVERLAP = 20
+# share of a passage's word shingles found in a kept passage that makes it a duplicate
+DUPLICATE_THRESHOLD = 0.8
+SHINGLE_SIZE = 5
+MAX_AUTHORS = 3
+
+
+def estimate_tokens(text:str) -> int:
+    """~4 characters per token, close enough for English text with Gemini tokenizers"""
+    return len(text) // 4 + 1
+
+
+def merge_overlap(first:str, second:str, max_overlap:int=CHUNK_OVERLAP) -> str | None:
+    """first + second without the text they share at the boundary, None if they do not overlap"""
+    first, second = first.rstrip(), second.lstrip()
+    for length in range(min(len(first), len(second), max_overlap), MIN_OVERLAP - 1, -1):
+        if first.endswith(second[:length]):
+            return first + second[length:]
+    return None
+
+
+def shingles(text:str) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def short_authors(authors:str|None) -> str:
+    names = [name.strip() for name in str(authors or "").split(",") if name.strip()]
+    if len(names) > MAX_AUTHORS:
+        return ", ".join(names[:MAX_AUTHORS]) + " et al."
+    return ", ".join(names)
+
+
+def source_of(doc:dict) -> tuple[str, str]:
+    """(source key, header line) of the article or study a hit belongs to"""
+    if doc.get("PMC_code"):
+        fields = [doc.get("name"), short_authors(doc.get("authors")), doc.get("date"), doc.get("doi")]
+        header = f"[Publication {doc['PMC_code']}] " + " | ".join(str(f) for f in fields if f and f != "None")
+        return f"publication:{doc['PMC_code']}", header
+    fields = [doc.get("name"), doc.get("organisms"), short_authors(doc.get("authors")), doc.get("doi"), doc.get("link")]
+    header = f"[OSDR study {doc.get('study_id')}] " + " | ".join(str(f) for f in fields if f and f != "None")
+    return f"osdr:{doc.get('study_id')}", header
+
+
+def text_of(doc:dict) -> str:
+    return doc.get("content") or doc.get("text") or ""
+
+
+def stitch(hits:list[dict]) -> list[dict]:
+    """
+    Merge chunks of one source whose texts overlap. Chunks of a doc are inserted in
+    order, so sorting by primary key restores the document order of each record.
+
+    Returns:
+        Passages with "text", "label" (osdr protocol), "score" (best chunk score) and "order"
+    """
+    records = {}
+    for doc in sorted(hits, key=lambda doc: doc.get("id") or 0):
+        label = doc.get("protocol_name") or (doc.get("type") if doc.get("type") not in (None, "description") else "")
+        records.setdefault(label, []).append(doc)
+
+    passages = []
+    for label, docs in records.items():
+        current = None
+        for doc in docs:
+            text = text_of(doc).strip()
+            if current is not None:
+                merged = merge_overlap(current["text"], text)
+                if merged is not None:
+                    current["text"] = merged
+                    current["score"] = max(current["score"], doc["score"])
+                    continue
+            current = {"text": text, "label": label, "score": doc["score"], "order": len(passages)}
+            passages.append(current)
+    return passages
+
+
+def build_context(docs:list[dict]|None, token_budget:int=CONTEXT_TOKEN_BUDGET,
+                  count_tokens=estimate_tokens) -> tuple[str | None, dict]:
+    """
+    Turn merged search hits into a compact context block for the answer prompt.
+
+    Args:
+        docs: Formatted hits from run_search
+        token_budget: Maximum tokens of the returned context
+        count_tokens: Callable text -> token count
+
+    Returns:
+        (context text or None if there are no docs, stats with hit, passage and token counts)
+    """
+    if not docs:
+        return None, {"hits": 0}
+
+    groups = {}
+    for doc in docs:
+        key, header = source_of(doc)
+        group = groups.setdefault(key, {"header": header, "hits": [], "score": doc["score"]})
+        group["hits"].append(doc)
+        group["score"] = max(group["score"], doc["score"])
+
+    candidates = []
+    for key, group in groups.items():
+        for passage in stitch(group["hits"]):
+            candidates.append((key, passage))
+
+    # best passages first, so duplicates and budget cuts drop the weaker copy
+    candidates.sort(key=lambda item: item[1]["score"], reverse=True)
+    kept_shingles = []
+    selected = {}
+    used_tokens = 0
+    duplicates = 0
+    for key, passage in candidates:
+        passage_shingles = shingles(passage["text"])
+        if any(len(passage_shingles & other) >= DUPLICATE_THRESHOLD * len(passage_shingles)
+               for other in kept_shingles):
+            duplicates += 1
+            continue
+        tokens = count_tokens(passage["text"])
+        if key not in selected:
+            tokens += count_tokens(groups[key]["header"])
+        if used_tokens + tokens > token_budget:
+            continue
+        used_tokens += tokens
+        kept_shingles.append(passage_shingles)
+        selected.setdefault(key, []).append(passage)
+
+    blocks = []
+    for key in sorted(selected, key=lambda key: groups[key]["score"], reverse=True):
+        lines = [groups[key]["header"]]
+        for passage in sorted(selected[key], key=lambda passage: passage["order"]):
+            prefix = f"({passage['label']}) " if passage["label"] else ""
+            lines.append(prefix + passage["text"])
+        blocks.append("\n".join(lines))
+
+    stats = {"hits": len(docs),
+             "sources": len(selected),
+             "passages": sum(len(passages) for passages in selected.values()),
+             "duplicates": duplicates,
+             "dropped_for_budget": len(candidates) - duplicates - sum(len(p) for p in selected.values()),
+             "raw_tokens": count_tokens(str(docs)),
+             "tokens": used_tokens}
+    return "\n\n".join(blocks), stats
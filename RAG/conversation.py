@@ -0,0 +1,109 @@
+"""chat state kept in the streamlit session: gemini contents built once, bounded windows and a rolling summary"""
+from __future__ import annotations
+from llm import types
+
+# messages served to the router and the reformulator
+ROUTER_WINDOW = 4
+# recent messages sent verbatim with the answer call, older ones are folded into the summary
+MAX_RECENT_MESSAGES = 12
+# messages kept verbatim after a fold
+KEEP_RECENT_MESSAGES = 6
+# fallback summary when the summarizer fails
+MAX_SUMMARY_CHARS = 2000
+FALLBACK_SNIPPET_CHARS = 200
+
+
+def to_content(msg:dict) -> types.Content:
+    return types.Content(role=msg["role"], parts=[types.Part.from_text(text=msg["content"])])
+
+
+class Conversation:
+    """
+    Messages of one chat session. Each message is converted to a gemini Content once
+    when it is appended, windows are cached until the next append, and turns older
+    than the recent messages are folded into a rolling summary by fold().
+
+    Args:
+        max_recent: Verbatim messages before fold() summarizes older ones
+        keep_recent: Verbatim messages left after a fold, at least 1
+    """
+
+    def __init__(self, max_recent:int=MAX_RECENT_MESSAGES, keep_recent:int=KEEP_RECENT_MESSAGES):
+        if keep_recent < 1:
+            # the verbatim part starts at a user message, fold() needs one to keep
+            raise ValueError(f"keep_recent must be at least 1, got {keep_recent}")
+        self.max_recent = max_recent
+        self.keep_recent = keep_recent
+        # every message for display, {"role", "content"} like the old chat_history
+        self.messages = []
+        self.contents = []
+        self.summary = None
+        # index of the first message not folded into the summary
+        self.start = 0
+        self._windows = {}
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def append(self, role:str, content:str):
+        msg = {"role": role, "content": content}
+        self.messages.append(msg)
+        self.contents.append(to_content(msg))
+        self._windows.clear()
+
+    @property
+    def last_message(self) -> str:
+        return self.messages[-1]["content"]
+
+    def window(self, n:int=ROUTER_WINDOW) -> list[types.Content]:
+        """last n messages as gemini contents"""
+        if n not in self._windows:
+            self._windows[n] = self.contents[max(self.start, len(self.contents) - n):]
+        return self._windows[n]
+
+    def user_text(self, n:int=ROUTER_WINDOW) -> str:
+        """user messages among the last n joined, so follow-ups like "and in mice?" keep their topic"""
+        messages = self.messages[max(self.start, len(self.messages) - n):]
+        return "\n".join(msg["content"] for msg in messages if msg["role"] == "user")
+
+    def recent(self) -> list[types.Content]:
+        """messages that are not summarized yet, for the answer call"""
+        return self.window(len(self.contents) - self.start)
+
+    def fold(self, summarize=None) -> bool:
+        """
+        Fold messages older than keep_recent into the summary once there are more than max_recent.
+
+        Args:
+            summarize: Callable (previous summary or None, messages to fold) -> new summary,
+                a truncated transcript is used if None or if it fails
+
+        Returns:
+            True if messages were folded
+        """
+        if len(self.messages) - self.start <= self.max_recent:
+            return False
+        end = len(self.messages) - self.keep_recent
+        # start the verbatim part at a user message so roles keep alternating
+        while end > self.start and self.messages[end]["role"] != "user":
+            end -= 1
+        if end <= self.start:
+            return False
+        folded = self.messages[self.start:end]
+        summary = None
+        if summarize is not None:
+            try:
+                summary = summarize(self.summary, folded)
+            except Exception as e:
+                print(f"Summarizing {len(folded)} messages failed: {e}")
+        if not summary:
+            lines = [f"{msg['role']}: {msg['content'][:FALLBACK_SNIPPET_CHARS]}" for msg in folded]
+            summary = "\n".join(([self.summary] if self.summary else []) + lines)[-MAX_SUMMARY_CHARS:]
+        self.summary = summary
+        self.start = end
+        self._windows.clear()
+        return True
+
+
+def transcript(messages:list[dict]) -> str:
+    return "\n".join(f"{'assistant' if msg['role'] == 'model' else msg['role']}: {msg['content']}" for msg in messages)
@@ -0,0 +1,523 @@
+"""
+columnar corpus store: docs, chunks and chunk embeddings of each collection.
+
+Layout of a corpus folder, per collection:
+    <collection>/docs/shard-00000.jsonl        {"key", "doc"} per line, last record of a key wins
+    <collection>/chunks/shard-00000.jsonl      {"doc", "src", "i", **row} per line, chunk id = line number over all shards
+    <collection>/embeddings.f32 (+ .json)      float32 rows aligned with chunk ids, memory-mapped
+
+Every file is append-only and compact, shards roll over after SHARD_ROWS rows, and
+everything is read as a stream: docs and chunks line by line, embeddings as zero-copy
+memmap slices. A torn last line or vector of an interrupted write is cut off when the
+file is opened for appending again. Chunks keep the row of the doc record they were cut
+from ("src"): a doc imported again is chunked again, and chunks of a replaced record
+are skipped by embed and removed from the vector store by reindex. Scrapers write docs here instead of one pretty
+printed json file per doc (--corpus), ingest.py and sync.py read docs from a corpus
+folder like from a json folder, and `reindex` fills a vector store from stored
+chunks and embeddings without the model.
+
+usage: python corpus.py import publications ./data/publications_raw
+       python corpus.py chunk publications --workers 4
+       python corpus.py embed publications --backend onnx
+       python corpus.py reindex publications --store local --rebuild
+       python corpus.py stats
+"""
+from __future__ import annotations
+import json
+import os
+import threading
+from typing import Iterator
+import numpy as np
+
+CORPUS_DIR = os.getenv("CORPUS_DIR", "./data/corpus")
+SHARD_ROWS = 20000
+READ_BATCH_SIZE = 1024
+
+_decoder = json.JSONDecoder()
+
+
+def leading_values(line:str, n:int=1) -> list:
+    """values of the first n keys of a json object line, without parsing the rest of it"""
+    values, end = [], 0
+    for _ in range(n):
+        start = line.index(":", end) + 1
+        while line[start] == " ":
+            start += 1
+        value, end = _decoder.raw_decode(line, start)
+        values.append(value)
+    return values
+
+
+def leading_value(line:str):
+    return leading_values(line)[0]
+
+
+class ShardedJsonl:
+    """
+    Append-only rows split over shard-NNNNN.jsonl files in a folder, addressed by row number.
+    Appends from several threads are serialized, one process may write at a time.
+
+    Args:
+        folder_path: Folder of the shards
+        shard_rows: Rows per shard before a new one is started
+    """
+
+    def __init__(self, folder_path:str, shard_rows:int=SHARD_ROWS):
+        self.folder_path = folder_path
+        self.shard_rows = shard_rows
+        self._lock = threading.Lock()
+        self._counts = None
+
+    def shards(self) -> list[str]:
+        if not os.path.isdir(self.folder_path):
+            return []
+        return [os.path.join(self.folder_path, name) for name in sorted(os.listdir(self.folder_path))
+                if name.startswith("shard-") and name.endswith(".jsonl")]
+
+    @staticmethod
+    def _count_lines(path:str) -> int:
+        lines = 0
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                lines += block.count(b"\n")
+        return lines
+
+    def counts(self) -> list[int]:
+        """rows per shard, a torn last line is not counted"""
+        if self._counts is None:
+            self._counts = [self._count_lines(path) for path in self.shards()]
+        return self._counts
+
+    def __len__(self) -> int:
+        return sum(self.counts())
+
+    def _repair(self, path:str):
+        """cut a torn last line left by an interrupted append"""
+        with open(path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            data_start = max(0, size - (1 << 20))
+            f.seek(data_start)
+            tail = f.read()
+            newline = tail.rfind(b"\n")
+            f.truncate(data_start + newline + 1 if newline >= 0 else 0)
+
+    def append(self, rows:list[dict]) -> int:
+        """append rows, returns the row number of the first one"""
+        with self._lock:
+            os.makedirs(self.folder_path, exist_ok=True)
+            counts = self.counts()
+            first = sum(counts)
+            if counts:
+                self._repair(self.shards()[-1])
+            i = 0
+            while i < len(rows):
+                if not counts or counts[-1] >= self.shard_rows:
+                    counts.append(0)
+                path = os.path.join(self.folder_path, f"shard-{len(counts) - 1:05d}.jsonl")
+                n = min(self.shard_rows - counts[-1], len(rows) - i)
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows[i:i + n]))
+                counts[-1] += n
+                i += n
+            return first
+
+    def iter_lines(self, start:int=0) -> Iterator[tuple[int, str]]:
+        """(row number, raw json line) from row start on, whole shards before it are skipped unread"""
+        row = 0
+        for path, count in zip(self.shards(), self.counts()):
+            if row + count <= start:
+                row += count
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break
+                    if row >= start:
+                        yield row, line
+                    row += 1
+
+    def __iter__(self) -> Iterator[dict]:
+        for _, line in self.iter_lines():
+            yield json.loads(line)
+
+
+class EmbeddingColumn:
+    """
+    float32 vectors in one append-only raw file, row i belongs to chunk id i.
+
+    Args:
+        path: Vector file, the dim and model are kept in <path>.json
+        dim: Vector dimension, read from the json file if it exists
+        model_name: Embedding model id, appending vectors of another model raises
+    """
+
+    def __init__(self, path:str, dim:int|None=None, model_name:str|None=None):
+        self.path = path
+        self.meta_path = path + ".json"
+        self.dim = dim
+        self.model_name = model_name
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if model_name and meta["model"] != model_name:
+                raise ValueError(f"{path} holds embeddings of {meta['model']}, not {model_name}")
+            self.dim, self.model_name = meta["dim"], meta["model"]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        if self.dim is None or not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // (self.dim * 4)
+
+    def append(self, vectors:np.ndarray) -> int:
+        """append normalized vectors, returns the row of the first one"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            if not os.path.exists(self.meta_path):
+                self.dim = vectors.shape[1]
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim, "model": self.model_name}, f)
+            first = len(self)
+            with open(self.path, "ab") as f:
+                # cut a torn vector of an interrupted append
+                f.truncate(first * self.dim * 4)
+                f.write(vectors.tobytes())
+            return first
+
+    def array(self) -> np.ndarray:
+        """read-only (rows, dim) memmap, empty if nothing is stored"""
+        n = len(self)
+        if n == 0:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(self.path, dtype=np.float32, mode="r", shape=(n, self.dim))
+
+
+def is_live(source:list, latest:dict) -> bool:
+    """whether a chunk with (doc key, src row) was cut from the latest record of its doc"""
+    return latest.get(source[0]) == source[1]
+
+
+class CorpusStore:
+    """
+    Docs, chunks and embeddings of the collections in a corpus folder.
+
+    Args:
+        folder_path: Corpus folder
+        shard_rows: Rows per doc / chunk shard
+    """
+
+    def __init__(self, folder_path:str=CORPUS_DIR, shard_rows:int=SHARD_ROWS):
+        self.folder_path = folder_path
+        self.shard_rows = shard_rows
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_corpus(folder_path:str, collection_name:str) -> bool:
+        return os.path.isdir(os.path.join(folder_path, collection_name, "docs"))
+
+    def collections(self) -> list[str]:
+        if not os.path.isdir(self.folder_path):
+            return []
+        return sorted(name for name in os.listdir(self.folder_path)
+                      if os.path.isdir(os.path.join(self.folder_path, name)))
+
+    def _table(self, collection_name:str, kind:str) -> ShardedJsonl:
+        with self._lock:
+            key = (collection_name, kind)
+            if key not in self._tables:
+                self._tables[key] = ShardedJsonl(os.path.join(self.folder_path, collection_name, kind),
+                                                 self.shard_rows)
+            return self._tables[key]
+
+    def docs(self, collection_name:str) -> ShardedJsonl:
+        return self._table(collection_name, "docs")
+
+    def chunks(self, collection_name:str) -> ShardedJsonl:
+        return self._table(collection_name, "chunks")
+
+    def embeddings(self, collection_name:str, model_name:str|None=None) -> EmbeddingColumn:
+        return EmbeddingColumn(os.path.join(self.folder_path, collection_name, "embeddings.f32"),
+                               model_name=model_name)
+
+    def add_docs(self, collection_name:str, docs:list[tuple[str, dict]]) -> int:
+        """append (key, doc) pairs, a key added again replaces the earlier doc for readers"""
+        return self.docs(collection_name).append([{"key": key, "doc": doc} for key, doc in docs])
+
+    def latest_doc_rows(self, collection_name:str) -> dict[str, int]:
+        """doc key -> row of its last record, one pass over the keys"""
+        return {leading_value(line): row for row, line in self.docs(collection_name).iter_lines()}
+
+    def iter_doc_records(self, collection_name:str, latest:bool=True) -> Iterator[tuple[int, str, dict]]:
+        """
+        Stream (record row, key, doc) in append order.
+
+        Args:
+            collection_name: Collection of the docs
+            latest: Skip records replaced by a later one with the same key, costs one pass over the keys
+        """
+        last = self.latest_doc_rows(collection_name) if latest else None
+        for row, line in self.docs(collection_name).iter_lines():
+            if last is not None and last[leading_value(line)] != row:
+                continue
+            record = json.loads(line)
+            yield row, record["key"], record["doc"]
+
+    def iter_docs(self, collection_name:str, latest:bool=True) -> Iterator[tuple[str, dict]]:
+        """(key, doc) pairs in append order, see iter_doc_records"""
+        for _, key, doc in self.iter_doc_records(collection_name, latest):
+            yield key, doc
+
+    def chunked_docs(self, collection_name:str) -> dict[str, int]:
+        """doc key -> row of the doc record its latest chunks were cut from"""
+        return dict(leading_values(line, 2) for _, line in self.chunks(collection_name).iter_lines())
+
+    def live_chunk_ids(self, collection_name:str) -> np.ndarray:
+        """chunk ids cut from the latest record of their doc"""
+        latest = self.latest_doc_rows(collection_name)
+        return np.array([chunk_id for chunk_id, line in self.chunks(collection_name).iter_lines()
+                         if is_live(leading_values(line, 2), latest)], dtype=np.int64)
+
+    def iter_chunks(self, collection_name:str, start:int=0) -> Iterator[tuple[int, dict]]:
+        """(chunk id, chunk row with "doc" and "i") from chunk id start on"""
+        for row, line in self.chunks(collection_name).iter_lines(start):
+            yield row, json.loads(line)
+
+    def iter_embedded(self, collection_name:str, batch_size:int=READ_BATCH_SIZE,
+                      start:int=0) -> Iterator[tuple[int, list[dict], np.ndarray]]:
+        """(first chunk id, chunk rows, their embeddings as a memmap slice) of the embedded chunks"""
+        vectors = self.embeddings(collection_name).array()
+        rows = []
+        first = start
+        for chunk_id, row in self.iter_chunks(collection_name, start):
+            if chunk_id >= len(vectors):
+                break
+            rows.append(row)
+            if len(rows) == batch_size:
+                yield first, rows, vectors[first:first + len(rows)]
+                first += len(rows)
+                rows = []
+        if rows:
+            yield first, rows, vectors[first:first + len(rows)]
+
+
+def import_json_folder(corpus:CorpusStore, collection_name:str, folder_path:str, batch_size:int=500) -> int:
+    """append every json doc of a scraped folder to the corpus, returns the number of docs"""
+    from ingest import iter_batches, read_docs
+    total = 0
+    for batch in iter_batches(read_docs(folder_path), batch_size):
+        corpus.add_docs(collection_name, batch)
+        total += len(batch)
+    print(f"Imported {total} docs into '{collection_name}' of {corpus.folder_path}")
+    return total
+
+
+def chunk_corpus(corpus:CorpusStore, collection_name:str, workers:int=os.cpu_count() or 1,
+                 batch_size:int=1000) -> int:
+    """chunk docs whose latest record has no chunks yet (process pool), returns the number of new chunks"""
+    from concurrent.futures import ProcessPoolExecutor
+    from ingest import bounded_map, chunk_doc
+    done = corpus.chunked_docs(collection_name)
+    sources = {}
+
+    def new_docs():
+        for row, key, doc in corpus.iter_doc_records(collection_name):
+            if done.get(key) != row:
+                sources[key] = row
+                yield key, doc
+
+    total, pending = 0, []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for key, chunks in bounded_map(executor, chunk_doc, new_docs(), workers * 4, collection_name):
+            # "doc" and "src" first, so chunked_docs reads them without parsing the row
+            src = sources.pop(key)
+            pending.extend({"doc": key, "src": src, "i": i, **chunk} for i, chunk in enumerate(chunks))
+            if len(pending) >= batch_size:
+                corpus.chunks(collection_name).append(pending)
+                total += len(pending)
+                pending = []
+    if pending:
+        corpus.chunks(collection_name).append(pending)
+        total += len(pending)
+    print(f"Added {total} chunks to '{collection_name}'")
+    return total
+
+
+def embed_corpus(corpus:CorpusStore, collection_name:str, model, model_name:str,
+                 batch_size:int=256) -> int:
+    """
+    embed chunks past the last stored embedding, resumes where an interrupted run stopped.
+    Chunks of a replaced doc record get a zero vector, which keeps the column aligned with chunk ids.
+    """
+    from ingest import COLLECTIONS, iter_batches
+    column = corpus.embeddings(collection_name, model_name)
+    text_field = COLLECTIONS[collection_name][2]
+    latest = corpus.latest_doc_rows(collection_name)
+    dim = model.get_sentence_embedding_dimension()
+    total = 0
+    for batch in iter_batches(corpus.iter_chunks(collection_name, len(column)), batch_size):
+        live = [j for j, (_, row) in enumerate(batch) if is_live([row["doc"], row["src"]], latest)]
+        vectors = np.zeros((len(batch), dim), dtype=np.float32)
+        if live:
+            vectors[live] = model.encode([batch[j][1][text_field] for j in live], normalize_embeddings=True,
+                                         batch_size=batch_size)
+        column.append(vectors)
+        total += len(live)
+        print(f"Embedded {len(column)} chunks of '{collection_name}'")
+    return total
+
+
+def reindex(corpus:CorpusStore, collection_name:str, store, batch_size:int=1000, rebuild:bool=False,
+            checkpoint_path:str|None=None) -> int:
+    """
+    Insert stored chunks with their stored embeddings into a vector store, no model needed.
+    Chunks of replaced doc records are skipped, and once the chunks of a newer record of a
+    doc are in, the rows inserted for its older record are deleted. Inserted primary keys
+    are journaled like in ingest.ingest, rows a crashed run inserted past its checkpoint
+    are deleted before resuming.
+
+    Args:
+        corpus: Corpus with chunked and embedded docs
+        collection_name: "publications" or "osdr"
+        store: Vector store to insert into (MilvusStore or LocalStore)
+        batch_size: Chunks per insert
+        rebuild: Drop the collection and the checkpoint first
+        checkpoint_path: File with the next chunk id to insert and the rows inserted per doc,
+            defaults to CHECKPOINT_DIR/<collection>_corpus.json
+
+    Returns:
+        Number of chunks inserted in this run
+    """
+    from ingest import CHECKPOINT_DIR, COLLECTION_DESCRIPTIONS, COLLECTION_FIELDS, InsertJournal, insert_partitioned
+    checkpoint_path = checkpoint_path or os.path.join(CHECKPOINT_DIR, f"{collection_name}_corpus.json")
+    journal = InsertJournal(checkpoint_path + ".pending")
+    column = corpus.embeddings(collection_name)
+    if len(column) == 0:
+        raise ValueError(f"'{collection_name}' has no embeddings in {corpus.folder_path}, run embed first")
+    if rebuild:
+        store.drop_collection(collection_name)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        journal.clear()
+    start, indexed = 0, {}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        start, indexed = checkpoint["next"], checkpoint.get("docs", {})
+        print(f"Resuming '{collection_name}' at chunk {start}")
+    store.create_collection(collection_name, column.dim, COLLECTION_FIELDS[collection_name],
+                            COLLECTION_DESCRIPTIONS[collection_name])
+    # rows inserted after the last checkpoint are inserted again from "next", drop them first
+    recorded = {primary_key for entry in indexed.values() for primary_key in entry["ids"]}
+    orphans = journal.orphans(lambda _, primary_key: primary_key in recorded)
+    if orphans:
+        print(f"Deleting {len(orphans)} chunks inserted by an interrupted run")
+        store.delete(collection_name, orphans)
+    journal.clear()
+    fields = list(COLLECTION_FIELDS[collection_name])
+    latest = corpus.latest_doc_rows(collection_name)
+    total = 0
+    for first, rows, vectors in corpus.iter_embedded(collection_name, batch_size, start):
+        live = [j for j, row in enumerate(rows) if is_live([row["doc"], row["src"]], latest)]
+        ids = []
+        if live:
+            ids = insert_partitioned(store, collection_name, vectors[live],
+                                     [{name: rows[j].get(name) for name in fields} for j in live],
+                                     journal=journal.append)
+        # doc key -> {"src": record row, "ids": primary keys}, rows of an older record go once the new ones are in
+        stale = []
+        for j, primary_key in zip(live, ids):
+            key, src = rows[j]["doc"], rows[j]["src"]
+            entry = indexed.get(key)
+            if entry is None or entry["src"] != src:
+                if entry is not None:
+                    stale.extend(entry["ids"])
+                entry = indexed[key] = {"src": src, "ids": []}
+            entry["ids"].append(int(primary_key))
+        store.delete(collection_name, stale)
+        total += len(live)
+        os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+        tmp_path = checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"next": first + len(rows), "docs": indexed}, f)
+        os.replace(tmp_path, checkpoint_path)
+        print(f"Inserted {total} chunks into '{collection_name}', deleted {len(stale)} replaced ones")
+    store.flush(collection_name)
+    journal.clear()
+    return total
+
+
+def stats(corpus:CorpusStore) -> dict:
+    report = {}
+    for name in corpus.collections():
+        column = corpus.embeddings(name)
+        report[name] = {"doc_records": len(corpus.docs(name)),
+                        "doc_shards": len(corpus.docs(name).shards()),
+                        "chunks": len(corpus.chunks(name)),
+                        "embedded": len(column),
+                        "embedding_model": column.model_name}
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="sharded docs / chunks / embeddings corpus")
+    parser.add_argument("--corpus", default=CORPUS_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="append a folder of scraped json docs")
+    import_parser.add_argument("collection")
+    import_parser.add_argument("folder")
+
+    chunk_parser = commands.add_parser("chunk", help="chunk docs without chunks")
+    chunk_parser.add_argument("collection")
+    chunk_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+
+    embed_parser = commands.add_parser("embed", help="embed chunks without embeddings")
+    embed_parser.add_argument("collection")
+    embed_parser.add_argument("--backend", choices=["torch", "onnx"], default=os.getenv("EMBEDDING_BACKEND", "torch"))
+    embed_parser.add_argument("--batch-size", type=int, default=256)
+    embed_parser.add_argument("--embed-workers", type=int, default=0,
+                              help="embed with bulk_embed.BulkEmbedder in this many processes, 0 uses the plain model")
+
+    reindex_parser = commands.add_parser("reindex", help="fill a vector store from stored chunks and embeddings")
+    reindex_parser.add_argument("collection")
+    reindex_parser.add_argument("--store", choices=["milvus", "local"], default=os.getenv("VECTOR_STORE", "milvus"))
+    reindex_parser.add_argument("--local-dir", default=os.getenv("LOCAL_STORE_DIR", "./data/vector_store"))
+    reindex_parser.add_argument("--batch-size", type=int, default=1000)
+    reindex_parser.add_argument("--rebuild", action="store_true", help="drop collection and checkpoint first")
+
+    commands.add_parser("stats", help="docs, chunks and embeddings per collection")
+    args = parser.parse_args()
+
+    corpus = CorpusStore(args.corpus)
+    if args.command == "import":
+        import_json_folder(corpus, args.collection, args.folder)
+    elif args.command == "chunk":
+        chunk_corpus(corpus, args.collection, args.workers)
+    elif args.command == "embed":
+        from encoders import embedding_model_id, load_embedding_model
+        from ingest import EMBEDDING_MODEL_NAME
+        if args.embed_workers:
+            from bulk_embed import bulk_embedder
+            model = bulk_embedder(args.backend, args.embed_workers)
+        else:
+            model = load_embedding_model(args.backend, EMBEDDING_MODEL_NAME)
+        embed_corpus(corpus, args.collection, model, embedding_model_id(args.backend, EMBEDDING_MODEL_NAME),
+                     args.batch_size)
+        if args.embed_workers:
+            print(model.stats())
+            model.close()
+    elif args.command == "reindex":
+        from vector_store import LocalStore, MilvusStore
+        store = LocalStore(args.local_dir) if args.store == "local" else MilvusStore()
+        reindex(corpus, args.collection, store, args.batch_size, args.rebuild)
+    else:
+        print(json.dumps(stats(corpus), indent=4))
@@ -0,0 +1,335 @@
+"""
+concurrent, resumable downloader for the PMC articles listed in SB_publication_PMC.csv.
+
+Network threads share one pooled session and a token bucket rate limiter, html is
+parsed in worker processes, and a ledger of done/failed PMC codes lets reruns skip
+finished articles. Links are handed to the threads a few at a time, so no more than
+MAX_PENDING_PER_WORKER articles per thread are queued or waiting to be parsed.
+
+usage: python download_publications.py
+       python download_publications.py --workers 8 --rate 2
+       python download_publications.py --url-template "http://127.0.0.1:8000/{code}.html"
+"""
+from __future__ import annotations
+import csv
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from utils import Ledger, save_json
+
+CSV_PATH = "./SB_publication_PMC.csv"
+OUTPUT_DIR = "./data/publications_raw"
+LEDGER_PATH = "./data/publications_ledger.jsonl"
+# fetched or queued articles per network thread, bounds the queue and the html held in memory
+MAX_PENDING_PER_WORKER = 2
+
+
+# --- parsing, same extraction as download_publications.ipynb ---
+
+def extract_article_name(header):
+    return header.find('h1').text
+
+
+def extract_authors(header) -> list:
+    """extract authors of article return list of them"""
+    authors_block = header.find("div", {'class':"cg p"})
+    authors = [a_link.text for a_link in authors_block.find_all("a")]
+    return list(set(authors))
+
+def extract_article_sections(article):
+    article_content = article.find("section",{'class':'body main-article-body'})
+    sections = article_content.find_all('section',recursive=False)
+    sections_filtered = []
+    for elem in sections:
+        try:
+            name = elem.find("h2").text
+        except:
+            name = elem.text
+
+        if not name == "References":
+            sections_filtered.append(elem)
+
+    return sections_filtered
+
+def extract_section_texts(sections):
+    all_texts = ""
+    for elem in sections:
+        texts = " ".join([paragraph.text for paragraph in elem.find_all('p')])
+        all_texts += "\n" + texts
+    return all_texts
+
+
+def extract_time_and_doi_section(article):
+
+    time_and_doi_section = article.find('section',{'class':"pmc-layout__citation font-secondary font-xs"})
+    text = time_and_doi_section.find("div").text.strip()
+    return text
+
+def extract_date_and_doi(text):
+
+    pattern = r"(\d{4}\s+[A-Za-z]{3}\s+\d{1,2}).*?doi:\s*(\S+)"
+    match = re.search(pattern, text)
+
+    if match:
+        date = match.group(1)
+        doi = match.group(2)
+        return {'date':date,'doi':doi}
+    else:
+        return None
+
+
+def extract_article(soup):
+    main = soup.find('main',{"id":"main-content"})
+    article = main.find("article")
+
+    header = article.find("div",{'class':"ameta p font-secondary font-xs"})
+    name = extract_article_name(header)
+    if 'correction' in name.lower():
+        print("correction article")
+        return None
+
+    authors = extract_authors(header)
+    article_sections =  extract_article_sections(article)
+    texts = extract_section_texts(article_sections)
+    date_doi_dict = extract_date_and_doi(extract_time_and_doi_section(article))
+    if date_doi_dict is not None:
+        date = date_doi_dict["date"]
+        doi = date_doi_dict['doi']
+    else:
+        date = None
+        doi = None
+    article_dict = {'name':name,
+                    "authors":authors,
+                    "text":texts,
+                    'date':date,
+                    'doi':doi
+                    }
+    return article_dict
+
+def extract_last_segment_split(url):
+    # remove trailing slash, split by '/', take last part
+    return url.rstrip('/').split('/')[-1]
+
+
+class ChallengePage(Exception):
+    """PMC served its proof-of-work interstitial (see debug.html) instead of the article"""
+
+
+def parse_article(code:str, content:bytes) -> dict | None:
+    """article dict of the html, None for correction articles, runs in a worker process"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, 'html.parser')
+    if soup.title is not None and "Preparing to download" in soup.title.text:
+        raise ChallengePage(code)
+    return extract_article(soup)
+
+
+def parse_and_save(code:str, content:bytes, output_dir:str) -> str:
+    """
+    Parse article html and save it as <output_dir>/<code>.json, runs in a worker process.
+
+    Returns:
+        "saved" or "skipped" (correction articles)
+    """
+    article_dict = parse_article(code, content)
+    if article_dict is None:
+        return "skipped"
+    if not save_json(article_dict, os.path.join(output_dir, code + ".json")):
+        # recorded as failed in the ledger, so the next run downloads it again
+        raise OSError(f"could not write {code}.json")
+    return "saved"
+
+
+# --- networking ---
+
+class TokenBucket:
+    """
+    Thread safe token bucket, allows bursts of up to capacity requests and
+    rate requests per second on average.
+    """
+
+    def __init__(self, rate:float, capacity:int=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+def create_session(pool_size:int):
+    """cloudscraper session with a connection pool sized for the worker threads"""
+    import cloudscraper
+    from requests.adapters import HTTPAdapter
+
+    session = cloudscraper.create_scraper()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+def fetch(session, url:str, bucket:TokenBucket, retries:int=4, backoff:float=2.0, timeout:float=30) -> bytes:
+    """GET url under the rate limit, retrying failed requests with exponential backoff and jitter"""
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        try:
+            response = session.get(url, timeout=timeout)
+        except Exception as e:
+            response = None
+            error = str(e)
+        if response is not None:
+            if response.status_code not in RETRY_STATUS:
+                # other 4xx will not get better with retries
+                response.raise_for_status()
+                return response.content
+            error = f"HTTP {response.status_code}"
+        if attempt == retries:
+            raise RuntimeError(f"{url}: {error}")
+        delay = backoff * 2 ** attempt * (0.5 + random.random())
+        print(f"Retrying {url} in {delay:.1f}s ({error})")
+        time.sleep(delay)
+
+
+def read_links(csv_path:str) -> list[str]:
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        return [row["Link"] for row in csv.DictReader(f)]
+
+
+def download_publications(links:list[str], output_dir:str=OUTPUT_DIR, ledger_path:str=LEDGER_PATH,
+                          workers:int=4, parse_workers:int=2, rate:float=1.0, burst:int=1,
+                          url_template:str|None=None, session=None, corpus_dir:str|None=None) -> dict:
+    """
+    Download and parse articles, skipping codes the ledger marks as done.
+
+    Args:
+        links: PMC article links, the last path segment is the PMC code
+        output_dir: Folder for the article json files
+        ledger_path: Ledger file of done/failed codes
+        workers: Concurrent network threads
+        parse_workers: Html parsing processes
+        rate: Average requests per second over all threads
+        burst: Token bucket capacity
+        url_template: Fetch this url instead of the link, e.g. a local stand-in server,
+            formatted with code=<PMC code>
+        session: Session to use, a pooled cloudscraper session by default
+        corpus_dir: Append articles to the doc shards of this corpus (see corpus.py) instead
+            of writing one json file each, parsed articles are appended by the main thread
+
+    Returns:
+        Count of codes per final status in this run
+    """
+    corpus = None
+    if corpus_dir:
+        from corpus import CorpusStore
+        corpus = CorpusStore(corpus_dir)
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+    ledger = Ledger(ledger_path, done_statuses=("saved", "skipped"))
+    session = session or create_session(workers)
+    bucket = TokenBucket(rate, burst)
+
+    jobs = []
+    for link in links:
+        code = extract_last_segment_split(link)
+        if not ledger.is_done(code):
+            jobs.append((code, url_template.format(code=code) if url_template else link))
+    print(f"{len(links) - len(jobs)} articles already done, {len(jobs)} to download")
+
+    counts = {"saved": 0, "skipped": 0, "failed": 0}
+
+    def finish(code:str, status:str, error:str|None=None):
+        ledger.record(code, status, error)
+        counts[status] += 1
+        if error:
+            print(f"{code} failed: {error}")
+
+    pending_jobs = iter(jobs)
+    max_pending = MAX_PENDING_PER_WORKER * workers
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch") as fetchers, \
+         ProcessPoolExecutor(max_workers=parse_workers) as parsers:
+        fetches, parses = {}, {}
+
+        def submit_fetches():
+            while len(fetches) + len(parses) < max_pending:
+                job = next(pending_jobs, None)
+                if job is None:
+                    return
+                code, url = job
+                fetches[fetchers.submit(fetch, session, url, bucket)] = code
+
+        submit_fetches()
+        while fetches or parses:
+            done, _ = wait(list(fetches) + list(parses), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in fetches:
+                    code = fetches.pop(future)
+                    try:
+                        content = future.result()
+                    except Exception as e:
+                        finish(code, "failed", str(e))
+                        continue
+                    if corpus is not None:
+                        parses[parsers.submit(parse_article, code, content)] = code
+                    else:
+                        parses[parsers.submit(parse_and_save, code, content, output_dir)] = code
+                else:
+                    code = parses.pop(future)
+                    try:
+                        result = future.result()
+                        if corpus is not None:
+                            if result is not None:
+                                corpus.add_docs("publications", [(code, result)])
+                            result = "saved" if result is not None else "skipped"
+                        finish(code, result)
+                    except ChallengePage:
+                        finish(code, "failed", "challenge page served, rerun later")
+                    except Exception as e:
+                        finish(code, "failed", f"parse error: {e!r}")
+            submit_fetches()
+
+    print(f"Download finished: {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="download PMC publications listed in a csv")
+    parser.add_argument("--csv", default=CSV_PATH)
+    parser.add_argument("--output", default=OUTPUT_DIR)
+    parser.add_argument("--ledger", default=LEDGER_PATH)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--parse-workers", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=1.0, help="requests per second")
+    parser.add_argument("--burst", type=int, default=1)
+    parser.add_argument("--url-template", default=None,
+                        help="fetch from e.g. a local server instead of the csv links, {code} is the PMC code")
+    parser.add_argument("--corpus", default=None, help="append articles to this corpus folder instead of json files")
+    args = parser.parse_args()
+
+    download_publications(read_links(args.csv),
+                          output_dir=args.output,
+                          ledger_path=args.ledger,
+                          workers=args.workers,
+                          parse_workers=args.parse_workers,
+                          rate=args.rate,
+                          burst=args.burst,
+                          url_template=args.url_template,
+                          corpus_dir=args.corpus)
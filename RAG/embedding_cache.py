@@ -0,0 +1,213 @@
+"""cache for query embeddings so repeated queries skip SentenceTransformer.encode"""
+from __future__ import annotations
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_query(query:str) -> str:
+    """normalize query text for cache keys.
+
+    MiniLM models use an uncased tokenizer, so lowercasing and collapsing
+    whitespace does not change the embedding.
+    """
+    return " ".join(query.lower().split())
+
+
+def safe_file_name(name:str) -> str:
+    """make a model name usable as a file name"""
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+
+
+class DiskEmbeddingStore:
+    """
+    Append-only on-disk tier: a raw float32 vector file read through np.memmap
+    plus a key index file with one key per row.
+
+    Args:
+        folder_path: Directory holding the store files
+        model_name: Embedding model name, used to name the files
+        dim: Embedding dimension
+    """
+
+    def __init__(self, folder_path:str, model_name:str, dim:int):
+        os.makedirs(folder_path, exist_ok=True)
+        safe_name = safe_file_name(model_name)
+        self.vectors_path = os.path.join(folder_path, f"{safe_name}.f32")
+        self.keys_path = os.path.join(folder_path, f"{safe_name}.keys")
+        self.dim = dim
+        self._rows = {}
+        self._mmap = None
+        self._load()
+
+    def _load(self):
+        """read the key index, ignoring keys whose vector row was never fully written"""
+        keys = []
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                keys = [line.strip() for line in f if line.strip()]
+        row_bytes = self.dim * 4
+        n_vectors = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        n_rows = min(len(keys), n_vectors)
+        if n_vectors > n_rows or len(keys) > n_rows:
+            # interrupted write, drop the partial tail so files stay aligned
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(n_rows * row_bytes)
+            with open(self.keys_path, "w", encoding="utf-8") as f:
+                f.writelines(key + "\n" for key in keys[:n_rows])
+        self._rows = {key: i for i, key in enumerate(keys[:n_rows])}
+
+    def _vectors(self) -> np.ndarray:
+        """memmap of all written rows, remapped when the file has grown"""
+        if self._mmap is None or self._mmap.shape[0] < len(self._rows):
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                   shape=(len(self._rows), self.dim))
+        return self._mmap
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, key:str):
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        return np.array(self._vectors()[row])
+
+    def put(self, key:str, vector:np.ndarray):
+        if key in self._rows:
+            return
+        # vector first, key second: a crash in between leaves an orphan row that _load trims
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.asarray(vector, dtype=np.float32).tobytes())
+        with open(self.keys_path, "a", encoding="utf-8") as f:
+            f.write(key + "\n")
+        self._rows[key] = len(self._rows)
+
+    def get_many(self, keys:list[str]) -> tuple[list[int], np.ndarray]:
+        """(positions in keys that are stored, their vectors) with one memmap read"""
+        found = [(i, self._rows[key]) for i, key in enumerate(keys) if key in self._rows]
+        if not found:
+            return [], np.zeros((0, self.dim), dtype=np.float32)
+        positions, rows = zip(*found)
+        return list(positions), np.asarray(self._vectors()[list(rows)])
+
+    def put_many(self, keys:list[str], vectors:np.ndarray):
+        """append new keys with one write per file, same crash safety as put"""
+        new = {}
+        for i, key in enumerate(keys):
+            if key not in self._rows and key not in new:
+                new[key] = i
+        if not new:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)[list(new.values())]
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.keys_path, "a", encoding="utf-8") as f:
+            f.write("".join(key + "\n" for key in new))
+        for key in new:
+            self._rows[key] = len(self._rows)
+
+
+class QueryEmbeddingCache:
+    """
+    LRU cache of normalized query embeddings with an optional persistent tier.
+
+    Args:
+        model_name: Embedding model name, part of every cache key
+        max_size: Maximum number of embeddings kept in memory
+        persist_dir: Optional directory for the on-disk tier that survives restarts
+        dim: Embedding dimension, required when persist_dir is set
+    """
+
+    def __init__(self, model_name:str, max_size:int=1024, persist_dir:str|None=None, dim:int|None=None):
+        self.model_name = model_name
+        self.max_size = max_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if persist_dir:
+            if dim is None:
+                raise ValueError("dim is required for the persistent cache tier")
+            self._disk = DiskEmbeddingStore(persist_dir, model_name, dim)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _key(self, query:str) -> str:
+        text = f"{self.model_name}\x00{normalize_query(query)}"
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _remember(self, key:str, vector:np.ndarray):
+        """insert into the LRU, caller holds the lock"""
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def get(self, query:str):
+        """return cached embedding for query or None"""
+        return self._lookup(query)[0]
+
+    def _lookup(self, query:str) -> tuple[np.ndarray | None, str]:
+        """(cached embedding or None, "memory" / "disk" / "miss")"""
+        key = self._key(query)
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return vector, "memory"
+            if self._disk is not None:
+                vector = self._disk.get(key)
+                if vector is not None:
+                    vector.flags.writeable = False
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector, "disk"
+            self.misses += 1
+        return None, "miss"
+
+    def put(self, query:str, vector:np.ndarray) -> np.ndarray:
+        """store embedding for query and return the cached read-only copy"""
+        vector = np.array(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        key = self._key(query)
+        with self._lock:
+            self._remember(key, vector)
+            if self._disk is not None:
+                self._disk.put(key, vector)
+        return vector
+
+    def encode(self, model, query:str) -> np.ndarray:
+        """
+        Encode query with model, serving repeated queries from the cache.
+
+        Args:
+            model: SentenceTransformer used on a cache miss
+            query: Query text
+
+        Returns:
+            Read-only normalized float32 embedding
+        """
+        return self.encode_with_source(model, query)[0]
+
+    def encode_with_source(self, model, query:str) -> tuple[np.ndarray, str]:
+        """like encode, also returns where the embedding came from: "memory", "disk" or "miss" (encoded)"""
+        vector, source = self._lookup(query)
+        if vector is None:
+            vector = model.encode(normalize_query(query), normalize_embeddings=True)
+            vector = self.put(query, vector)
+        return vector, source
+
+    def stats(self) -> dict:
+        """hit/miss counters and current sizes"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {"hits": self.hits,
+                    "disk_hits": self.disk_hits,
+                    "misses": self.misses,
+                    "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                    "memory_size": len(self._lru),
+                    "disk_size": len(self._disk) if self._disk is not None else 0}
@@ -0,0 +1,269 @@
+"""
+embedding model backends: SentenceTransformer on torch, or an int8 quantized ONNX
+export of the same model that only needs onnxruntime and tokenizers.
+
+OnnxEncoder mirrors the part of the SentenceTransformer API the RAG code uses
+(encode, get_sentence_embedding_dimension), so either one can be passed wherever
+a model is expected. EMBEDDING_BACKEND=onnx selects it in the app.
+
+usage: python encoders.py export              # needs torch, run once
+       python encoders.py parity              # cosine agreement with the torch model
+       python encoders.py benchmark           # load time, latency and RSS of both backends
+"""
+from __future__ import annotations
+import json
+import os
+import numpy as np
+
+EMBEDDING_MODEL_NAME = "multi-qa-MiniLM-L6-cos-v1"
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", f"./data/onnx/{EMBEDDING_MODEL_NAME}-int8")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# int8 weights move embeddings slightly, same-model cosine stays well above this
+PARITY_THRESHOLD = 0.98
+
+
+class OnnxEncoder:
+    """
+    Quantized ONNX transformer with the tokenizer, pooling and normalization of the
+    SentenceTransformer it was exported from.
+
+    Args:
+        model_dir: Folder written by export_onnx
+        threads: onnxruntime intra op threads, onnxruntime default if None
+    """
+
+    def __init__(self, model_dir:str=ONNX_MODEL_DIR, threads:int|None=None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, "encoder_config.json"), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"])
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, "model_int8.onnx"),
+                                                    sess_options=options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def _encode_batch(self, sentences:list[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(sentences)
+        feeds = {"input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                 "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64)}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        hidden = self.session.run(None, feeds)[0]
+        if self.config["pooling"] == "cls":
+            embeddings = hidden[:, 0]
+        else:
+            mask = feeds["attention_mask"][:, :, None].astype(np.float32)
+            embeddings = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.config["normalize"]:
+            embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings.astype(np.float32)
+
+    def encode(self, sentences, batch_size:int=32, normalize_embeddings:bool=False, **kwargs) -> np.ndarray:
+        """same contract as SentenceTransformer.encode: 1-d array for a string, 2-d for a list"""
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        if not sentences:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        # sort by length so each batch pads to similar lengths
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        embeddings = np.empty((len(sentences), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(sentences), batch_size):
+            batch = order[start:start + batch_size]
+            embeddings[batch] = self._encode_batch([sentences[i] for i in batch])
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings[0] if single else embeddings
+
+
+def export_onnx(model_name:str=EMBEDDING_MODEL_NAME, output_dir:str=ONNX_MODEL_DIR, opset:int=14):
+    """
+    Export the SentenceTransformer's transformer to ONNX, quantize its weights to int8
+    and save the tokenizer and pooling settings next to it.
+
+    Args:
+        model_name: SentenceTransformer model to export
+        output_dir: Folder for model_int8.onnx, tokenizer.json and encoder_config.json
+        opset: ONNX opset version
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    pooling = next(module for module in st_model if type(module).__name__ == "Pooling")
+
+    dummy = tokenizer(["an example query about spaceflight"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    fp32_path = os.path.join(output_dir, "model_fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(transformer,
+                          tuple(dummy[name] for name in input_names),
+                          fp32_path,
+                          input_names=input_names,
+                          output_names=["last_hidden_state"],
+                          dynamic_axes={name: {0: "batch", 1: "sequence"}
+                                        for name in input_names + ["last_hidden_state"]},
+                          opset_version=opset)
+    quantize_dynamic(fp32_path, os.path.join(output_dir, "model_int8.onnx"), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    tokenizer.save_pretrained(output_dir)
+    config = {"model_name": model_name,
+              "dim": st_model.get_sentence_embedding_dimension(),
+              "max_seq_length": st_model.max_seq_length,
+              "pad_token_id": tokenizer.pad_token_id,
+              "pooling": "cls" if pooling.pooling_mode_cls_token else "mean",
+              "normalize": any(type(module).__name__ == "Normalize" for module in st_model)}
+    with open(os.path.join(output_dir, "encoder_config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=4)
+    print(f"Exported {model_name} to {output_dir}")
+
+
+def embedding_model_id(backend:str|None=None, model_name:str=EMBEDDING_MODEL_NAME) -> str:
+    """name for caches of embeddings, the onnx backend gets its own since vectors differ slightly"""
+    return f"{model_name}-onnx-int8" if (backend or EMBEDDING_BACKEND) == "onnx" else model_name
+
+
+def load_embedding_model(backend:str|None=None, model_name:str=EMBEDDING_MODEL_NAME, onnx_dir:str=ONNX_MODEL_DIR,
+                         threads:int|None=None):
+    """
+    Embedding model for the selected backend.
+
+    Args:
+        backend: "torch" (SentenceTransformer) or "onnx", EMBEDDING_BACKEND if None
+        model_name: SentenceTransformer model name for the torch backend
+        onnx_dir: Export folder for the onnx backend
+        threads: CPU threads of the model, library default if None
+    """
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "onnx":
+        return OnnxEncoder(onnx_dir, threads)
+    if backend != "torch":
+        raise ValueError(f"Unknown embedding backend '{backend}', use 'torch' or 'onnx'")
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    from sentence_transformers import SentenceTransformer
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    return SentenceTransformer(model_name, device=device)
+
+
+def parity_sentences() -> list[str]:
+    """router prototypes and eval queries plus a few chunk-length passages"""
+    from local_router import EVAL_QUERIES_PATH, load_prototypes
+    sentences = [query for queries in load_prototypes().values() for query in queries]
+    with open(EVAL_QUERIES_PATH, "r", encoding="utf-8") as f:
+        sentences += [json.loads(line)["query"] for line in f if line.strip()]
+    passage = ("Mice flown on the International Space Station for 30 days showed reduced bone mineral "
+               "density in the femur and tibia, with increased osteoclast activity and changes in gene "
+               "expression related to extracellular matrix remodeling. ")
+    sentences += [passage * n for n in (1, 2, 4)]
+    return sentences
+
+
+def parity(torch_model, onnx_model, sentences:list[str], threshold:float=PARITY_THRESHOLD) -> dict:
+    """cosine similarity between the two backends per sentence and agreement of nearest neighbours"""
+    a = torch_model.encode(sentences, normalize_embeddings=True)
+    b = onnx_model.encode(sentences, normalize_embeddings=True)
+    cosines = np.sum(a * b, axis=1)
+    # same nearest neighbour among the other sentences with both backends
+    sims_a, sims_b = a @ a.T, b @ b.T
+    np.fill_diagonal(sims_a, -np.inf)
+    np.fill_diagonal(sims_b, -np.inf)
+    neighbour_agreement = float(np.mean(np.argmax(sims_a, axis=1) == np.argmax(sims_b, axis=1)))
+    return {"sentences": len(sentences),
+            "cosine_min": float(cosines.min()),
+            "cosine_mean": float(cosines.mean()),
+            "neighbour_agreement": neighbour_agreement,
+            "passed": bool(cosines.min() >= threshold)}
+
+
+BENCHMARK_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+from encoders import load_embedding_model, parity_sentences
+model = load_embedding_model({backend!r})
+load_s = time.perf_counter() - start
+sentences = parity_sentences()
+model.encode(sentences[0])
+latencies = []
+for sentence in sentences[:{queries}]:
+    t = time.perf_counter()
+    model.encode(sentence, normalize_embeddings=True)
+    latencies.append((time.perf_counter() - t) * 1000)
+t = time.perf_counter()
+model.encode(sentences * 4, batch_size=32, normalize_embeddings=True)
+batch_s = time.perf_counter() - t
+print(json.dumps({{"load_s": load_s, "latencies_ms": latencies, "batch_per_s": len(sentences) * 4 / batch_s,
+                  "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "torch_imported": "torch" in sys.modules}}))
+"""
+
+
+def benchmark(backends:list[str], queries:int=50, onnx_dir:str=ONNX_MODEL_DIR) -> dict:
+    """load time, single query latency, batch throughput and peak RSS of each backend in a fresh process"""
+    import subprocess
+    import sys
+    report = {}
+    for backend in backends:
+        result = subprocess.run([sys.executable, "-c", BENCHMARK_SCRIPT.format(backend=backend, queries=queries)],
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                                env={**os.environ, "ONNX_MODEL_DIR": os.path.abspath(onnx_dir)})
+        if result.returncode != 0:
+            report[backend] = {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+            print(f"{backend}: {report[backend]['error']}")
+            continue
+        run = json.loads(result.stdout.strip().splitlines()[-1])
+        latencies = run.pop("latencies_ms")
+        run["latency_ms_p50"] = float(np.percentile(latencies, 50))
+        run["latency_ms_p95"] = float(np.percentile(latencies, 95))
+        report[backend] = run
+        print(f"{backend:6} load={run['load_s']:.2f}s p50={run['latency_ms_p50']:.2f}ms "
+              f"p95={run['latency_ms_p95']:.2f}ms batch={run['batch_per_s']:.0f}/s rss={run['max_rss_mb']:.0f}MB "
+              f"torch={run['torch_imported']}")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="export, check and benchmark the ONNX embedding backend")
+    parser.add_argument("command", choices=["export", "parity", "benchmark"])
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--onnx-dir", default=ONNX_MODEL_DIR)
+    parser.add_argument("--threshold", type=float, default=PARITY_THRESHOLD)
+    parser.add_argument("--queries", type=int, default=50, help="single query encodes per benchmark run")
+    parser.add_argument("--output", default=None, help="write the report as json")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model, args.onnx_dir)
+        sys.exit(0)
+    if args.command == "parity":
+        report = parity(load_embedding_model("torch", args.model),
+                        OnnxEncoder(args.onnx_dir),
+                        parity_sentences(),
+                        args.threshold)
+    else:
+        report = benchmark(["torch", "onnx"], args.queries, args.onnx_dir)
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+    if args.command == "parity" and not report["passed"]:
+        sys.exit(1)
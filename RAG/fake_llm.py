@@ -0,0 +1,134 @@
+"""local stand-in for google.genai Client, for running the app pipeline without gemini"""
+from __future__ import annotations
+import random
+import time
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Iterator
+
+# ~4 characters per token, as context_builder.estimate_tokens
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class FakeUsage:
+    """usage_metadata look-alike, read by tracing.usage_tokens"""
+    prompt_token_count: int
+    candidates_token_count: int
+    total_token_count: int
+
+
+@dataclass
+class FakeResponse:
+    """minimal GenerateContentResponse look-alike, .text and .usage_metadata are used by the app"""
+    text: str
+    usage_metadata: FakeUsage | None = None
+
+
+@dataclass
+class FakePart:
+    text: str
+
+    @classmethod
+    def from_text(cls, text:str) -> FakePart:
+        return cls(text)
+
+
+@dataclass
+class FakeContent:
+    role: str
+    parts: list[FakePart] = field(default_factory=list)
+
+
+# google.genai.types look-alikes the app builds requests from, llm.py falls back to them
+# when google-genai is not installed so the pipeline runs offline on FakeClient
+types = SimpleNamespace(
+    Content=FakeContent,
+    Part=FakePart,
+    GenerateContentConfig=SimpleNamespace,
+    Tool=SimpleNamespace,
+    GoogleSearch=SimpleNamespace,
+    GenerateContentResponse=FakeResponse,
+)
+
+
+def count_tokens(contents, config=None) -> int:
+    """estimated prompt tokens of the contents and the system instruction"""
+    texts = [getattr(config, "system_instruction", None) or ""]
+    for content in contents if isinstance(contents, list) else [contents]:
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        texts.extend(getattr(part, "text", None) or "" for part in getattr(content, "parts", None) or [])
+    return sum(len(text) for text in texts) // CHARS_PER_TOKEN + 1
+
+
+class FakeModels:
+    """
+    Fake of client.models that answers with a fixed text.
+
+    Args:
+        text: Text returned for every call, or a callable (model, contents, config) -> text
+        chunk_size: Characters per streamed chunk
+        first_chunk_delay: Seconds before the first chunk (or the full response) is returned
+        chunk_delay: Seconds between streamed chunks
+        output_tokens: Length in tokens of streamed answers, the text is repeated or cut to it,
+            None keeps the text. Non streamed calls (router, reformulator) always get the text
+        jitter: Delays are scaled by a random factor in [1 - jitter, 1 + jitter]
+        seed: Seed of the jitter
+    """
+
+    def __init__(self, text="fake answer", chunk_size:int=16, first_chunk_delay:float=0.0, chunk_delay:float=0.0,
+                 output_tokens:int|None=None, jitter:float=0.0, seed:int|None=None):
+        self.text = text
+        self.chunk_size = chunk_size
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_delay = chunk_delay
+        self.output_tokens = output_tokens
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self.calls = []
+
+    def _sleep(self, seconds:float):
+        if seconds > 0:
+            time.sleep(seconds * self._random.uniform(1 - self.jitter, 1 + self.jitter) if self.jitter else seconds)
+
+    def _reply(self, model:str, contents, config, stream:bool=False) -> str:
+        text = self.text(model, contents, config) if callable(self.text) else self.text
+        if self.output_tokens is None or not stream:
+            return text
+        length = self.output_tokens * CHARS_PER_TOKEN
+        return (text * (length // max(len(text), 1) + 1))[:length]
+
+    def _usage(self, contents, config, text:str) -> FakeUsage:
+        prompt_tokens = count_tokens(contents, config)
+        output_tokens = len(text) // CHARS_PER_TOKEN + 1
+        return FakeUsage(prompt_tokens, output_tokens, prompt_tokens + output_tokens)
+
+    def generate_content(self, model:str, contents, config=None) -> FakeResponse:
+        self.calls.append({"model": model, "contents": contents, "config": config, "stream": False})
+        text = self._reply(model, contents, config)
+        self._sleep(self.first_chunk_delay + self.chunk_delay * (len(text) // self.chunk_size))
+        return FakeResponse(text, self._usage(contents, config, text))
+
+    def generate_content_stream(self, model:str, contents, config=None) -> Iterator[FakeResponse]:
+        self.calls.append({"model": model, "contents": contents, "config": config, "stream": True})
+        return self._stream(model, contents, config)
+
+    def _stream(self, model:str, contents, config) -> Iterator[FakeResponse]:
+        text = self._reply(model, contents, config, stream=True)
+        usage = self._usage(contents, config, text)
+        self._sleep(self.first_chunk_delay)
+        for i in range(0, len(text), self.chunk_size):
+            if i:
+                self._sleep(self.chunk_delay)
+            # gemini reports usage on the last chunk of a stream
+            last = i + self.chunk_size >= len(text)
+            yield FakeResponse(text[i:i + self.chunk_size], usage if last else None)
+
+
+class FakeClient:
+    """drop-in for google.genai.Client, takes the same arguments as FakeModels"""
+
+    def __init__(self, text="fake answer", **kwargs):
+        self.models = FakeModels(text, **kwargs)
@@ -0,0 +1,91 @@
+"""local stand-in for the Milvus collections, for running the app pipeline without a Milvus server"""
+from __future__ import annotations
+import random
+import time
+import numpy as np
+from filters import CHUNK_TYPES, matches
+from vector_store import LocalHit
+
+WORDS = ("microgravity spaceflight radiation mice arabidopsis drosophila bone muscle immune gene expression "
+         "transcriptomics protocol sample tissue cell culture station orbit mission exposure response "
+         "analysis rna sequencing liver heart retina stem growth root seedling").split()
+# fields of the two collections the app searches
+PUBLICATION_FIELDS = ("PMC_code", "name", "authors", "date", "doi", "content")
+OSDR_FIELDS = ("study_id", "name", "organisms", "authors", "doi", "link", "type", "protocole_name", "text")
+
+
+def fake_row(collection_name:str, i:int, rng:random.Random, text_words:int=120) -> dict:
+    """synthetic row with every field search_publications / search_osdr read"""
+    text = " ".join(rng.choice(WORDS) for _ in range(text_words))
+    authors = ", ".join(f"Author {rng.randint(1, 500)}" for _ in range(rng.randint(1, 6)))
+    if collection_name == "osdr":
+        return {"study_id": f"OSD-{i // 4}", "name": f"Study {i // 4}", "organisms": rng.choice(WORDS),
+                "authors": authors, "doi": f"10.0000/osd.{i // 4}", "link": f"https://osdr.example/{i // 4}",
+                "type": rng.choice(sorted(CHUNK_TYPES)), "protocole_name": f"protocol {i % 4}",
+                "text": text}
+    return {"PMC_code": f"PMC{i // 8}", "name": f"Publication {i // 8}", "authors": authors,
+            "date": f"20{rng.randint(10, 24)}-01-01", "doi": f"10.0000/pmc.{i // 8}", "content": text}
+
+
+class FakeStore:
+    """
+    In-memory vector store with random unit vectors, exact search and a configurable delay.
+    Same surface as MilvusStore / LocalStore as far as the pipeline uses it.
+
+    Args:
+        sizes: Rows per collection name
+        dim: Vector dimension, must match the embedding model
+        latency: Seconds every search sleeps, as the round trip to Milvus
+        jitter: Latency is scaled by a random factor in [1 - jitter, 1 + jitter]
+        seed: Seed of the vectors, rows and jitter
+    """
+
+    def __init__(self, sizes:dict|None=None, dim:int=384, latency:float=0.0, jitter:float=0.0, seed:int=0):
+        sizes = sizes or {"publications": 20000, "osdr": 5000}
+        rng = random.Random(seed)
+        np_rng = np.random.default_rng(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed + 1)
+        self.vectors = {}
+        self.rows = {}
+        for name, size in sizes.items():
+            vectors = np_rng.standard_normal((size, dim)).astype(np.float32)
+            self.vectors[name] = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            self.rows[name] = [fake_row(name, i, rng) for i in range(size)]
+        self.searches = 0
+
+    def has_collection(self, collection_name:str) -> bool:
+        return collection_name in self.vectors
+
+    def health_check(self) -> dict:
+        return {"collections": {name: len(rows) for name, rows in self.rows.items()}}
+
+    def memory_bytes(self) -> int:
+        return sum(vectors.nbytes for vectors in self.vectors.values())
+
+    def search(self, collection_name:str, embedding, output_fields:list, k:int=5,
+               params:dict|None=None, timeout:float|None=None, filters:dict|None=None):
+        """same contract as MilvusStore.search, params are ignored"""
+        self.searches += 1
+        if self.latency > 0:
+            time.sleep(self.latency * self._random.uniform(1 - self.jitter, 1 + self.jitter))
+        rows = self.rows[collection_name]
+        scores = self.vectors[collection_name] @ np.asarray(embedding, dtype=np.float32)
+        if filters:
+            allowed = np.array([matches(row, filters) for row in rows], dtype=bool)
+            scores = np.where(allowed, scores, -np.inf)
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [LocalHit(id=int(i), score=float(scores[i]),
+                         entity={name: rows[i].get(name) for name in output_fields})
+                for i in top if np.isfinite(scores[i])]
+
+    def hydrate(self, collection_name:str, ids:list[int], output_fields:list,
+                timeout:float|None=None) -> dict[int, dict]:
+        """fields of rows by id, for the second phase of vector_store.two_phase_search"""
+        if self.latency > 0:
+            time.sleep(self.latency * self._random.uniform(1 - self.jitter, 1 + self.jitter))
+        rows = self.rows[collection_name]
+        return {int(i): {name: rows[i].get(name) for name in output_fields} for i in ids}
@@ -0,0 +1,138 @@
+"""structured search filters and the partition scheme of the collections"""
+from __future__ import annotations
+import re
+
+# filter keys each collection accepts, anything else is dropped
+ALLOWED_FILTERS = {
+    "publications": {"PMC_code", "date_from", "date_to"},
+    "osdr": {"study_id", "type", "organisms"},
+}
+CHUNK_TYPES = {"description", "protocole"}
+
+
+def partition_name(collection_name:str, row:dict) -> str:
+    """partition of a chunk row: publication year or osdr chunk type"""
+    if collection_name == "publications":
+        year = str(row.get("date") or "")[:4]
+        return f"year_{year}" if year.isdigit() else "year_unknown"
+    return f"type_{row['type']}"
+
+
+def _values(value) -> list[str]:
+    values = value if isinstance(value, (list, tuple)) else [value]
+    return [str(v).strip() for v in values if v is not None and str(v).strip()]
+
+
+def _date_bound(value, upper:bool) -> str | None:
+    """'2015' -> '2015-01-01' (or '2015-12-31' as upper bound), full dates pass through"""
+    value = str(value).strip()
+    if re.fullmatch(r"\d{4}", value):
+        return f"{value}-12-31" if upper else f"{value}-01-01"
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+        return value
+    return None
+
+
+def clean_filters(collection_name:str, filters:dict|None) -> dict:
+    """
+    Keep only valid filters for a collection, e.g. from LLM output.
+
+    Args:
+        collection_name: "publications" or "osdr"
+        filters: Raw filters, values may be strings or lists
+
+    Returns:
+        Filters with list values for id fields and normalized dates
+    """
+    cleaned = {}
+    for key, value in (filters or {}).items():
+        if key not in ALLOWED_FILTERS.get(collection_name, ()) or value in (None, "", "None", []):
+            continue
+        if key in ("PMC_code", "study_id"):
+            values = _values(value)
+            if values:
+                cleaned[key] = values
+        elif key in ("date_from", "date_to"):
+            bound = _date_bound(value, upper=key == "date_to")
+            if bound:
+                cleaned[key] = bound
+        elif key == "type":
+            if str(value).strip().lower() in CHUNK_TYPES:
+                cleaned[key] = str(value).strip().lower()
+        elif key == "organisms":
+            values = _values(value)
+            if values:
+                cleaned[key] = values
+    return cleaned
+
+
+def _quote(value:str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def to_expression(filters:dict) -> str | None:
+    """Milvus boolean expression for cleaned filters, None if there are none"""
+    clauses = []
+    for key in ("PMC_code", "study_id"):
+        if key in filters:
+            clauses.append(f"{key} in [{', '.join(_quote(v) for v in filters[key])}]")
+    if "type" in filters:
+        clauses.append(f"type == {_quote(filters['type'])}")
+    if "organisms" in filters:
+        # organisms is a comma separated string, any of the requested organisms matches
+        clauses.append("(" + " or ".join(f"organisms like {_quote('%' + v + '%')}"
+                                         for v in filters["organisms"]) + ")")
+    if "date_from" in filters:
+        clauses.append(f"date >= {_quote(filters['date_from'])}")
+    if "date_to" in filters:
+        clauses.append(f"date <= {_quote(filters['date_to'])}")
+    if "date_from" in filters or "date_to" in filters:
+        # missing dates are stored as the string "None"
+        clauses.append('date != "None"')
+    return " and ".join(clauses) if clauses else None
+
+
+def matches(row:dict, filters:dict) -> bool:
+    """python equivalent of to_expression for the local store"""
+    for key in ("PMC_code", "study_id"):
+        if key in filters and row.get(key) not in filters[key]:
+            return False
+    if "type" in filters and row.get("type") != filters["type"]:
+        return False
+    if "organisms" in filters:
+        organisms = str(row.get("organisms") or "")
+        if not any(v in organisms for v in filters["organisms"]):
+            return False
+    if "date_from" in filters or "date_to" in filters:
+        date = row.get("date")
+        if not date or date == "None":
+            return False
+        if "date_from" in filters and date < filters["date_from"]:
+            return False
+        if "date_to" in filters and date > filters["date_to"]:
+            return False
+    return True
+
+
+def partition_names(collection_name:str, filters:dict, existing:list[str]) -> list[str] | None:
+    """
+    Partitions that can hold matches, or None to search all of them.
+
+    Args:
+        collection_name: "publications" or "osdr"
+        filters: Cleaned filters
+        existing: Partition names of the collection
+    """
+    if collection_name == "osdr" and "type" in filters:
+        wanted = [f"type_{filters['type']}"]
+    elif collection_name == "publications" and ("date_from" in filters or "date_to" in filters):
+        years = [p for p in existing if re.fullmatch(r"year_\d{4}", p)]
+        low = filters.get("date_from", "0000")[:4]
+        high = filters.get("date_to", "9999")[:4]
+        wanted = [p for p in years if low <= p[5:] <= high]
+    else:
+        return None
+    # collections built before partitioning only have _default
+    if not any(p != "_default" for p in existing):
+        return None
+    return [p for p in wanted if p in existing]
@@ -0,0 +1,417 @@
+"""
+streaming ingestion of scraped publications / OSDR studies into the vector store.
+
+Pipeline: read docs -> clean -> chunk (process pool) -> embed in fixed batches -> insert.
+Every stage is a generator, so memory stays bounded by the batch size and the number
+of docs in flight, not by the corpus. Each inserted batch is logged to a checkpoint
+file and an interrupted run resumes after the last inserted chunk. Primary keys are
+journaled as soon as the store returns them, so rows of a batch that was inserted but
+never logged are deleted on resume instead of being inserted twice.
+
+usage: python ingest.py publications ./data/publications_raw
+       python ingest.py osdr ./data/osdr_raw --store local --workers 4
+       python ingest.py publications ./data/corpus       # docs of a corpus folder
+       python ingest.py publications ./data/corpus --embed-workers 4 --batch-size 4096
+"""
+from __future__ import annotations
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Iterable, Iterator
+from filters import partition_name
+
+EMBEDDING_MODEL_NAME = "multi-qa-MiniLM-L6-cos-v1"
+CHUNK_SIZE = 600
+CHUNK_OVERLAP = 120
+MIN_CHUNK_LENGTH = 100
+BATCH_SIZE = 256
+CHECKPOINT_DIR = "./data/checkpoints"
+
+# VARCHAR fields of each collection, same schema the preprocessing notebooks created
+COLLECTION_FIELDS = {
+    "publications": {
+        "PMC_code": 20,
+        "name": 300,
+        "content": 2000,
+        "authors": 2000,
+        "date": 20,
+        "doi": 200,
+    },
+    "osdr": {
+        "doi": 200,
+        "name": 500,
+        "study_id": 50,
+        "organisms": 1000,
+        "authors": 2000,
+        "link": 500,
+        "type": 20,
+        "text": 2000,
+        "protocole_name": 200,
+    },
+}
+COLLECTION_DESCRIPTIONS = {
+    "publications": "RAG collection with publication metadata",
+    "osdr": "RAG collection with OSD experiment metadata",
+}
+
+
+def read_docs(folder_path:str, collection_name:str|None=None) -> Iterator[tuple[str, dict]]:
+    """yield (doc key, json doc) for every json file in folder, one file at a time,
+    or streamed from the doc shards if folder is a corpus (see corpus.py) holding the collection"""
+    from corpus import CorpusStore
+    if collection_name and CorpusStore.is_corpus(folder_path, collection_name):
+        yield from CorpusStore(folder_path).iter_docs(collection_name)
+        return
+    for file in sorted(os.listdir(folder_path)):
+        if file.endswith(".json"):
+            with open(os.path.join(folder_path, file), "r", encoding="utf-8") as doc:
+                yield file.replace(".json", "").strip(), json.load(doc)
+
+
+def clean_publication(key:str, publication:dict) -> dict | None:
+    """clean publication name and text, None if there is no text"""
+    if publication["text"] == "":
+        return None
+    publication["PMC_code"] = key
+    publication["name"] = publication["name"].replace(r"\n","").strip()
+    publication["text"] = publication["text"].strip()
+    return publication
+
+
+def clean_osdr(key:str, osd:dict) -> dict | None:
+    """clean study name and strip 'email' suffix from authors, None if there is no description"""
+    if osd["description"] == "":
+        return None
+    osd["study_name"] = osd["study_name"].replace(r"\n","").strip()
+    if len(osd["authors"]) > 1:
+        authors_cleaned = []
+        for author in osd["authors"]:
+            if author.endswith("email"):
+                author = author.replace("email","")
+            authors_cleaned.append(author.strip())
+        osd["authors"] = authors_cleaned
+    return osd
+
+
+def format_date(date:str|None) -> str:
+    """'2014 Aug 12' -> '2014-08-12', 'None' if missing"""
+    if not date:
+        return "None"
+    return datetime.strptime(date, "%Y %b %d").strftime("%Y-%m-%d")
+
+
+def publication_records(doc:dict) -> list[dict]:
+    """collection rows of a publication before chunking, text goes to 'content'"""
+    return [{
+        "PMC_code": doc["PMC_code"],
+        "name": doc["name"],
+        "authors": ",".join(doc["authors"]),
+        "date": format_date(doc["date"]),
+        "doi": doc["doi"] or "None",
+        "content": doc["text"],
+    }]
+
+
+def osdr_records(doc:dict) -> list[dict]:
+    """collection rows of a study before chunking: main description plus one row per protocol"""
+    base_info = {"doi": doc["doi"] or "None",
+                 "name": doc["study_name"],
+                 "study_id": doc["genelab_id"],
+                 "organisms": ",".join(doc["organisms"]),
+                 "authors": ",".join(doc["authors"]),
+                 "link": doc["link"]}
+    records = [{**base_info, "type": "description", "text": doc["description"], "protocole_name": ""}]
+    protocoles = doc["protocole_samples"]
+    if len(protocoles) > 1:
+        for protocole in protocoles:
+            records.append({**base_info,
+                            "type": "protocole",
+                            "text": protocole["description"],
+                            "protocole_name": protocole["name"]})
+    return records
+
+
+# collection -> (cleaning function, record builder, name of the field that gets chunked)
+COLLECTIONS = {
+    "publications": (clean_publication, publication_records, "content"),
+    "osdr": (clean_osdr, osdr_records, "text"),
+}
+
+_text_splitter = None
+
+def chunk_doc(collection_name:str, key:str, doc:dict) -> tuple[str, list[dict]]:
+    """clean and chunk one doc, runs in a worker process. Returns (doc key, chunk rows)"""
+    global _text_splitter
+    if _text_splitter is None:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        _text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+    clean, build_records, text_field = COLLECTIONS[collection_name]
+    doc = clean(key, doc)
+    if doc is None:
+        return key, []
+    chunks = []
+    for record in build_records(doc):
+        for text in _text_splitter.split_text(record[text_field]):
+            # drop reference lists and tiny fragments
+            if "List of" in text or len(text.strip()) <= MIN_CHUNK_LENGTH:
+                continue
+            chunks.append({**record, text_field: text})
+    return key, chunks
+
+
+def bounded_map(executor, fn, iterable:Iterable, window:int, *args) -> Iterator:
+    """like executor.map but keeps at most window tasks in flight, so input is read lazily"""
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, *args, *item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class Checkpoint:
+    """
+    Append-only log of inserted batches. Each line records how many chunks of each
+    doc were inserted and which docs are complete.
+
+    Args:
+        path: Checkpoint file path
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.done = set()
+        self.inserted = {}
+        # logged batches, numbers the batches in the insert journal
+        self.batches = 0
+        if os.path.exists(path):
+            end = 0
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # torn last line from an interrupted write, that batch is redone
+                        break
+                    entry = json.loads(line)
+                    for key, n in entry["chunks"].items():
+                        self.inserted[key] = self.inserted.get(key, 0) + n
+                    self.done.update(entry["done"])
+                    self.batches += 1
+                    end += len(line)
+            if end < os.path.getsize(path):
+                # cut the torn line, the next entry would be appended to it
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+        for key in self.done:
+            self.inserted.pop(key, None)
+
+    def log(self, chunks:dict, done:list):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"chunks": chunks, "done": done}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        for key, n in chunks.items():
+            self.inserted[key] = self.inserted.get(key, 0) + n
+        for key in done:
+            self.done.add(key)
+            self.inserted.pop(key, None)
+        self.batches += 1
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.done = set()
+        self.inserted = {}
+        self.batches = 0
+
+
+class InsertJournal:
+    """
+    Primary keys of inserted rows, appended as soon as the store returns them and before
+    the run records the rows in its checkpoint or manifest. The next run deletes the
+    journaled keys that never got recorded, so a crash between insert and checkpoint does
+    not leave duplicates. Primary keys come from the store, a crash inside the insert call
+    itself is not covered.
+
+    Args:
+        path: Journal file, next to the checkpoint or manifest it belongs to
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+
+    def append(self, ids:list, batch:int=0):
+        """journal the primary keys of one insert, batch numbers the checkpoint entry they belong to"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"batch": batch, "ids": [int(i) for i in ids]}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def orphans(self, recorded) -> list[int]:
+        """journaled primary keys for which recorded(batch, primary key) is False"""
+        if not os.path.exists(self.path):
+            return []
+        ids = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                # a torn last line was never followed by a checkpoint / manifest update of its ids either
+                if not line.endswith("\n"):
+                    break
+                entry = json.loads(line)
+                ids.extend(i for i in entry["ids"] if not recorded(entry["batch"], i))
+        return ids
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def iter_chunks(collection_name:str, folder_path:str, checkpoint:Checkpoint, workers:int) -> Iterator[tuple[str, int, int, dict]]:
+    """yield (doc key, chunk index, chunks in doc, chunk row) for chunks not yet inserted"""
+    docs = ((key, doc) for key, doc in read_docs(folder_path, collection_name) if key not in checkpoint.done)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for key, chunks in bounded_map(executor, chunk_doc, docs, workers * 4, collection_name):
+            start = checkpoint.inserted.get(key, 0)
+            if not chunks:
+                yield key, 0, 0, None
+            for i in range(start, len(chunks)):
+                yield key, i, len(chunks), chunks[i]
+
+
+def insert_partitioned(store, collection_name:str, vectors, rows:list[dict], journal=None) -> list:
+    """insert a batch split by partition (publication year / osdr chunk type), returns primary keys in row order.
+    journal is called with the primary keys of every partition insert as soon as it returns"""
+    groups = {}
+    for i, row in enumerate(rows):
+        groups.setdefault(partition_name(collection_name, row), []).append(i)
+    ids = [None] * len(rows)
+    for partition, indices in groups.items():
+        inserted = store.insert(collection_name,
+                                [vectors[i] for i in indices],
+                                [rows[i] for i in indices],
+                                partition_name=partition)
+        if journal is not None:
+            journal(inserted)
+        for i, primary_key in zip(indices, inserted):
+            ids[i] = primary_key
+    return ids
+
+
+def iter_batches(chunks:Iterable, batch_size:int) -> Iterator[list]:
+    batch = []
+    for item in chunks:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest(collection_name:str, folder_path:str, store, model, batch_size:int=BATCH_SIZE,
+           workers:int=os.cpu_count() or 1, checkpoint_path:str|None=None, rebuild:bool=False) -> int:
+    """
+    Ingest a folder of scraped json docs into a collection.
+
+    Args:
+        collection_name: "publications" or "osdr"
+        folder_path: Folder with the scraped json files, or a corpus folder
+        store: Vector store to insert into (MilvusStore or LocalStore)
+        model: SentenceTransformer or encoders.OnnxEncoder used for embeddings
+        batch_size: Chunks per embedding / insert batch
+        workers: Chunking worker processes
+        checkpoint_path: Checkpoint file, defaults to CHECKPOINT_DIR/<collection>.jsonl
+        rebuild: Drop the collection and checkpoint and start from scratch
+
+    Returns:
+        Number of chunks inserted in this run
+    """
+    checkpoint = Checkpoint(checkpoint_path or os.path.join(CHECKPOINT_DIR, f"{collection_name}.jsonl"))
+    journal = InsertJournal(checkpoint.path + ".pending")
+    if rebuild:
+        store.drop_collection(collection_name)
+        checkpoint.clear()
+        journal.clear()
+    store.create_collection(collection_name,
+                            model.get_sentence_embedding_dimension(),
+                            COLLECTION_FIELDS[collection_name],
+                            COLLECTION_DESCRIPTIONS[collection_name])
+    # rows of batches inserted after the last checkpoint entry are redone, drop them first
+    orphans = journal.orphans(lambda batch, _: batch < checkpoint.batches)
+    if orphans:
+        print(f"Deleting {len(orphans)} chunks inserted by an interrupted run")
+        store.delete(collection_name, orphans)
+    journal.clear()
+    if checkpoint.done or checkpoint.inserted:
+        print(f"Resuming '{collection_name}': {len(checkpoint.done)} docs already inserted")
+
+    total = 0
+    for batch in iter_batches(iter_chunks(collection_name, folder_path, checkpoint, workers), batch_size):
+        rows = [row for _, _, _, row in batch if row is not None]
+        if rows:
+            vectors = model.encode([row[COLLECTIONS[collection_name][2]] for row in rows],
+                                   normalize_embeddings=True,
+                                   batch_size=batch_size)
+            insert_partitioned(store, collection_name, vectors, rows,
+                               journal=lambda ids: journal.append(ids, checkpoint.batches))
+
+        chunks, done = {}, []
+        for key, i, n_chunks, row in batch:
+            if row is not None:
+                chunks[key] = chunks.get(key, 0) + 1
+            if i + 1 >= n_chunks:
+                done.append(key)
+        checkpoint.log(chunks, done)
+        total += len(rows)
+        print(f"Inserted {total} chunks into '{collection_name}'")
+
+    store.flush(collection_name)
+    journal.clear()
+    return total
+
+
+if __name__ == "__main__":
+    import argparse
+    from vector_store import VECTOR_DTYPES, LocalStore, MilvusStore
+
+    parser = argparse.ArgumentParser(description="ingest scraped docs into a vector store collection")
+    parser.add_argument("collection", choices=sorted(COLLECTIONS))
+    parser.add_argument("folder")
+    parser.add_argument("--store", choices=["milvus", "local"], default=os.getenv("VECTOR_STORE", "milvus"))
+    parser.add_argument("--local-dir", default=os.getenv("LOCAL_STORE_DIR", "./data/vector_store"))
+    parser.add_argument("--vector-dtype", choices=sorted(VECTOR_DTYPES), default=os.getenv("LOCAL_VECTOR_DTYPE", "float32"),
+                        help="vector dtype of a new local collection")
+    parser.add_argument("--keep-full", action="store_true", help="keep float32 vectors of a compressed local collection for reranking")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default=os.getenv("EMBEDDING_BACKEND", "torch"),
+                        help="embedding backend, onnx needs 'python encoders.py export' first")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--embed-workers", type=int, default=0,
+                        help="embed with bulk_embed.BulkEmbedder in this many processes (length bucketing, chunk cache), "
+                             "0 uses the plain model")
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--rebuild", action="store_true", help="drop collection and checkpoint first")
+    args = parser.parse_args()
+
+    if args.embed_workers:
+        from bulk_embed import bulk_embedder
+        model = bulk_embedder(args.backend, args.embed_workers)
+    else:
+        from encoders import load_embedding_model
+        model = load_embedding_model(args.backend, EMBEDDING_MODEL_NAME)
+    store = (LocalStore(args.local_dir, vector_dtype=args.vector_dtype, keep_full=args.keep_full)
+             if args.store == "local" else MilvusStore())
+
+    ingest(args.collection, args.folder, store, model,
+           batch_size=args.batch_size,
+           workers=args.workers,
+           checkpoint_path=args.checkpoint,
+           rebuild=args.rebuild)
+    if args.embed_workers:
+        print(model.stats())
+        model.close()
@@ -1,10 +1,18 @@
 """functions for llms"""
 from __future__ import annotations
-from google.genai import types, Client
 from datetime import datetime
+from typing import TYPE_CHECKING, Iterator
+try:
+    from google.genai import types
+except ImportError:
+    # no google-genai, only fake_llm.FakeClient can answer and it takes its look-alike types
+    from fake_llm import types
+if TYPE_CHECKING:
+    from google.genai import Client
+from prompts import get_answer_prompt
 
-def run_llm(client:Client, system_instruction:str, messages:list[Content], llm_model_name:str,grounding:bool=True):
-    """runs llm call, returns response object from gemini"""
+def run_llm(client:Client, system_instruction:str, messages:list[Content], llm_model_name:str,grounding:bool=True,stream:bool=False):
+    """runs llm call, returns response object from gemini, or iterator of response chunks if stream is True"""
     if grounding:
         grounding_tool = types.Tool(
             google_search=types.GoogleSearch()
@@ -18,6 +26,10 @@ def run_llm(client:Client, system_instruction:str, messages:list[Content], llm_m
         config = types.GenerateContentConfig(
             system_instruction=system_instruction
         )
+    if stream:
+        return client.models.generate_content_stream(model=llm_model_name,
+                                                     contents=messages,
+                                                     config=config)
     response = client.models.generate_content(model=llm_model_name,
                                               contents=messages,
                                               config=config)
@@ -36,12 +48,22 @@ def handle_router(client:Client, messages:list[Content], llm_model_name:str,rout
     return response
 
 
-def handle_answer(client:Client, messages:list[Content], llm_model_name:str) -> types.GenerateContentResponse:
+def handle_answer(client:Client, messages:list[Content], llm_model_name:str, system_instruction:str|None=None, stream:bool=False) -> types.GenerateContentResponse | Iterator[types.GenerateContentResponse]:
+    """generate final answer, with stream=True chunks are yielded as gemini produces them"""
     current_time = datetime.today().strftime('%Y-%m-%d %H:%M:%S')
 
-    system_instructions = "prompt"
+    if system_instruction is None:
+        system_instruction = get_answer_prompt()
     response = run_llm(client,
-                       system_instruction=system_instructions,
+                       system_instruction=system_instruction,
                        messages=messages,
-                       llm_model_name=llm_model_name)
-    return response
\ No newline at end of file
+                       llm_model_name=llm_model_name,
+                       stream=stream)
+    return response
+
+
+def iter_text(chunks:Iterator[types.GenerateContentResponse]) -> Iterator[str]:
+    """yield text of streamed response chunks, skipping chunks without text (e.g. grounding metadata)"""
+    for chunk in chunks:
+        if chunk.text:
+            yield chunk.text
@@ -0,0 +1,231 @@
+"""
+offline load test of the chat turn pipeline.
+
+Replays a query corpus as concurrent chat sessions through pipeline.Pipeline, with
+fake_llm.FakeClient in place of gemini and fake_store.FakeStore in place of Milvus,
+both with configurable latency. The embedding model is the real one unless
+--encoder hash is given. Reports turns/s, per stage p50/p95/p99 from the traces
+and the process memory, per concurrency level.
+
+usage: python load_test.py --concurrency 1 4 16 --sessions 32 --turns 4
+       python load_test.py --encoder hash --llm-first-chunk 0.3 --search-latency 0.02 --output ./data/benchmarks/load.json
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import tracing
+from fake_llm import FakeClient
+from fake_store import FakeStore
+from pipeline import build_pipeline, new_conversation
+from prompts import REFORMULATION_SYS_PROMPT, ROUTING_SYSTEM_PROMPT
+
+RAG_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_QUERIES = os.path.join(RAG_DIR, "router_queries.jsonl")
+HASH_ENCODER_DIM = 384
+# reformulator instructions start with this, the query and collections are filled in after it
+REFORMULATION_HEAD = REFORMULATION_SYS_PROMPT.split("{user_query}")[0]
+
+
+class HashEncoder:
+    """
+    Deterministic stand-in for the embedding model, vectors seeded by the text hash.
+    Keeps the load test runnable without torch, routing and retrieval become random.
+    """
+
+    def __init__(self, dim:int=HASH_ENCODER_DIM):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, sentences, normalize_embeddings:bool=False, **kwargs):
+        single = isinstance(sentences, str)
+        vectors = []
+        for sentence in [sentences] if single else sentences:
+            seed = int.from_bytes(hashlib.sha1(sentence.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            vectors.append(vector / np.linalg.norm(vector) if normalize_embeddings else vector)
+        return vectors[0] if single else np.stack(vectors)
+
+
+def last_user_text(contents) -> str:
+    for content in reversed(contents):
+        if getattr(content, "role", None) == "user":
+            return " ".join(part.text or "" for part in content.parts)
+    return ""
+
+
+def fake_reply(answer:str, rag_share:float=1.0):
+    """
+    gemini stand-in replies: router and reformulator get valid json, every other call the answer.
+
+    Args:
+        answer: Text of answers and summaries
+        rag_share: Share of LLM routed turns that need retrieval, picked by the query hash
+    """
+    def reply(model, contents, config) -> str:
+        instruction = getattr(config, "system_instruction", None)
+        query = last_user_text(contents)
+        if instruction == ROUTING_SYSTEM_PROMPT:
+            rag = int(hashlib.sha1(query.encode("utf-8")).hexdigest(), 16) % 1000 < rag_share * 1000
+            return json.dumps({"NEEDS_RAG": "YES" if rag else "NO",
+                               "COLLECTIONS": ["NASA_Space_Biology", "Experiment_Collection"] if rag else [],
+                               "REASON": "load test"})
+        if instruction and instruction.startswith(REFORMULATION_HEAD):
+            # the reformulator instruction ends with "Collections: <selected keys>"
+            selected = instruction.split("Collections:")[-1].split("\n")[0]
+            return json.dumps({key: query if key in selected else "None"
+                               for key in ("NASA_Space_Biology", "Experiment_Collection")})
+        return answer
+    return reply
+
+
+def load_queries(path:str=DEFAULT_QUERIES) -> list[str]:
+    """queries of a jsonl file with a "query" field, or one query per line of a text file"""
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            queries.append(json.loads(line)["query"] if path.endswith(".jsonl") else line)
+    return queries
+
+
+def rss_mb() -> float:
+    """current resident memory of the process"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_level(model, client, store, queries:list[str], concurrency:int, sessions:int, turns:int,
+              embedding_model_name:str) -> dict:
+    """
+    Run sessions chat sessions of turns turns each, concurrency of them at a time, on a fresh pipeline.
+
+    Returns:
+        Throughput, error count, per stage latency percentiles and memory of the run
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        trace_path = os.path.join(tmp, "traces.jsonl")
+        pipeline = build_pipeline(model, client, store, embedding_model_name,
+                                  tracer=tracing.Tracer(trace_path=trace_path))
+        errors = []
+        lock = threading.Lock()
+
+        def session(index:int):
+            conversation = new_conversation()
+            for turn in range(turns):
+                query = queries[(index * turns + turn) % len(queries)]
+                try:
+                    pipeline.turn(conversation, query)
+                except Exception as e:
+                    with lock:
+                        errors.append(f"{type(e).__name__}: {e}")
+
+        rss_before = rss_mb()
+        calls_before = len(client.models.calls)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="session") as executor:
+            list(executor.map(session, range(sessions)))
+        wall_s = time.perf_counter() - start
+        pipeline.search_executor.shutdown()
+
+        stages = tracing.summarize(trace_path) if os.path.exists(trace_path) else {}
+
+    completed = sessions * turns - len(errors)
+    report = {"concurrency": concurrency,
+              "sessions": sessions,
+              "turns": sessions * turns,
+              "errors": len(errors),
+              "wall_s": wall_s,
+              "turns_per_s": completed / wall_s if wall_s else 0.0,
+              "llm_calls": len(client.models.calls) - calls_before,
+              "rss_mb": rss_mb(),
+              "rss_growth_mb": rss_mb() - rss_before,
+              "peak_rss_mb": peak_rss_mb(),
+              "stages": stages}
+    if errors:
+        report["first_error"] = errors[0]
+    # calls are only recorded for the report, do not let them pile up across levels
+    client.models.calls.clear()
+    return report
+
+
+def print_level(report:dict):
+    print(f"\nconcurrency {report['concurrency']:3}: {report['turns_per_s']:8.2f} turns/s "
+          f"({report['turns']} turns, {report['errors']} errors, {report['wall_s']:.1f}s) "
+          f"rss {report['rss_mb']:.0f}MB (+{report['rss_growth_mb']:.0f}) peak {report['peak_rss_mb']:.0f}MB")
+    for stage, stats in report["stages"].items():
+        print(f"  {stage:14} n={stats['count']:6} p50={stats['p50_ms']:9.1f}ms "
+              f"p95={stats['p95_ms']:9.1f}ms p99={stats['p99_ms']:9.1f}ms")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="replay queries as concurrent chat sessions against fake gemini and milvus")
+    parser.add_argument("--queries", default=DEFAULT_QUERIES, help="jsonl with a query field, or one query per line")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--sessions", type=int, default=32, help="chat sessions per concurrency level")
+    parser.add_argument("--turns", type=int, default=4, help="turns per session")
+    parser.add_argument("--encoder", choices=["model", "hash"], default="model",
+                        help="real embedding model (EMBEDDING_BACKEND) or hashed random vectors")
+    parser.add_argument("--llm-first-chunk", type=float, default=0.3, help="seconds to first chunk of every gemini call")
+    parser.add_argument("--llm-chunk-delay", type=float, default=0.02, help="seconds between streamed chunks")
+    parser.add_argument("--output-tokens", type=int, default=300, help="tokens of every answer")
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--rag-share", type=float, default=0.8, help="share of llm routed turns needing retrieval")
+    parser.add_argument("--search-latency", type=float, default=0.02, help="seconds per collection search")
+    parser.add_argument("--publications", type=int, default=20000, help="rows of the fake publications collection")
+    parser.add_argument("--osdr", type=int, default=5000, help="rows of the fake osdr collection")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the report as json")
+    args = parser.parse_args()
+
+    if args.encoder == "hash":
+        model = HashEncoder()
+    else:
+        from resources import load_model
+        model = load_model()
+    from resources import EMBEDDING_MODEL_NAME
+
+    client = FakeClient(fake_reply("The fake answer. ", args.rag_share),
+                        first_chunk_delay=args.llm_first_chunk,
+                        chunk_delay=args.llm_chunk_delay,
+                        output_tokens=args.output_tokens,
+                        jitter=args.llm_jitter,
+                        seed=args.seed)
+    store = FakeStore({"publications": args.publications, "osdr": args.osdr},
+                      dim=model.get_sentence_embedding_dimension(),
+                      latency=args.search_latency,
+                      seed=args.seed)
+    queries = load_queries(args.queries)
+    print(f"{len(queries)} queries, fake store {store.memory_bytes() / 2 ** 20:.0f}MB of vectors, rss {rss_mb():.0f}MB")
+
+    report = {"args": vars(args), "levels": []}
+    for concurrency in args.concurrency:
+        level = run_level(model, client, store, queries, concurrency, args.sessions, args.turns,
+                          EMBEDDING_MODEL_NAME)
+        print_level(level)
+        report["levels"].append(level)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
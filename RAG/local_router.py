@@ -0,0 +1,234 @@
+"""
+in-process query router on top of the already loaded embedding model.
+
+The query embedding is compared with labelled prototype queries per route. Confident
+decisions are answered locally, uncertain ones return None so the caller falls back
+to the LLM router.
+
+The app only routes locally by default once router_report.json, written by the
+evaluation below on router_queries.jsonl, shows the local router about as exact as the
+LLM router on the turns it answers. ROUTER=local / ROUTER=llm override the report.
+
+usage: python local_router.py            # accuracy/latency report vs the LLM router, writes router_report.json
+       python local_router.py --local-only --output local_report.json
+"""
+from __future__ import annotations
+import json
+import os
+import time
+import numpy as np
+
+PROTOTYPES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "router_prototypes.json")
+EVAL_QUERIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "router_queries.jsonl")
+ROUTER_REPORT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "router_report.json")
+# exact accuracy the local router may lose against the LLM router and still be used by default
+MAX_ACCURACY_LOSS = 0.02
+
+NO_RAG = "NO_RAG"
+COLLECTION_LABELS = ["NASA_Space_Biology", "Experiment_Collection"]
+
+
+def load_prototypes(path:str=PROTOTYPES_PATH) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class LocalRouter:
+    """
+    Nearest-prototype router.
+
+    Each label is scored by the mean cosine similarity of the query to its top_n
+    closest prototypes. RAG is needed when the best collection beats NO_RAG, and a
+    collection is selected when it is within collection_margin of the best one.
+
+    Args:
+        prototype_embeddings: Label -> normalized embeddings of its prototype queries
+        margin: Minimum score gap between RAG and NO_RAG to answer locally
+        collection_margin: Collections within this gap of the best one are all selected
+        top_n: Prototypes averaged per label
+    """
+
+    def __init__(self, prototype_embeddings:dict, margin:float=0.05, collection_margin:float=0.03, top_n:int=3):
+        self.prototype_embeddings = {label: np.asarray(embeddings, dtype=np.float32)
+                                     for label, embeddings in prototype_embeddings.items()}
+        self.margin = margin
+        self.collection_margin = collection_margin
+        self.top_n = top_n
+
+    @classmethod
+    def from_model(cls, model, prototypes:dict|None=None, **kwargs) -> "LocalRouter":
+        """embed prototype queries with the SentenceTransformer model"""
+        prototypes = prototypes or load_prototypes()
+        return cls({label: model.encode(queries, normalize_embeddings=True)
+                    for label, queries in prototypes.items()}, **kwargs)
+
+    def scores(self, query_embedding) -> dict:
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        scores = {}
+        for label, embeddings in self.prototype_embeddings.items():
+            similarities = embeddings @ query_embedding
+            top = np.sort(similarities)[-self.top_n:]
+            scores[label] = float(top.mean())
+        return scores
+
+    def route(self, query_embedding) -> dict | None:
+        """
+        Route a query embedding.
+
+        Returns:
+            Route dict in the LLM router format, or None when the decision is uncertain
+        """
+        scores = self.scores(query_embedding)
+        best_collection = max(COLLECTION_LABELS, key=scores.get)
+        gap = scores[best_collection] - scores[NO_RAG]
+        if abs(gap) < self.margin:
+            return None
+        if gap < 0:
+            return {"NEEDS_RAG": "NO",
+                    "COLLECTIONS": [],
+                    "REASON": f"local router, closest to general questions ({gap:+.2f})"}
+        collections = [label for label in COLLECTION_LABELS
+                       if scores[best_collection] - scores[label] <= self.collection_margin]
+        return {"NEEDS_RAG": "YES",
+                "COLLECTIONS": collections,
+                "REASON": f"local router, closest to {best_collection} ({gap:+.2f})"}
+
+
+def normalize_route(route:dict) -> tuple[bool, list]:
+    """(needs rag, sorted collections) of a local or LLM route, for comparison with labels"""
+    needs_rag = "YES" in str(route.get("NEEDS_RAG", "")).upper()
+    collections = route.get("COLLECTIONS") or []
+    if isinstance(collections, str):
+        collections = collections.split(",")
+    # the LLM router may answer with spaces instead of underscores
+    names = {" ".join(label.split("_")).lower(): label for label in COLLECTION_LABELS}
+    collections = sorted({names[c.strip().replace("_", " ").lower()] for c in collections
+                          if c.strip().replace("_", " ").lower() in names})
+    return needs_rag, collections if needs_rag else []
+
+
+def percentile(values:list, q:float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def evaluate(router:LocalRouter, model, queries:list[dict], llm_route=None) -> dict:
+    """
+    Accuracy and latency of the local router (and optionally the LLM router) on labelled queries.
+
+    Args:
+        router: Local router
+        model: SentenceTransformer for query embeddings
+        queries: Dicts with "query", "needs_rag" and "collections"
+        llm_route: Callable query -> route dict, skipped if None
+
+    Returns:
+        Report dict per router
+    """
+    def summarize(results, latencies, answered):
+        correct_rag = sum(r[0] == q["needs_rag"] for r, q in results)
+        correct_all = sum(r == (q["needs_rag"], sorted(q["collections"])) for r, q in results)
+        return {"answered": answered,
+                "needs_rag_accuracy": correct_rag / len(results) if results else 0.0,
+                "exact_accuracy": correct_all / len(results) if results else 0.0,
+                "latency_ms_p50": percentile(latencies, 50),
+                "latency_ms_p95": percentile(latencies, 95)}
+
+    report = {}
+    local_results, local_latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        route = router.route(model.encode(q["query"], normalize_embeddings=True))
+        local_latencies.append((time.perf_counter() - start) * 1000)
+        if route is not None:
+            local_results.append((normalize_route(route), q))
+    report["local"] = summarize(local_results, local_latencies, len(local_results))
+    report["local"]["coverage"] = len(local_results) / len(queries)
+
+    if llm_route is not None:
+        llm_results, llm_latencies, failures = [], [], 0
+        for q in queries:
+            start = time.perf_counter()
+            try:
+                route = llm_route(q["query"])
+            except Exception as e:
+                failures += 1
+                print(f"LLM router failed on '{q['query']}': {e}")
+                continue
+            finally:
+                llm_latencies.append((time.perf_counter() - start) * 1000)
+            llm_results.append((normalize_route(route), q))
+        report["llm"] = summarize(llm_results, llm_latencies, len(llm_results))
+        report["llm"]["failures"] = failures
+    return report
+
+
+def approved(report:dict) -> bool:
+    """True if an evaluate() report compared both routers and the local one is at most
+    MAX_ACCURACY_LOSS less exact than the LLM router on the turns it answered"""
+    local, llm = report.get("local"), report.get("llm")
+    if not local or not llm or not local["answered"]:
+        return False
+    return local["exact_accuracy"] >= llm["exact_accuracy"] - MAX_ACCURACY_LOSS
+
+
+def use_local_router(choice:str|None=None, report_path:str=ROUTER_REPORT_PATH) -> bool:
+    """
+    Whether turns are routed locally first. ROUTER=local and ROUTER=llm decide directly,
+    the default "auto" follows the evaluation report and keeps the LLM router without one.
+    """
+    choice = choice or os.getenv("ROUTER", "auto")
+    if choice != "auto":
+        return choice == "local"
+    if not os.path.exists(report_path):
+        return False
+    with open(report_path, "r", encoding="utf-8") as f:
+        return approved(json.load(f))
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from encoders import load_embedding_model
+
+    parser = argparse.ArgumentParser(description="evaluate the local router against labelled queries and the LLM router")
+    parser.add_argument("--queries", default=EVAL_QUERIES_PATH)
+    parser.add_argument("--margin", type=float, default=0.05)
+    parser.add_argument("--collection-margin", type=float, default=0.03)
+    parser.add_argument("--local-only", action="store_true", help="skip the LLM router")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default=os.getenv("EMBEDDING_BACKEND", "torch"))
+    parser.add_argument("--output", default=ROUTER_REPORT_PATH,
+                        help="write the report as json, the default path gates the app's ROUTER=auto")
+    args = parser.parse_args()
+    load_dotenv()
+
+    model = load_embedding_model(args.backend)
+    router = LocalRouter.from_model(model, margin=args.margin, collection_margin=args.collection_margin)
+    with open(args.queries, "r", encoding="utf-8") as f:
+        queries = [json.loads(line) for line in f if line.strip()]
+
+    llm_route = None
+    if not args.local_only:
+        from google.genai import Client, types
+        from llm import handle_router
+        from prompts import ROUTING_SYSTEM_PROMPT
+        from utils import clean_response
+        client = Client()
+
+        def llm_route(query):
+            messages = [types.Content(role="user", parts=[types.Part.from_text(text=query)])]
+            response = handle_router(client=client,
+                                     messages=messages,
+                                     llm_model_name="gemini-2.0-flash-lite",
+                                     routing_prompt=ROUTING_SYSTEM_PROMPT)
+            return clean_response(response.text)
+
+    report = evaluate(router, model, queries, llm_route)
+    report["config"] = {"backend": args.backend, "margin": args.margin, "collection_margin": args.collection_margin,
+                        "queries": len(queries)}
+    report["approved"] = approved(report)
+    print(json.dumps(report, indent=4))
+    if args.local_only and args.output == ROUTER_REPORT_PATH:
+        print(f"Not writing {ROUTER_REPORT_PATH}: a local only report cannot approve the local router")
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
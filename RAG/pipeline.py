@@ -0,0 +1,425 @@
+"""
+chat turn pipeline without streamlit: route -> reformulate -> search -> context -> answer.
+
+app.py builds one Pipeline per process from the shared resources and calls turn()
+for every user message; load_test.py builds the same pipeline on fake stand-ins.
+"""
+from __future__ import annotations
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import tracing
+from resources import current
+from answer_cache import AnswerCache
+from context_builder import CONTEXT_TOKEN_BUDGET, build_context
+from conversation import Conversation, ROUTER_WINDOW, transcript
+from embedding_cache import QueryEmbeddingCache
+from encoders import embedding_model_id
+from filters import clean_filters
+from llm import handle_answer, handle_router, iter_text, run_llm, types
+from local_router import LocalRouter, normalize_route, use_local_router
+from prompts import ROUTING_SYSTEM_PROMPT, SUMMARY_SYS_PROMPT, get_answer_prompt, get_reformulation_prompt
+from tracing import get_tracer, traced_stream, usage_tokens
+from utils import clean_response
+from vector_store import TWO_PHASE_SEARCH, RowCache, index_config, two_phase_search
+
+LLM_MODEL_NAME = "gemini-2.5-flash"
+ROUTER_LLM_MODEL_NAME = "gemini-2.0-flash-lite"
+
+# reformulator key -> collection searched for it
+SEARCH_ROUTES = {
+    "NASA_Space_Biology": "publications",
+    "Experiment_Collection": "osdr",
+}
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "5"))
+# prompt token budget of the retrieved context
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", str(CONTEXT_TOKEN_BUDGET)))
+
+# used when the LLM router reply cannot be parsed, retrieval is cheaper than a wrong answer
+DEFAULT_ROUTE = {"NEEDS_RAG": "YES", "COLLECTIONS": ["NASA_Space_Biology", "Experiment_Collection"],
+                 "REASON": "router reply could not be parsed"}
+
+
+def needs_rag(route:dict) -> bool:
+    """router may answer YES, "YES" or ["YES"]"""
+    return "YES" in str(route.get("NEEDS_RAG", "")).upper()
+
+
+def route_collections(route:dict) -> list[str]:
+    """reformulator keys of the collections a route selected, all of them if it names none"""
+    return normalize_route(route)[1] or list(SEARCH_ROUTES)
+
+
+def new_conversation() -> Conversation:
+    return Conversation(max_recent=int(os.getenv("MAX_RECENT_MESSAGES", "12")),
+                        keep_recent=int(os.getenv("KEEP_RECENT_MESSAGES", "6")))
+
+
+class Pipeline:
+    """
+    Everything a chat turn needs, shared by all sessions of a process. Model, client and
+    store can be resources.Resource handles: they are looked up on every use, so a
+    resource dropped by a health check is replaced without writing to the shared pipeline.
+
+    Args:
+        model: Embedding model with the SentenceTransformer encode() contract, or its Resource
+        client: google.genai Client or a fake_llm.FakeClient, or its Resource
+        store: Vector store (see vector_store.py) or a fake_store.FakeStore, or its Resource
+        query_cache: Query embedding cache
+        answer_cache: Cache of answers grounded in retrieved docs
+        local_router: Router deciding confident turns without the LLM, None sends every turn to the LLM router
+        search_executor: Thread pool the collection searches run on
+        tracer: Tracer receiving one trace per turn
+        search_params: Search params per collection, from index_config() of the store kind if None
+        retrieval: RetrievalClient of retrieval_service.py, searches go through it instead of
+            encoding and searching in process
+        row_cache: Hydrated rows of two phase searches, None searches with all fields in one call
+    """
+
+    def __init__(self, model, client, store, query_cache:QueryEmbeddingCache, answer_cache:AnswerCache,
+                 local_router:LocalRouter|None, search_executor:ThreadPoolExecutor, tracer:tracing.Tracer,
+                 search_params:dict|None=None, retrieval=None, row_cache:RowCache|None=None):
+        self._model = model
+        self._client = client
+        self._store = store
+        self.query_cache = query_cache
+        self.answer_cache = answer_cache
+        self.local_router = local_router
+        self.search_executor = search_executor
+        self.tracer = tracer
+        self.retrieval = retrieval
+        self.row_cache = row_cache
+        kind = getattr(self.store, "kind", "milvus")
+        self.search_params = search_params or {name: index_config(name, kind)[1] for name in SEARCH_ROUTES.values()}
+        self.searches = {"publications": self.search_publications, "osdr": self.search_osdr}
+
+    @property
+    def model(self):
+        return current(self._model)
+
+    @property
+    def client(self):
+        return current(self._client)
+
+    @property
+    def store(self):
+        return current(self._store)
+
+    def search_collection(self, collection_name: str, query: str, output_fields: list, k: int = 5,
+                          query_embedding=None, timeout: float | None = None, filters: dict | None = None):
+        """
+        Generic search function for any vector store collection.
+
+        Args:
+            collection_name: Name of the collection to search
+            query: Search query text
+            output_fields: List of field names to retrieve
+            k: Number of results to return
+            query_embedding: Precomputed embedding of query, encoded here if None
+            timeout: Search timeout in seconds
+            filters: Structured filters (see filters.ALLOWED_FILTERS), pushed down into the search
+
+        Returns:
+            Raw search hits from the vector store
+        """
+        # the retrieval service encodes the query text in batches with other sessions' queries
+        if self.retrieval is not None:
+            with self.tracer.span("search", collection=collection_name, k=k, remote=True) as span:
+                hits = self.retrieval.search(collection_name, query, output_fields, k=k, timeout=timeout,
+                                             filters=clean_filters(collection_name, filters))
+                scores = [hit.score for hit in hits]
+                span.set(hits=len(hits), top_score=max(scores, default=None), min_score=min(scores, default=None))
+            return hits
+
+        # Get collection
+        if not self.store.has_collection(collection_name):
+            raise ValueError(f"Collection '{collection_name}' does not exist")
+
+        # Generate query embedding, repeated queries are served from the cache
+        if query_embedding is None:
+            query_embedding = self.query_cache.encode(self.model, query)
+
+        # Perform search, in two phases the fields of the deduplicated top k only are fetched
+        with self.tracer.span("search", collection=collection_name, k=k) as span:
+            if self.row_cache is not None:
+                hits, counts = two_phase_search(self.store,
+                                                collection_name,
+                                                query_embedding,
+                                                output_fields,
+                                                k=k,
+                                                params=self.search_params[collection_name],
+                                                timeout=timeout,
+                                                filters=clean_filters(collection_name, filters),
+                                                cache=self.row_cache)
+                span.set(**counts)
+            else:
+                hits = self.store.search(collection_name,
+                                         query_embedding,
+                                         output_fields,
+                                         k=k,
+                                         params=self.search_params[collection_name],
+                                         timeout=timeout,
+                                         filters=clean_filters(collection_name, filters))
+            scores = [hit.score for hit in hits]
+            span.set(hits=len(hits), top_score=max(scores, default=None), min_score=min(scores, default=None))
+        return hits
+
+    def search_publications(self, query: str, k: int = 5, query_embedding=None, timeout: float | None = None,
+                            filters: dict | None = None):
+        """Search the publications collection, filters: PMC_code, date_from, date_to."""
+        output_fields = ["PMC_code", "name", "authors", "date", "doi", "content"]
+        results = self.search_collection("publications", query, output_fields, k, query_embedding, timeout, filters)
+
+        formatted_results = []
+        for hit in results:
+            formatted_results.append({
+                "id": hit.id,
+                "PMC_code": hit.entity.get("PMC_code"),
+                "name": hit.entity.get("name"),
+                "authors": hit.entity.get("authors"),
+                "date": hit.entity.get("date"),
+                "doi": hit.entity.get("doi"),
+                "text": hit.entity.get("content"),
+                "score": hit.score
+            })
+
+        return formatted_results
+
+    def search_osdr(self, query: str, k: int = 5, query_embedding=None, timeout: float | None = None,
+                    filters: dict | None = None):
+        """Search the osdr collection, filters: study_id, type, organisms."""
+        output_fields = ["study_id", "name", "organisms", "authors", "doi", "link", "type", "protocole_name", "text"]
+        results = self.search_collection("osdr", query, output_fields, k, query_embedding, timeout, filters)
+
+        formatted_results = []
+        for hit in results:
+            formatted_results.append({
+                "id": hit.id,
+                "study_id": hit.entity.get("study_id"),
+                "name": hit.entity.get("name"),
+                "organisms": hit.entity.get("organisms"),
+                "authors": hit.entity.get("authors"),
+                "doi": hit.entity.get("doi"),
+                "link": hit.entity.get("link"),
+                "type": hit.entity.get("type"),
+                "protocol_name": hit.entity.get("protocole_name"),
+                "text": hit.entity.get("text"),
+                "score": hit.score
+            })
+
+        return formatted_results
+
+    def embed(self, query:str):
+        """query embedding from the cache or the model, traced with its cache result"""
+        with self.tracer.span("embed", cache="query_embedding") as span:
+            embedding, source = self.query_cache.encode_with_source(self.model, query)
+            span.set(cache_result=source)
+        return embedding
+
+    def get_route(self, conversation:Conversation):
+        """get json formatted route if rag is needed or not and which collections should be searched"""
+        with self.tracer.span("route") as span:
+            # the same user turns the LLM router sees, a bare follow-up has no topic of its own
+            route = None
+            if self.local_router is not None:
+                route = self.local_router.route(self.embed(conversation.user_text(ROUTER_WINDOW)))
+            if route is not None:
+                span.set(source="local")
+                return route
+
+            router_label = handle_router(client=self.client,
+                                         llm_model_name=ROUTER_LLM_MODEL_NAME,
+                                         messages=conversation.window(ROUTER_WINDOW),
+                                         routing_prompt=ROUTING_SYSTEM_PROMPT)
+            span.set(source="llm", **usage_tokens(router_label))
+
+        try:
+            return clean_response(router_label.text)
+        except Exception as e:
+            print(f"Router reply could not be parsed: {e}")
+            return DEFAULT_ROUTE
+
+    def reformulate_prompt(self, prompt:str, conversation:Conversation, collections:list[str]):
+        """reformulate user prompt to make it more searchable in rag, for the collections the router selected"""
+        with self.tracer.span("reformulate", collections=len(collections)) as span:
+            response = run_llm(client=self.client,
+                               system_instruction=get_reformulation_prompt(prompt, collections),
+                               messages=conversation.window(ROUTER_WINDOW),
+                               llm_model_name=ROUTER_LLM_MODEL_NAME,
+                               grounding=False)
+            span.set(**usage_tokens(response))
+
+        return clean_response(response.text)
+
+    def run_search(self, reformulated_queries:dict, k:int=4, timeout:float=SEARCH_TIMEOUT,
+                   collections:list[str]|None=None):
+        """
+        Search all routed collections in parallel and merge hits by score.
+        Only the reformulator keys in collections are searched, if given.
+
+        Each distinct query string is encoded once, then every collection is searched
+        on the shared thread pool. Collections that miss the timeout are skipped so a
+        slow one cannot stall the turn. Filters the reformulator put under "FILTERS"
+        are passed to the matching collection search.
+
+        A running search cannot be cancelled, cancel() only drops searches still queued.
+        Each search therefore gets the time left until the turn deadline as its store
+        timeout, so a stalled collection frees its pool thread shortly after the turn gave up on it.
+        """
+        deadline = time.monotonic() + timeout
+        routed = {key: query for key, query in reformulated_queries.items()
+                  if query and query != "None" and key in SEARCH_ROUTES
+                  and (collections is None or key in collections)}
+        # with the retrieval service queries are encoded there
+        embeddings = {} if self.retrieval is not None else {query: self.embed(query) for query in set(routed.values())}
+        filters = reformulated_queries.get("FILTERS") or {}
+        if not isinstance(filters, dict):
+            filters = {}
+
+        futures = {
+            self.search_executor.submit(tracing.propagate(self._search_until), deadline,
+                                        self.searches[SEARCH_ROUTES[key]], query, k,
+                                        embeddings.get(query), filters.get(key)): key
+            for key, query in routed.items()
+        }
+        done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+
+        docs = []
+        for future in done:
+            try:
+                docs.extend(future.result())
+            except Exception as e:
+                print(f"Search in {futures[future]} failed: {e}")
+        for future in not_done:
+            future.cancel()
+            print(f"Search in {futures[future]} timed out after {timeout}s")
+
+        docs.sort(key=lambda doc: doc["score"], reverse=True)
+        return docs
+
+    @staticmethod
+    def _search_until(deadline:float, search, query:str, k:int, query_embedding, filters:dict|None):
+        """run a collection search with the time left until deadline as its timeout"""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("queued past the search deadline")
+        return search(query, k, query_embedding, remaining, filters)
+
+    def get_llm_answer(self, conversation:Conversation, rag_docs=None, stream=False):
+        """answer last user message from the recent messages, summary of older ones and retrieved docs, streamed if stream is True"""
+        with self.tracer.span("context") as span:
+            context, stats = build_context(rag_docs, CONTEXT_TOKEN_BUDGET)
+            span.set(**stats)
+        return handle_answer(client=self.client,
+                             messages=conversation.recent(),
+                             llm_model_name=LLM_MODEL_NAME,
+                             system_instruction=get_answer_prompt(context, summary=conversation.summary),
+                             stream=stream)
+
+    def summarize_turns(self, summary:str|None, messages:list[dict]) -> str:
+        """fold old messages into the rolling conversation summary with the router model"""
+        text = f"Previous summary: {summary or ''}\n\nConversation:\n{transcript(messages)}"
+        with self.tracer.span("summarize", messages=len(messages)) as span:
+            response = run_llm(client=self.client,
+                               system_instruction=SUMMARY_SYS_PROMPT,
+                               messages=[types.Content(role="user", parts=[types.Part.from_text(text=text)])],
+                               llm_model_name=ROUTER_LLM_MODEL_NAME,
+                               grounding=False)
+            span.set(**usage_tokens(response))
+        return response.text.strip()
+
+    def retrieve_docs(self, conversation:Conversation):
+        """route the turn and run retrieval if the router asks for it, returns (docs, reformulated queries)"""
+        route = self.get_route(conversation)
+        if not needs_rag(route):
+            return None, None
+        collections = route_collections(route)
+        reformulated_queries = self.reformulate_prompt(conversation.last_message, conversation, collections)
+        # queries for collections the router did not select are neither searched nor cached on
+        reformulated_queries = {key: query for key, query in reformulated_queries.items()
+                                if key not in SEARCH_ROUTES or key in collections}
+        return self.run_search(reformulated_queries, collections=collections), reformulated_queries
+
+    def answer_cache_embedding(self, reformulated_queries:dict):
+        """mean of the reformulated query embeddings, already cached by run_search"""
+        queries = {query for key, query in reformulated_queries.items()
+                   if query and query != "None" and key in SEARCH_ROUTES}
+        embedding = np.mean([self.query_cache.encode(self.model, query) for query in sorted(queries)], axis=0)
+        return embedding / np.linalg.norm(embedding)
+
+    def turn(self, conversation:Conversation, query:str, render=None) -> str:
+        """
+        Run one chat turn: retrieve, answer, and fold old messages into the summary.
+
+        Args:
+            conversation: Chat state of the session, the query and the answer are appended to it
+            query: User message
+            render: Callable taking an iterator of answer text chunks and returning the full
+                text, e.g. st.write_stream. Chunks are joined if None
+
+        Returns:
+            Answer text
+        """
+        render = render or "".join
+        # one trace per turn, spans of every stage below are attached to it
+        with self.tracer.turn(messages=len(conversation) + 1) as turn:
+            conversation.append("user", query)
+
+            rag_docs, reformulated_queries = self.retrieve_docs(conversation)
+            turn.set(rag=bool(rag_docs), docs=len(rag_docs or []))
+
+            # only answers grounded in retrieved docs are cached, others depend on the whole chat
+            response_text = None
+            if rag_docs:
+                with self.tracer.span("answer_cache", cache="answer") as span:
+                    cache_embedding = self.answer_cache_embedding(reformulated_queries)
+                    response_text = self.answer_cache.get(cache_embedding, rag_docs)
+                    span.set(cache_result="hit" if response_text is not None else "miss")
+
+            if response_text is not None:
+                response_text = render(iter([response_text]))
+            else:
+                # answer chunks are rendered as they arrive, render returns the full text
+                span = self.tracer.start_span("answer", rag=bool(rag_docs))
+                chunks = self.get_llm_answer(conversation, rag_docs, stream=True)
+                response_text = render(iter_text(traced_stream(chunks, span)))
+                if rag_docs:
+                    self.answer_cache.put(cache_embedding, rag_docs, response_text)
+
+            conversation.append("model", response_text)
+
+            # after the answer is rendered, so summarizing never delays it
+            conversation.fold(self.summarize_turns)
+        return response_text
+
+
+def build_pipeline(model, client, store, embedding_model_name:str, tracer:tracing.Tracer|None=None,
+                   search_params:dict|None=None, retrieval=None) -> Pipeline:
+    """pipeline with caches, router and search pool configured from the environment like the app,
+    searches go through the retrieval service of RETRIEVAL_URL if it is set.
+    model, client and store may be resources.Resource handles, see Pipeline"""
+    if retrieval is None:
+        from retrieval_service import get_retrieval_client
+        retrieval = get_retrieval_client()
+    query_cache = QueryEmbeddingCache(embedding_model_id(model_name=embedding_model_name),
+                                      max_size=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+                                      persist_dir=os.getenv("QUERY_CACHE_DIR"),
+                                      dim=current(model).get_sentence_embedding_dimension())
+    answer_cache = AnswerCache(threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+                               ttl=float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600))),
+                               max_size=int(os.getenv("ANSWER_CACHE_SIZE", "512")))
+    # prototype embeddings are computed once per pipeline, the local router is used when
+    # ROUTER=local or when router_report.json approves it (see local_router.use_local_router)
+    local_router = None
+    if use_local_router():
+        local_router = LocalRouter.from_model(current(model),
+                                              margin=float(os.getenv("LOCAL_ROUTER_MARGIN", "0.05")),
+                                              collection_margin=float(os.getenv("LOCAL_ROUTER_COLLECTION_MARGIN", "0.03")))
+    # a turn holds one thread per routed collection for at most SEARCH_TIMEOUT,
+    # size SEARCH_WORKERS for the concurrent turns times the collections searched
+    search_executor = ThreadPoolExecutor(max_workers=int(os.getenv("SEARCH_WORKERS", "8")),
+                                         thread_name_prefix="search")
+    row_cache = RowCache() if TWO_PHASE_SEARCH else None
+    return Pipeline(model, client, store, query_cache, answer_cache, local_router, search_executor,
+                    tracer or get_tracer(), search_params, retrieval, row_cache)
@@ -69,12 +69,21 @@ You receive:
 
 ---
 
+### FILTERS
+
+If the query clearly restricts the search, also return filters under "FILTERS". Only use filters that are explicit in the query, otherwise leave them out.
+- "NASA_Space_Biology": "date_from" / "date_to" (year, e.g. "2015") for publication date ranges, "PMC_code" for named PMC articles.
+- "Experiment_Collection": "type" = "protocole" for questions only about how an experiment was done (methods, protocols, sample handling) or "description" for questions about what a study is, "study_id" for named studies (e.g. "OSD-48"), "organisms" for a named organism (e.g. "Mus musculus").
+
+---
+
 ### OUTPUT FORMAT
 
-Always return a valid JSON object with two keys:
+Always return a valid JSON object with two keys, plus "FILTERS" if any filter applies:
 {
   "NASA_Space_Biology": "<reformulated query or None>",
-  "Experiment_Collection": "<reformulated query or None>"
+  "Experiment_Collection": "<reformulated query or None>",
+  "FILTERS": {"Experiment_Collection": {"type": "protocole"}}
 }
 
 Do not include any other text, commentary, or explanation.
@@ -94,6 +103,14 @@ Collections: {collections}
 }
 """
 
+SUMMARY_SYS_PROMPT = """
+You keep a running summary of a conversation between a user and a NASA space biology learning assistant.
+You get the previous summary (may be empty) and the next part of the conversation.
+Return an updated summary in at most 150 words: topics, studies and experiments discussed (keep PMC codes and OSD ids),
+facts the user shared about themselves or their knowledge level, and open questions.
+Return only the summary text.
+"""
+
 ANSWER_SYS_PROMPT = """
 YOUR ROLE & APPROACH: 
 As a Learning Guide: 
@@ -156,8 +173,14 @@ If user needs LEARNING PATH:
 Now, provide your helpful, friendly response:
 """
 
-def get_answer_prompt(rag_docs=None, user_level="beginner"):
+def get_reformulation_prompt(user_query:str, collections:list[str]) -> str:
+    """reformulator instruction with the query and the collections selected by the router filled in"""
+    return REFORMULATION_SYS_PROMPT.replace("{user_query}", user_query).replace("{collections}", ", ".join(collections))
+
+def get_answer_prompt(rag_docs=None, user_level="beginner", summary=None):
     query_start = "You are a friendly NASA Space Biology Learning Companion. Your mission is to make space biology accessible, engaging, and easy to understand for students and beginners.\n"
     query_inserts = f'User\'s Knowledge Level: {user_level}\nRetrieved Space Biology Data: {rag_docs}'
+    if summary:
+        query_inserts += f'\nSummary of the Earlier Conversation: {summary}'
     return query_start+query_inserts+ANSWER_SYS_PROMPT
 
@@ -0,0 +1,145 @@
+"""
+process wide resources of the app: embedding model, gemini client and vector store.
+
+Streamlit re-executes app.py on every interaction, but imported modules stay loaded,
+so every resource here is created once per process, on first use. check_health()
+starts the health checks in a background thread at most once per interval, so a slow
+probe never holds up a rerun, and drops broken resources, which are created again on
+their next use. Heavy libraries are only imported by the loaders.
+With RETRIEVAL_URL set, model and store live in retrieval_service.py, shared by all app processes.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+
+EMBEDDING_MODEL_NAME = "multi-qa-MiniLM-L6-cos-v1"
+HEALTH_CHECK_MODEL_NAME = "gemini-2.0-flash-lite"
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "60"))
+
+
+class Resource:
+    """
+    Lazily created singleton with an optional health check.
+
+    Args:
+        name: Name used in logs and health reports
+        factory: Callable creating the resource
+        check: Callable taking the resource, raises if it is not usable
+    """
+
+    def __init__(self, name:str, factory, check=None):
+        self.name = name
+        self.factory = factory
+        self._check = check
+        self._value = None
+        self._lock = threading.Lock()
+        self.load_s = None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    start = time.perf_counter()
+                    self._value = self.factory()
+                    self.load_s = time.perf_counter() - start
+                    print(f"Loaded {self.name} in {self.load_s:.2f}s")
+        return self._value
+
+    def loaded(self) -> bool:
+        return self._value is not None
+
+    def reset(self):
+        with self._lock:
+            self._value = None
+
+    def check(self) -> dict:
+        """health of the resource, a failing resource is dropped and recreated on next get()"""
+        if self._value is None:
+            return {"ok": True, "loaded": False}
+        start = time.perf_counter()
+        try:
+            details = self._check(self._value) if self._check else None
+        except Exception as e:
+            print(f"Health check of {self.name} failed: {e}")
+            self.reset()
+            return {"ok": False, "loaded": False, "error": str(e)}
+        return {"ok": True, "loaded": True, "load_s": self.load_s,
+                "check_ms": (time.perf_counter() - start) * 1000, "details": details}
+
+
+def current(value):
+    """value of a Resource looked up now, anything else as is"""
+    return value.get() if isinstance(value, Resource) else value
+
+
+def load_model():
+    """SentenceTransformer, or the int8 ONNX export with EMBEDDING_BACKEND=onnx,
+    or the model of the retrieval service if RETRIEVAL_URL is set"""
+    from retrieval_service import RemoteEncoder, get_retrieval_client
+    if get_retrieval_client() is not None:
+        return RemoteEncoder(get_retrieval_client())
+    from encoders import load_embedding_model
+    return load_embedding_model(model_name=EMBEDDING_MODEL_NAME)
+
+
+def check_model(model):
+    model.encode("health check", normalize_embeddings=True)
+
+
+def load_client():
+    from google.genai import Client
+    return Client()
+
+
+def check_client(client):
+    return client.models.get(model=HEALTH_CHECK_MODEL_NAME).name
+
+
+def load_store():
+    """vector store, or the retrieval service (searches and health checks only) if RETRIEVAL_URL is set"""
+    from retrieval_service import get_retrieval_client
+    if get_retrieval_client() is not None:
+        return get_retrieval_client()
+    from vector_store import get_vector_store
+    return get_vector_store()
+
+
+def check_store(store):
+    return store.health_check()
+
+
+model = Resource("embedding_model", load_model, check_model)
+client = Resource("gemini_client", load_client, check_client)
+store = Resource("vector_store", load_store, check_store)
+RESOURCES = [model, client, store]
+
+# resources are fresh at import, the first check is due one interval later
+_last_check = {"time": time.monotonic(), "report": {}, "running": False}
+_check_lock = threading.Lock()
+
+
+def _run_checks():
+    try:
+        _last_check["report"] = {resource.name: resource.check() for resource in RESOURCES}
+    finally:
+        with _check_lock:
+            _last_check["time"] = time.monotonic()
+            _last_check["running"] = False
+
+
+def check_health(max_age:float=HEALTH_CHECK_INTERVAL, block:bool=False) -> dict:
+    """
+    Last health report of all resources. A new check is started if the last one is older
+    than max_age seconds, in a background thread unless block is True.
+    """
+    with _check_lock:
+        due = not _last_check["running"] and time.monotonic() - _last_check["time"] >= max_age
+        if due:
+            _last_check["running"] = True
+    if due:
+        if block:
+            _run_checks()
+        else:
+            threading.Thread(target=_run_checks, name="health-check", daemon=True).start()
+    return _last_check["report"]
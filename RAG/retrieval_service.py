@@ -0,0 +1,416 @@
+"""
+retrieval microservice: one embedding model and one vector store shared by all app processes.
+
+The service runs an asyncio HTTP/JSON server. Concurrent requests put their query
+on a queue and MicroBatcher encodes everything that arrived within a small window
+(or up to max_batch queries) in one model.encode call, off the event loop. The
+collection searches then run on a thread pool. Apps started with RETRIEVAL_URL
+load neither the model nor the store: RetrievalClient searches through the
+service and RemoteEncoder stands in for the model (router, answer cache).
+
+API (POST bodies and replies are json):
+    POST /search  {"collection", "query", "k", "fields", "filters", "timeout"} -> {"hits": [{"id", "score", "entity"}]}
+    POST /encode  {"texts": [...]} -> {"embeddings": [[...], ...]}
+    GET  /health  -> model dim, store health and batching stats
+
+usage: python retrieval_service.py serve --port 8700 --max-batch 32 --max-wait-ms 5
+       python retrieval_service.py bench --url http://127.0.0.1:8700 --concurrency 1 8 32
+"""
+from __future__ import annotations
+import asyncio
+import http.client
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import numpy as np
+from embedding_cache import normalize_query
+from vector_store import TWO_PHASE_SEARCH, LocalHit, RowCache, two_phase_search
+
+RETRIEVAL_URL = os.getenv("RETRIEVAL_URL")
+# a batch is encoded once max_batch queries wait or the first one waited max_wait_ms
+MAX_BATCH = int(os.getenv("RETRIEVAL_MAX_BATCH", "32"))
+MAX_WAIT_MS = float(os.getenv("RETRIEVAL_MAX_WAIT_MS", "5"))
+SEARCH_WORKERS = int(os.getenv("RETRIEVAL_SEARCH_WORKERS", "16"))
+REQUEST_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "10"))
+
+DEFAULT_QUERIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "router_queries.jsonl")
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent encode requests into batches.
+
+    Args:
+        encode: Blocking callable, list of texts -> array of normalized embeddings
+        max_batch: Most texts per encode call
+        max_wait: Seconds the first text of a batch waits for more
+    """
+
+    def __init__(self, encode, max_batch:int=MAX_BATCH, max_wait:float=MAX_WAIT_MS / 1000):
+        self._encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # one encode at a time, the model already uses all cores for a batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode")
+        self._queue = None
+        self._task = None
+        self.batches = 0
+        self.texts = 0
+        self.encode_s = 0.0
+
+    def start(self):
+        """start the batching loop, called from the running event loop"""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def encode(self, text:str) -> np.ndarray:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _next_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            # whatever is queued already joins without waiting
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            # identical queries of different sessions are encoded once
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            start = time.perf_counter()
+            try:
+                vectors = await loop.run_in_executor(self._executor, self._encode, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            self.encode_s += time.perf_counter() - start
+            by_text = dict(zip(texts, vectors))
+            for text, future in batch:
+                if not future.done():
+                    future.set_result(by_text[text])
+
+    def stats(self) -> dict:
+        return {"batches": self.batches,
+                "texts": self.texts,
+                "mean_batch": self.texts / self.batches if self.batches else 0.0,
+                "encode_s": self.encode_s}
+
+
+class RetrievalService:
+    """
+    Search and encode handlers of the server, sharing one model, store and query cache.
+
+    Args:
+        model: Embedding model with the SentenceTransformer encode() contract
+        store: Vector store (see vector_store.py)
+        query_cache: QueryEmbeddingCache checked before a query is batched, None to always encode
+        search_params: Search params per collection, from index_config() if missing
+        max_batch: See MicroBatcher
+        max_wait: See MicroBatcher
+        search_workers: Threads running store searches
+        row_cache: Hydrated rows of two phase searches, None searches with all fields in one call
+    """
+
+    def __init__(self, model, store, query_cache=None, search_params:dict|None=None, max_batch:int=MAX_BATCH,
+                 max_wait:float=MAX_WAIT_MS / 1000, search_workers:int=SEARCH_WORKERS,
+                 row_cache:RowCache|None=None):
+        self.model = model
+        self.store = store
+        self.query_cache = query_cache
+        self.row_cache = row_cache
+        self.search_params = search_params or {}
+        self.batcher = MicroBatcher(self.encode_batch, max_batch, max_wait)
+        self._search_executor = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="search")
+        self.requests = 0
+
+    def encode_batch(self, texts:list[str]) -> np.ndarray:
+        return self.model.encode(texts, normalize_embeddings=True, batch_size=len(texts))
+
+    async def embed(self, query:str) -> np.ndarray:
+        if self.query_cache is not None:
+            vector = self.query_cache.get(query)
+            if vector is not None:
+                return vector
+        vector = await self.batcher.encode(normalize_query(query))
+        if self.query_cache is not None:
+            vector = self.query_cache.put(query, vector)
+        return vector
+
+    def params(self, collection:str) -> dict:
+        if collection not in self.search_params:
+            from vector_store import index_config
+            self.search_params[collection] = index_config(collection, getattr(self.store, "kind", "milvus"))[1]
+        return self.search_params[collection]
+
+    async def search(self, request:dict) -> tuple[int, dict]:
+        collection = request["collection"]
+        fields = request.get("fields") or []
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(self._search_executor, self.store.has_collection, collection):
+            return 404, {"error": f"Collection '{collection}' does not exist"}
+        embedding = await self.embed(request["query"])
+        hits = await loop.run_in_executor(self._search_executor, self.search_store, collection, embedding,
+                                          fields, int(request.get("k", 5)), request.get("timeout"),
+                                          request.get("filters"))
+        return 200, {"hits": [{"id": hit.id, "score": hit.score,
+                               "entity": {name: hit.entity.get(name) for name in fields}}
+                              for hit in hits]}
+
+    def search_store(self, collection:str, embedding, fields:list, k:int, timeout:float|None,
+                     filters:dict|None) -> list:
+        if self.row_cache is None:
+            return self.store.search(collection, embedding, fields, k=k, params=self.params(collection),
+                                     timeout=timeout, filters=filters)
+        return two_phase_search(self.store, collection, embedding, fields, k=k, params=self.params(collection),
+                                timeout=timeout, filters=filters, cache=self.row_cache)[0]
+
+    async def encode(self, request:dict) -> tuple[int, dict]:
+        vectors = await asyncio.gather(*(self.embed(text) for text in request["texts"]))
+        return 200, {"embeddings": [np.asarray(vector, dtype=np.float32).tolist() for vector in vectors]}
+
+    async def health(self) -> tuple[int, dict]:
+        loop = asyncio.get_running_loop()
+        store = await loop.run_in_executor(self._search_executor, self.store.health_check)
+        return 200, {"dim": self.model.get_sentence_embedding_dimension(),
+                     "store": store,
+                     "requests": self.requests,
+                     "batching": self.batcher.stats(),
+                     "query_cache": self.query_cache.stats() if self.query_cache is not None else None,
+                     "row_cache": self.row_cache.stats() if self.row_cache is not None else None}
+
+    async def dispatch(self, method:str, path:str, body:bytes) -> tuple[int, dict]:
+        self.requests += 1
+        try:
+            if method == "GET" and path == "/health":
+                return await self.health()
+            if method == "POST" and path in ("/search", "/encode"):
+                request = json.loads(body or b"{}")
+                return await (self.search(request) if path == "/search" else self.encode(request))
+            return 404, {"error": f"no route {method} {path}"}
+        except (KeyError, ValueError) as e:
+            return 400, {"error": f"{type(e).__name__}: {e}"}
+        except Exception as e:
+            print(f"Request {method} {path} failed: {e}")
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def handle(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        """minimal HTTP/1.1 with keep-alive, one request at a time per connection"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload = await self.dispatch(method, path, body)
+                data = json.dumps(payload, default=str).encode("utf-8")
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host:str, port:int):
+        self.batcher.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Retrieval service on {host}:{port}, batches of up to {self.batcher.max_batch} "
+              f"within {self.batcher.max_wait * 1000:.1f}ms")
+        async with server:
+            await server.serve_forever()
+
+
+class RetrievalClient:
+    """
+    Blocking client of the service, safe to share between threads (one connection per thread).
+
+    Args:
+        url: Service url, e.g. http://127.0.0.1:8700
+        timeout: Seconds per request
+    """
+
+    def __init__(self, url:str, timeout:float=REQUEST_TIMEOUT):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _request(self, method:str, path:str, payload:dict|None=None) -> dict:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        # a kept-alive connection may have been closed by the server, retry once on a new one
+        for attempt in range(2):
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self._local.connection = connection
+            try:
+                connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+                response = connection.getresponse()
+                reply = json.loads(response.read() or b"{}")
+                break
+            except (ConnectionError, http.client.HTTPException):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+        if response.status == 404 and path == "/search":
+            raise ValueError(reply.get("error"))
+        if response.status != 200:
+            raise RuntimeError(f"Retrieval service {path} returned {response.status}: {reply.get('error')}")
+        return reply
+
+    def search(self, collection_name:str, query:str, output_fields:list, k:int=5, timeout:float|None=None,
+               filters:dict|None=None) -> list[LocalHit]:
+        """hits with the .id/.score/.entity.get() surface of a Milvus hit"""
+        reply = self._request("POST", "/search", {"collection": collection_name, "query": query, "k": k,
+                                                   "fields": output_fields, "timeout": timeout,
+                                                   "filters": filters})
+        return [LocalHit(id=hit["id"], score=hit["score"], entity=hit["entity"]) for hit in reply["hits"]]
+
+    def encode(self, texts:list[str]) -> np.ndarray:
+        return np.asarray(self._request("POST", "/encode", {"texts": texts})["embeddings"], dtype=np.float32)
+
+    def health_check(self) -> dict:
+        return self._request("GET", "/health")
+
+
+class RemoteEncoder:
+    """
+    Embedding model stand-in encoding through the service, embeddings are always normalized.
+
+    Args:
+        client: RetrievalClient of the service
+    """
+
+    def __init__(self, client:RetrievalClient):
+        self.client = client
+        self._dim = None
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dim is None:
+            self._dim = self.client.health_check()["dim"]
+        return self._dim
+
+    def encode(self, sentences, normalize_embeddings:bool=True, **kwargs):
+        if isinstance(sentences, str):
+            return self.client.encode([sentences])[0]
+        return self.client.encode(list(sentences))
+
+
+_client = None
+
+
+def get_retrieval_client() -> RetrievalClient | None:
+    """process wide client of RETRIEVAL_URL, None if the app searches in process"""
+    global _client
+    if _client is None and RETRIEVAL_URL:
+        _client = RetrievalClient(RETRIEVAL_URL)
+    return _client
+
+
+def bench(url:str, queries:list[str], concurrency:int, requests:int, collection:str="publications",
+          k:int=4) -> dict:
+    """search qps and latency of requests searches, concurrency at a time, distinct queries to defeat the cache"""
+    client = RetrievalClient(url)
+    before = client.health_check()["batching"]
+    latencies = []
+
+    def one(i:int):
+        start = time.perf_counter()
+        client.search(collection, f"{queries[i % len(queries)]} {i}", ["name"], k=k)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    wall_s = time.perf_counter() - start
+    after = client.health_check()["batching"]
+    batches = after["batches"] - before["batches"]
+    return {"concurrency": concurrency,
+            "qps": requests / wall_s,
+            "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+            "p95_ms": float(np.percentile(latencies, 95)) * 1000,
+            "mean_batch": (after["texts"] - before["texts"]) / batches if batches else 0.0}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="retrieval service with micro-batched query encoding")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the service")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=8700)
+    serve.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    serve.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    serve.add_argument("--search-workers", type=int, default=SEARCH_WORKERS)
+    serve.add_argument("--backend", default=None, choices=["torch", "onnx"], help="embedding backend, EMBEDDING_BACKEND if unset")
+
+    bench_parser = commands.add_parser("bench", help="search qps of a running service per concurrency")
+    bench_parser.add_argument("--url", default=RETRIEVAL_URL or "http://127.0.0.1:8700")
+    bench_parser.add_argument("--queries", default=None, help="jsonl with a query field, router_queries.jsonl if unset")
+    bench_parser.add_argument("--collection", default="publications")
+    bench_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    bench_parser.add_argument("--requests", type=int, default=256)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        from dotenv import load_dotenv
+        from embedding_cache import QueryEmbeddingCache
+        from encoders import embedding_model_id, load_embedding_model
+        from resources import EMBEDDING_MODEL_NAME
+        from vector_store import get_vector_store
+        load_dotenv()
+        model = load_embedding_model(args.backend, EMBEDDING_MODEL_NAME)
+        query_cache = QueryEmbeddingCache(embedding_model_id(args.backend, EMBEDDING_MODEL_NAME),
+                                          max_size=int(os.getenv("QUERY_CACHE_SIZE", "4096")),
+                                          persist_dir=os.getenv("QUERY_CACHE_DIR"),
+                                          dim=model.get_sentence_embedding_dimension())
+        service = RetrievalService(model, get_vector_store(), query_cache, max_batch=args.max_batch,
+                                   max_wait=args.max_wait_ms / 1000, search_workers=args.search_workers,
+                                   row_cache=RowCache() if TWO_PHASE_SEARCH else None)
+        asyncio.run(service.serve(args.host, args.port))
+    else:
+        with open(args.queries or DEFAULT_QUERIES, "r", encoding="utf-8") as f:
+            queries = [json.loads(line)["query"] for line in f if line.strip()]
+        for concurrency in args.concurrency:
+            result = bench(args.url, queries, concurrency, args.requests, args.collection)
+            print(f"concurrency {concurrency:3}: {result['qps']:8.1f} qps p50={result['p50_ms']:7.1f}ms "
+                  f"p95={result['p95_ms']:7.1f}ms mean batch {result['mean_batch']:.1f}")
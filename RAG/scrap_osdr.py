@@ -0,0 +1,252 @@
+"""
+parallel OSDR study scraper.
+
+A pool of headless Chrome drivers pulls study numbers from a queue. Each page is
+waited on with explicit conditions (no fixed sleeps), the protocols panel is expanded
+once, and every field is then parsed from a single page_source snapshot with
+BeautifulSoup instead of one XPath wait per field. Results go to the same
+OSD_<n>.json files as scrap_osdr.ipynb and a ledger makes reruns skip saved studies.
+
+usage: python scrap_osdr.py --start 521 --end 876 --drivers 4
+       python scrap_osdr.py --base-url http://127.0.0.1:8000/OSD-   # locally served pages
+"""
+from __future__ import annotations
+import os
+import queue
+import threading
+import time
+from utils import Ledger, save_json
+
+BASE_URL = "https://osdr.nasa.gov/bio/repo/data/studies/OSD-"
+OUTPUT_DIR = "./data/osdr_raw"
+LEDGER_PATH = "./data/osdr_ledger.jsonl"
+
+
+def node_text(elem) -> str:
+    """visible-ish text of a soup element with whitespace collapsed, like selenium's .text"""
+    return " ".join(elem.get_text(" ").split())
+
+
+def parse_study(html:str, link:str) -> dict:
+    """
+    Extract all study fields from one page_source snapshot, mirroring the XPaths of
+    scrap_osdr.ipynb.
+
+    Args:
+        html: Rendered page source with the protocols panel expanded
+        link: Study url, stored in the result
+
+    Returns:
+        Study dict in the osdr_raw json format
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    content = soup.select_one("mat-sidenav-content")
+
+    # name of OSD study
+    study_name = node_text(content.select_one(
+        "div.flex-container.justify-start > div.three-quarters-width > h1 > span:nth-child(4)"))
+
+    # genelab id follows the first <b> of the second block, doi is its first link
+    info_block = content.find_all("div", recursive=False)[1]
+    genelab_id = str(info_block.find("b").next_sibling).replace(":","").strip()
+    doi = node_text(info_block.find("a"))
+
+    panel = soup.select_one("#cdk-accordion-child-0 description-panel")
+    panel_blocks = panel.find_all("div", recursive=False)
+
+    # main description of study
+    description = node_text(panel_blocks[0].find("div").find("p"))
+
+    # which organisms this study is related to
+    organisms = [node_text(organism) for organism in
+                 panel_blocks[2].find("mat-grid-list").select(".mat-grid-tile-content")]
+
+    # ontology factors: experimental parameters that relate studies using different wording
+    ontology_concepts = {}
+    for row in panel_blocks[1].find("table").find("tbody").find_all("tr"):
+        key_values = row.find_all("td")
+        ontology_concepts[node_text(key_values[0])] = node_text(key_values[1])
+
+    # authors related to this study (contacts)
+    authors = [node_text(elem).replace(",","").strip() for elem in
+               panel_blocks[5].find("div").select(".contact-container.ng-star-inserted")]
+
+    # protocols, name and description of every sample card
+    samples_info_list = []
+    samples_block = soup.select_one("#Samples > div > div")
+    if samples_block is not None:
+        for card in samples_block.find_all("div", recursive=False):
+            protocol_sample_name = node_text(card.select_one(".card-header"))
+            nested_div = card.find("div").find("div").find("div")
+            sample_description = node_text(nested_div.find_all("div")[1]).replace("Description", "").strip()
+            samples_info_list.append({"name":protocol_sample_name, "description": sample_description})
+
+    return {"doi":doi,
+            'study_name':study_name,
+            "genelab_id":genelab_id,
+            "description":description,
+            "organisms":organisms,
+            "ontology_factors":ontology_concepts,
+            "authors":authors,
+            "protocole_samples":samples_info_list,
+            "link":link}
+
+
+def create_driver(page_timeout:float):
+    """headless chrome that skips images and returns once the DOM is ready"""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    options.add_argument("--headless=new")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--window-size=1920,1080")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.page_load_strategy = "eager"
+    wd = webdriver.Chrome(options=options)
+    wd.set_page_load_timeout(page_timeout)
+    return wd
+
+
+def load_study_page(wd, link:str, timeout:float) -> str:
+    """open study page, expand protocols and return page_source"""
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    wd.get(link)
+    wait = WebDriverWait(wd, timeout)
+    wait.until(EC.presence_of_element_located((By.ID, "header-tagline")))
+    wait.until(EC.presence_of_element_located(
+        (By.CSS_SELECTOR, "#cdk-accordion-child-0 description-panel p")))
+
+    # protocol cards are only rendered after the expand button is clicked
+    buttons = wd.find_elements(By.CSS_SELECTOR, "#cdk-accordion-child-4 protocols-panel button")
+    if buttons:
+        wd.execute_script("arguments[0].click();", buttons[0])
+        try:
+            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "#Samples > div > div > div")))
+        except TimeoutException:
+            # study without protocol samples
+            pass
+    return wd.page_source
+
+
+def scrape_osdr(study_numbers:list[int], drivers:int=4, base_url:str=BASE_URL, output_dir:str=OUTPUT_DIR,
+                ledger_path:str=LEDGER_PATH, timeout:float=20, driver_factory=None,
+                corpus_dir:str|None=None) -> dict:
+    """
+    Scrape OSDR studies with a pool of drivers.
+
+    Args:
+        study_numbers: OSD numbers to scrape, e.g. range(521, 877)
+        drivers: Number of concurrent headless drivers
+        base_url: Study url prefix, the OSD number is appended
+        output_dir: Folder for OSD_<n>.json files
+        ledger_path: Ledger file of saved/failed studies
+        timeout: Per study page load and wait timeout in seconds
+        driver_factory: Callable returning a new driver, headless chrome by default
+        corpus_dir: Append studies to the doc shards of this corpus (see corpus.py) instead
+            of writing one json file each
+
+    Returns:
+        Counts of saved/failed studies, elapsed seconds and studies per minute
+    """
+    corpus = None
+    if corpus_dir:
+        from corpus import CorpusStore
+        corpus = CorpusStore(corpus_dir)
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+    ledger = Ledger(ledger_path)
+    driver_factory = driver_factory or (lambda: create_driver(timeout))
+
+    jobs = queue.Queue()
+    skipped = 0
+    for i in study_numbers:
+        if ledger.is_done(f"OSD-{i}"):
+            skipped += 1
+        else:
+            jobs.put(i)
+    print(f"{skipped} studies already saved, {jobs.qsize()} to scrape with {drivers} drivers")
+
+    counts = {"saved": 0, "failed": 0}
+    counts_lock = threading.Lock()
+
+    def worker():
+        wd = None
+        try:
+            while True:
+                try:
+                    i = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                link = base_url + str(i)
+                try:
+                    if wd is None:
+                        wd = driver_factory()
+                    osd_study = parse_study(load_study_page(wd, link, timeout), link)
+                    if corpus is not None:
+                        corpus.add_docs("osdr", [(f"OSD_{i}", osd_study)])
+                    elif not save_json(osd_study, os.path.join(output_dir, f"OSD_{i}")):
+                        # recorded as failed in the ledger, so the next run scrapes it again
+                        raise OSError(f"could not write OSD_{i}.json")
+                    status, error = "saved", None
+                except Exception as e:
+                    status, error = "failed", f"{type(e).__name__}: {e}".strip()
+                    print(f"{link} failed: {error}")
+                    # a timed out or crashed driver may be stuck on the old page, start fresh
+                    if wd is not None:
+                        try:
+                            wd.quit()
+                        except Exception:
+                            pass
+                        wd = None
+                ledger.record(f"OSD-{i}", status, error)
+                with counts_lock:
+                    counts[status] += 1
+        finally:
+            if wd is not None:
+                wd.quit()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f"osdr-driver-{n}") for n in range(drivers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    done = counts["saved"] + counts["failed"]
+    report = {**counts,
+              "skipped": skipped,
+              "elapsed_s": round(elapsed, 1),
+              "studies_per_min": round(done / elapsed * 60, 1) if elapsed else 0.0}
+    print(f"OSDR scrape finished: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="scrape OSDR study pages with a pool of headless drivers")
+    parser.add_argument("--start", type=int, default=521)
+    parser.add_argument("--end", type=int, default=876, help="last OSD number, inclusive")
+    parser.add_argument("--drivers", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=20, help="per study timeout in seconds")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--output", default=OUTPUT_DIR)
+    parser.add_argument("--ledger", default=LEDGER_PATH)
+    parser.add_argument("--corpus", default=None, help="append studies to this corpus folder instead of json files")
+    args = parser.parse_args()
+
+    scrape_osdr(list(range(args.start, args.end + 1)),
+                drivers=args.drivers,
+                base_url=args.base_url,
+                output_dir=args.output,
+                ledger_path=args.ledger,
+                timeout=args.timeout,
+                corpus_dir=args.corpus)
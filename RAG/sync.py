@@ -0,0 +1,316 @@
+"""
+incremental, idempotent sync of a scraped folder into its collection.
+
+Instead of drop_collection + full rebuild, every source doc and chunk is content
+hashed and a manifest records which primary keys hold which chunk. A sync run only
+chunks docs whose hash changed, embeds chunks whose text is not indexed yet, and
+deletes chunks of changed or removed docs after their replacements are in, so the
+live collection keeps serving complete results while it runs. Chunks are keyed by
+their text alone: a chunk whose metadata changed (name, authors, ...) is rewritten
+with its stored vector instead of being embedded again. Inserted primary keys are
+journaled as soon as the store returns them, and the next run deletes those an
+interrupted run inserted but never recorded in the manifest.
+
+A collection indexed before it had a manifest (notebooks, ingest.py) is adopted on
+the first sync: its rows are read into the manifest, so only new text is embedded
+and the collection keeps serving during that run too.
+
+usage: python sync.py publications ./data/publications_raw
+       python sync.py osdr ./data/osdr_raw --rebuild   # drop the collection and index everything
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from ingest import (BATCH_SIZE, COLLECTIONS, COLLECTION_DESCRIPTIONS, COLLECTION_FIELDS, EMBEDDING_MODEL_NAME,
+                    InsertJournal, bounded_map, chunk_doc, insert_partitioned, read_docs)
+
+MANIFEST_DIR = "./data/manifests"
+
+
+def content_hash(data) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+# field of the chunk rows naming the doc they were cut from
+DOC_ID_FIELDS = {"publications": "PMC_code", "osdr": "study_id"}
+
+
+def doc_id(collection_name:str, key:str, doc:dict) -> str:
+    """value of the doc id field in the chunk rows of a doc"""
+    return doc["genelab_id"] if collection_name == "osdr" else key
+
+
+def chunk_keys(chunks:list[dict], text_field:str) -> list[str]:
+    """hash of each chunk text, identical texts in one doc get an occurrence suffix"""
+    seen = {}
+    keys = []
+    for chunk in chunks:
+        digest = content_hash(chunk[text_field])
+        seen[digest] = seen.get(digest, 0) + 1
+        keys.append(f"{digest}:{seen[digest]}")
+    return keys
+
+
+def meta_hash(chunk:dict, text_field:str) -> str:
+    """hash of the fields of a chunk row that are not embedded"""
+    return content_hash({name: value for name, value in chunk.items() if name != text_field})
+
+
+class Manifest:
+    """
+    What is indexed: doc key -> {"hash": doc content hash,
+    "chunks": {chunk key: [primary key, metadata hash]}}.
+    Primary keys inserted during a run are appended to a journal next to it until the run ends.
+
+    Args:
+        path: Manifest json file
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.journal = InsertJournal(path + ".pending")
+        self.docs = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.docs = json.load(f)
+            for doc in self.docs.values():
+                for chunk_key, chunk in doc["chunks"].items():
+                    if isinstance(chunk, int):
+                        # manifest of an older sync, chunk key -> primary key
+                        doc["chunks"][chunk_key] = [chunk, None]
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.docs, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.docs = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.journal.clear()
+
+    def orphans(self) -> list[int]:
+        """journaled primary keys no doc of the manifest holds, left by an interrupted run"""
+        indexed = {chunk[0] for doc in self.docs.values() for chunk in doc["chunks"].values()}
+        return self.journal.orphans(lambda _, primary_key: primary_key in indexed)
+
+    def end_run(self):
+        """save and drop the journal, every inserted key is in the manifest now"""
+        self.save()
+        self.journal.clear()
+
+
+def adopt_collection(manifest:Manifest, store, collection_name:str, folder_path:str) -> int:
+    """
+    Fill an empty manifest from a collection indexed without one. Rows are grouped into
+    docs by their doc id field and keyed like sync keys chunks; adopted docs get no hash,
+    so the next sync chunks every doc once but only embeds text the collection lacks.
+    Rows of docs that are no longer in folder_path are kept under their doc id and
+    removed by that sync.
+
+    Returns:
+        Number of adopted rows
+    """
+    id_field = DOC_ID_FIELDS[collection_name]
+    text_field = COLLECTIONS[collection_name][2]
+    keys = {doc_id(collection_name, key, doc): key for key, doc in read_docs(folder_path, collection_name)}
+    seen = {}
+    total = 0
+    for primary_key, row in store.iter_rows(collection_name, list(COLLECTION_FIELDS[collection_name])):
+        key = keys.get(row[id_field], row[id_field])
+        digest = content_hash(row[text_field])
+        counts = seen.setdefault(key, {})
+        counts[digest] = counts.get(digest, 0) + 1
+        doc = manifest.docs.setdefault(key, {"hash": None, "chunks": {}})
+        doc["chunks"][f"{digest}:{counts[digest]}"] = [primary_key, meta_hash(row, text_field)]
+        total += 1
+    manifest.save()
+    return total
+
+
+class DocUpdate:
+    """pending update of one changed doc while its new chunks are being inserted"""
+
+    def __init__(self, doc_hash:str, chunks:dict, stale_ids:list, remaining:int):
+        self.doc_hash = doc_hash
+        self.chunks = chunks
+        self.stale_ids = stale_ids
+        self.remaining = remaining
+
+
+def sync(collection_name:str, folder_path:str, store, model, batch_size:int=BATCH_SIZE,
+         workers:int=os.cpu_count() or 1, manifest_path:str|None=None, rebuild:bool=False) -> dict:
+    """
+    Bring a collection in line with the docs in folder_path.
+
+    Args:
+        collection_name: "publications" or "osdr"
+        folder_path: Folder with the scraped json files
+        store: Vector store holding the collection
+        model: SentenceTransformer or encoders.OnnxEncoder used for embeddings
+        batch_size: Chunks per embedding / insert batch
+        workers: Chunking worker processes
+        manifest_path: Manifest file, defaults to MANIFEST_DIR/<collection>.json
+        rebuild: Drop the collection and manifest and index everything, without it an
+            existing collection with no manifest is adopted (see adopt_collection)
+
+    Returns:
+        Counts of unchanged/changed/removed docs, adopted/inserted/embedded/deleted chunks
+        and chunks rewritten with new metadata
+    """
+    manifest = Manifest(manifest_path or os.path.join(MANIFEST_DIR, f"{collection_name}.json"))
+    if rebuild:
+        store.drop_collection(collection_name)
+        manifest.clear()
+    adopted = 0
+    if not rebuild and not manifest.exists() and store.has_collection(collection_name):
+        adopted = adopt_collection(manifest, store, collection_name, folder_path)
+        print(f"Adopted {adopted} chunks of '{collection_name}' into a new manifest")
+    store.create_collection(collection_name,
+                            model.get_sentence_embedding_dimension(),
+                            COLLECTION_FIELDS[collection_name],
+                            COLLECTION_DESCRIPTIONS[collection_name])
+
+    stats = {"unchanged_docs": 0, "changed_docs": 0, "removed_docs": 0, "adopted_chunks": adopted,
+             "inserted_chunks": 0, "embedded_chunks": 0, "rewritten_chunks": 0,
+             "deleted_chunks": 0, "deleted_orphans": 0}
+    orphans = manifest.orphans()
+    if orphans:
+        print(f"Deleting {len(orphans)} chunks inserted by an interrupted run")
+        store.delete(collection_name, orphans)
+        stats["deleted_orphans"] = len(orphans)
+        manifest.end_run()
+    text_field = COLLECTIONS[collection_name][2]
+    updates = {}
+    pending = []
+
+    def finish(key:str):
+        """swap in a doc once all of its new chunks are inserted"""
+        update = updates.pop(key)
+        store.delete(collection_name, update.stale_ids)
+        stats["deleted_chunks"] += len(update.stale_ids)
+        manifest.docs[key] = {"hash": update.doc_hash, "chunks": update.chunks}
+
+    def flush():
+        rows = [row for _, _, row, _, _ in pending]
+        vectors = np.zeros((len(rows), model.get_sentence_embedding_dimension()), dtype=np.float32)
+        embed = []
+        for j, (_, _, _, _, vector) in enumerate(pending):
+            if vector is None:
+                embed.append(j)
+            else:
+                vectors[j] = vector
+        if embed:
+            vectors[embed] = model.encode([rows[j][text_field] for j in embed],
+                                          normalize_embeddings=True,
+                                          batch_size=batch_size)
+        # a crash during the insert call itself can still leave rows the journal never saw
+        ids = insert_partitioned(store, collection_name, vectors, rows, journal=manifest.journal.append)
+        for (key, chunk_key, _, meta, _), primary_key in zip(pending, ids):
+            update = updates[key]
+            update.chunks[chunk_key] = [int(primary_key), meta]
+            update.remaining -= 1
+            if update.remaining == 0:
+                finish(key)
+        stats["inserted_chunks"] += len(pending)
+        stats["embedded_chunks"] += len(embed)
+        pending.clear()
+        manifest.save()
+
+    seen = set()
+    doc_hashes = {}
+
+    def changed_docs():
+        for key, doc in read_docs(folder_path, collection_name):
+            seen.add(key)
+            doc_hash = content_hash(doc)
+            if manifest.docs.get(key, {}).get("hash") == doc_hash:
+                stats["unchanged_docs"] += 1
+                continue
+            doc_hashes[key] = doc_hash
+            yield key, doc
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for key, chunks in bounded_map(executor, chunk_doc, changed_docs(), workers * 4, collection_name):
+            stats["changed_docs"] += 1
+            old_chunks = manifest.docs.get(key, {}).get("chunks", {})
+            kept, new, rewritten = {}, [], []
+            for chunk_key, chunk in zip(chunk_keys(chunks, text_field), chunks):
+                meta = meta_hash(chunk, text_field)
+                old = old_chunks.get(chunk_key)
+                if old is None:
+                    new.append((chunk_key, chunk, meta, None))
+                elif old[1] == meta:
+                    kept[chunk_key] = old
+                else:
+                    # same text with new metadata, rewritten with the stored vector
+                    rewritten.append((chunk_key, chunk, meta, old[0]))
+            stale_ids = [old[0] for chunk_key, old in old_chunks.items() if chunk_key not in kept]
+            if rewritten:
+                vectors = store.fetch_vectors(collection_name, [primary_key for *_, primary_key in rewritten])
+                new += [(chunk_key, chunk, meta, vector) for (chunk_key, chunk, meta, _), vector in zip(rewritten, vectors)]
+                stats["rewritten_chunks"] += len(rewritten)
+
+            updates[key] = DocUpdate(doc_hashes.pop(key), kept, stale_ids, len(new))
+            if not new:
+                finish(key)
+                continue
+            for chunk_key, chunk, meta, vector in new:
+                pending.append((key, chunk_key, chunk, meta, vector))
+                if len(pending) >= batch_size:
+                    flush()
+        if pending:
+            flush()
+
+    for key in [key for key in manifest.docs if key not in seen]:
+        stale_ids = [chunk[0] for chunk in manifest.docs.pop(key)["chunks"].values()]
+        store.delete(collection_name, stale_ids)
+        stats["removed_docs"] += 1
+        stats["deleted_chunks"] += len(stale_ids)
+
+    manifest.end_run()
+    store.flush(collection_name)
+    print(f"Synced '{collection_name}': {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    from vector_store import VECTOR_DTYPES, LocalStore, MilvusStore
+
+    parser = argparse.ArgumentParser(description="incrementally sync scraped docs into a vector store collection")
+    parser.add_argument("collection", choices=sorted(COLLECTIONS))
+    parser.add_argument("folder")
+    parser.add_argument("--store", choices=["milvus", "local"], default=os.getenv("VECTOR_STORE", "milvus"))
+    parser.add_argument("--local-dir", default=os.getenv("LOCAL_STORE_DIR", "./data/vector_store"))
+    parser.add_argument("--vector-dtype", choices=sorted(VECTOR_DTYPES), default=os.getenv("LOCAL_VECTOR_DTYPE", "float32"),
+                        help="vector dtype of a new local collection")
+    parser.add_argument("--keep-full", action="store_true", help="keep float32 vectors of a compressed local collection for reranking")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default=os.getenv("EMBEDDING_BACKEND", "torch"),
+                        help="embedding backend, onnx needs 'python encoders.py export' first")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--manifest", default=None)
+    parser.add_argument("--rebuild", action="store_true",
+                        help="drop collection and manifest first, an existing collection is adopted without it")
+    args = parser.parse_args()
+
+    from encoders import load_embedding_model
+    model = load_embedding_model(args.backend, EMBEDDING_MODEL_NAME)
+    store = (LocalStore(args.local_dir, vector_dtype=args.vector_dtype, keep_full=args.keep_full)
+             if args.store == "local" else MilvusStore())
+
+    sync(args.collection, args.folder, store, model,
+         batch_size=args.batch_size,
+         workers=args.workers,
+         manifest_path=args.manifest,
+         rebuild=args.rebuild)
@@ -0,0 +1,34 @@
+"""shared fixtures, the app modules are flat and imported from the RAG folder"""
+import hashlib
+import os
+import re
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class WordEncoder:
+    """bag of hashed words, texts sharing words get similar vectors, no model download"""
+
+    def __init__(self, dim:int=64):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, sentences, normalize_embeddings:bool=False, **kwargs):
+        single = isinstance(sentences, str)
+        vectors = np.zeros((1 if single else len(sentences), self.dim), dtype=np.float32)
+        for row, sentence in enumerate([sentences] if single else sentences):
+            for word in re.findall(r"\w+", sentence.lower()):
+                vectors[row, int(hashlib.sha1(word.encode("utf-8")).hexdigest(), 16) % self.dim] += 1
+            if normalize_embeddings:
+                vectors[row] /= max(np.linalg.norm(vectors[row]), 1e-12)
+        return vectors[0] if single else vectors
+
+
+@pytest.fixture
+def encoder():
+    return WordEncoder()
@@ -0,0 +1,19 @@
+from benchmark_index import lock_config
+from vector_store import DEFAULT_INDEX_PARAMS, DEFAULT_SEARCH_PARAMS, index_config
+
+
+def result(index_type, search_params, vector_dtype="float32"):
+    return {"index": {"index_type": index_type, "metric_type": "COSINE", "params": {"nlist": 64}},
+            "search_params": search_params, "vector_dtype": vector_dtype,
+            "recall": 0.97, "memory_bytes": 1024, "latency_ms_p95": 1.5}
+
+
+def test_local_lock_leaves_milvus_config_alone(tmp_path):
+    path = str(tmp_path / "index_config.json")
+    lock_config("osdr", result("IVF_FLAT", {"nprobe": 4, "rerank": 4}, "int8"), "local", path)
+    assert index_config("osdr", "milvus", path) == (DEFAULT_INDEX_PARAMS, DEFAULT_SEARCH_PARAMS)
+    assert index_config("osdr", "local", path)[1] == {"nprobe": 4, "rerank": 4}
+
+    lock_config("osdr", result("HNSW", {"ef": 64}), "milvus", path)
+    assert index_config("osdr", "milvus", path)[0]["index_type"] == "HNSW"
+    assert index_config("osdr", "local", path)[1] == {"nprobe": 4, "rerank": 4}
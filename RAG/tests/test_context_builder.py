@@ -0,0 +1,39 @@
+from context_builder import build_context, merge_overlap, stitch
+
+OVERLAP = "microgravity exposure changed gene expression in the liver"
+
+
+def hit(i, text, score, code="PMC1"):
+    return {"id": i, "PMC_code": code, "name": f"Paper {code}", "authors": "A, B", "date": "2020-01-01",
+            "doi": "10.1/x", "text": text, "score": score}
+
+
+def test_merge_overlap():
+    assert merge_overlap("first part " + OVERLAP, OVERLAP + " second part") == \
+        "first part " + OVERLAP + " second part"
+    assert merge_overlap("no shared text here at all", "completely different words") is None
+
+
+def test_stitch_merges_adjacent_chunks_of_a_source():
+    passages = stitch([hit(2, OVERLAP + " and in muscle.", 0.5), hit(1, "Mice flew for 30 days and " + OVERLAP, 0.9)])
+    assert len(passages) == 1
+    assert passages[0]["text"] == "Mice flew for 30 days and " + OVERLAP + " and in muscle."
+    assert passages[0]["score"] == 0.9
+
+
+def test_build_context_writes_header_once_and_stitches():
+    context, stats = build_context([hit(1, "Mice flew for 30 days and " + OVERLAP, 0.9),
+                                    hit(2, OVERLAP + " and in muscle.", 0.8),
+                                    hit(7, "Plants grew roots in random directions on orbit.", 0.7, code="PMC2")])
+    assert context.count("[Publication PMC1]") == 1
+    assert context.count(OVERLAP) == 1
+    assert stats["sources"] == 2 and stats["passages"] == 2
+
+
+def test_build_context_drops_duplicates_and_respects_budget():
+    text = "Bone density of the femur dropped in flight mice compared with ground controls after landing"
+    context, stats = build_context([hit(1, text, 0.9), hit(5, text, 0.8, code="PMC3")])
+    assert stats["duplicates"] == 1 and "PMC3" not in context
+    _, stats = build_context([hit(1, text * 20, 0.9)], token_budget=50)
+    assert stats["passages"] == 0 and stats["dropped_for_budget"] == 1
+    assert build_context(None) == (None, {"hits": 0})
@@ -0,0 +1,69 @@
+import pytest
+from conversation import Conversation
+
+
+def chat(conversation, turns):
+    for i in range(turns):
+        conversation.append("user", f"question {i}")
+        conversation.append("model", f"answer {i}")
+
+
+def test_fold_waits_for_max_recent():
+    conversation = Conversation(max_recent=6, keep_recent=2)
+    chat(conversation, 3)
+    assert conversation.fold(lambda summary, messages: "unused") is False
+    assert conversation.summary is None and len(conversation.recent()) == 6
+
+
+def test_fold_summarizes_older_messages_and_starts_at_user():
+    calls = []
+
+    def summarize(summary, messages):
+        calls.append((summary, [msg["content"] for msg in messages]))
+        return f"summary of {len(messages)}"
+
+    conversation = Conversation(max_recent=6, keep_recent=3)
+    chat(conversation, 4)
+    assert conversation.fold(summarize) is True
+    # keep_recent 3 would start at a model message, the verbatim part starts one earlier at a user message
+    assert calls == [(None, ["question 0", "answer 0", "question 1", "answer 1"])]
+    assert conversation.summary == "summary of 4"
+    recent = conversation.recent()
+    assert [content.role for content in recent] == ["user", "model", "user", "model"]
+    assert len(conversation.messages) == 8
+
+    chat(conversation, 2)
+    conversation.fold(summarize)
+    assert calls[-1][0] == "summary of 4"
+
+
+def test_fold_falls_back_to_transcript_when_summarizer_fails():
+    def summarize(summary, messages):
+        raise RuntimeError("quota")
+
+    conversation = Conversation(max_recent=4, keep_recent=2)
+    chat(conversation, 3)
+    assert conversation.fold(summarize) is True
+    assert "user: question 0" in conversation.summary
+
+
+def test_user_text_joins_user_turns_of_the_window():
+    conversation = Conversation()
+    conversation.append("user", "bone loss in space")
+    conversation.append("model", "long answer")
+    conversation.append("user", "and in mice?")
+    assert conversation.user_text(4) == "bone loss in space\nand in mice?"
+    assert conversation.user_text(1) == "and in mice?"
+
+
+@pytest.mark.parametrize("keep_recent", [0, -1])
+def test_keep_recent_must_leave_a_message(keep_recent):
+    with pytest.raises(ValueError):
+        Conversation(max_recent=4, keep_recent=keep_recent)
+
+
+def test_fold_with_one_kept_message_keeps_the_last_user_turn():
+    conversation = Conversation(max_recent=4, keep_recent=1)
+    chat(conversation, 3)
+    assert conversation.fold() is True
+    assert conversation.messages[conversation.start] == {"role": "user", "content": "question 2"}
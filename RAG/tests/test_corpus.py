@@ -0,0 +1,74 @@
+import json
+import os
+import pytest
+pytest.importorskip("langchain_text_splitters")
+import corpus as corpus_module
+from corpus import CorpusStore, chunk_corpus, embed_corpus, reindex
+from vector_store import LocalStore
+
+
+def publication(words):
+    return {"name": "Paper", "text": " ".join(words * 200), "authors": ["A"], "date": "2014 Aug 12", "doi": "x"}
+
+
+@pytest.fixture
+def env(tmp_path, encoder):
+    corpus = CorpusStore(str(tmp_path / "corpus"))
+    store = LocalStore(str(tmp_path / "store"))
+    checkpoint = str(tmp_path / "reindex.json")
+
+    def update(docs):
+        corpus.add_docs("publications", docs)
+        chunk_corpus(corpus, "publications", workers=1)
+        embed_corpus(corpus, "publications", encoder, "test-encoder")
+
+    def run(**kwargs):
+        return reindex(corpus, "publications", store, batch_size=3, checkpoint_path=checkpoint, **kwargs)
+
+    def live_rows():
+        collection = store.collection("publications")
+        collection.refresh()
+        return sorted((row["PMC_code"], row["content"]) for i, row in enumerate(collection.rows)
+                      if i not in collection.deleted)
+
+    return update, run, live_rows, checkpoint
+
+
+def test_reindex_replaces_rows_of_an_updated_doc(env):
+    update, run, live_rows, _ = env
+    update([("PMC1", publication(["bone", "loss"])), ("PMC2", publication(["plant", "roots"]))])
+    run(rebuild=True)
+    before = live_rows()
+
+    update([("PMC1", publication(["muscle", "atrophy"]))])
+    run()
+    after = live_rows()
+    assert [row for row in after if row[0] == "PMC2"] == [row for row in before if row[0] == "PMC2"]
+    assert all("muscle" in content for code, content in after if code == "PMC1")
+
+
+def test_kill_between_insert_and_checkpoint_leaves_no_duplicates(env, monkeypatch):
+    update, run, live_rows, checkpoint = env
+    update([("PMC1", publication(["bone", "loss"])), ("PMC2", publication(["plant", "roots"]))])
+    run(rebuild=True)
+    expected = live_rows()
+
+    replace = os.replace
+    saved = []
+
+    def killed_on_second_checkpoint(src, dst):
+        if dst == checkpoint:
+            saved.append(dst)
+            if len(saved) == 2:
+                raise KeyboardInterrupt
+        replace(src, dst)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(corpus_module.os, "replace", killed_on_second_checkpoint)
+        with pytest.raises(KeyboardInterrupt):
+            run(rebuild=True)
+    with open(checkpoint, "r", encoding="utf-8") as f:
+        assert json.load(f)["next"] == 3
+
+    run()
+    assert live_rows() == expected
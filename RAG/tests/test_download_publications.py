@@ -0,0 +1,74 @@
+import json
+import threading
+import time
+import pytest
+pytest.importorskip("bs4")
+import download_publications
+from download_publications import download_publications as download
+
+ARTICLE = """<html><head><title>{code}</title></head><body><main id="main-content"><article>
+<div class="ameta p font-secondary font-xs"><h1>Bone loss in {code}</h1>
+<div class="cg p"><a>A. Author</a></div></div>
+<section class="pmc-layout__citation font-secondary font-xs"><div>2014 Aug 12; 9(8). doi: 10.1/{code}</div></section>
+<section class="body main-article-body">
+<section><h2>Results</h2><p>Mice lost bone.</p></section>
+<section><h2>References</h2><p>Reference list.</p></section>
+</section></article></main></body></html>"""
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class Session:
+    """serves ARTICLE for every url, requests block until release is set"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+
+    def get(self, url, timeout=None):
+        self.started.release()
+        self.release.wait()
+        return Response(ARTICLE.format(code=url.rsplit("/", 1)[-1]).encode("utf-8"))
+
+
+def test_download_drops_references_and_bounds_queued_fetches(tmp_path, monkeypatch):
+    submitted = []
+
+    class CountingPool(download_publications.ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            submitted.append(fn)
+            return super().submit(fn, *args, **kwargs)
+
+    monkeypatch.setattr(download_publications, "ThreadPoolExecutor", CountingPool)
+    session = Session()
+    links = [f"https://pmc.example/articles/PMC{i}" for i in range(20)]
+    counts = {}
+
+    def run():
+        counts.update(download(links, output_dir=str(tmp_path / "out"), ledger_path=str(tmp_path / "ledger.jsonl"),
+                               workers=2, parse_workers=1, rate=1000, burst=20, session=session))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        # both network threads are blocked in a request, the rest of the links are not queued yet
+        assert session.started.acquire(timeout=5) and session.started.acquire(timeout=5)
+        time.sleep(0.2)
+        assert len(submitted) == download_publications.MAX_PENDING_PER_WORKER * 2
+    finally:
+        session.release.set()
+        thread.join(timeout=30)
+
+    assert counts["saved"] == 20 and len(submitted) == 20
+    with open(tmp_path / "out" / "PMC3.json", "r", encoding="utf-8") as f:
+        article = json.load(f)
+    assert "Mice lost bone." in article["text"] and "Reference list." not in article["text"]
+    assert article["doi"] == "10.1/PMC3"
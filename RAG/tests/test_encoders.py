@@ -0,0 +1,49 @@
+import importlib.util
+import os
+import numpy as np
+import pytest
+from encoders import ONNX_MODEL_DIR, PARITY_THRESHOLD, embedding_model_id, parity, parity_sentences
+
+
+class Noisy:
+    """copy of an encoder with gaussian noise, stands in for a drifting export"""
+
+    def __init__(self, model, scale:float, seed:int=0):
+        self.model = model
+        self.scale = scale
+        self.rng = np.random.default_rng(seed)
+
+    def encode(self, sentences, normalize_embeddings:bool=False, **kwargs):
+        vectors = self.model.encode(sentences, normalize_embeddings=True)
+        vectors = vectors + self.rng.normal(0, self.scale, vectors.shape).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_parity_passes_for_close_backends(encoder):
+    report = parity(encoder, Noisy(encoder, 0.001), parity_sentences())
+    assert report["passed"] and report["cosine_min"] >= PARITY_THRESHOLD
+    assert report["sentences"] == len(parity_sentences())
+
+
+def test_parity_fails_below_threshold(encoder):
+    report = parity(encoder, Noisy(encoder, 0.2), parity_sentences())
+    assert not report["passed"] and report["cosine_min"] < PARITY_THRESHOLD
+
+
+def test_onnx_backend_has_its_own_cache_id():
+    assert embedding_model_id("onnx", "m") != embedding_model_id("torch", "m")
+
+
+def onnx_parity_available() -> bool:
+    return bool(importlib.util.find_spec("onnxruntime") and importlib.util.find_spec("tokenizers")
+                and importlib.util.find_spec("sentence_transformers") and os.path.isdir(ONNX_MODEL_DIR))
+
+
+# set EMBEDDING_PARITY_REQUIRED=1 where the export exists so a missing backend fails instead of skipping
+@pytest.mark.skipif(not onnx_parity_available() and os.environ.get("EMBEDDING_PARITY_REQUIRED") != "1",
+                    reason="needs onnxruntime, tokenizers, sentence_transformers and 'python encoders.py export'")
+def test_onnx_export_matches_torch():
+    assert onnx_parity_available(), "EMBEDDING_PARITY_REQUIRED=1 but the onnx export or its dependencies are missing"
+    from encoders import load_embedding_model
+    report = parity(load_embedding_model("torch"), load_embedding_model("onnx"), parity_sentences())
+    assert report["passed"], report
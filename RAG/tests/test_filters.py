@@ -0,0 +1,40 @@
+import pytest
+from filters import clean_filters, matches, partition_name, to_expression
+
+
+def test_clean_filters_drops_unknown_keys_and_normalizes_values():
+    cleaned = clean_filters("osdr", {"type": " Protocole ", "study_id": "OSD-48", "date_from": "2015",
+                                     "organisms": ["Mus musculus", ""]})
+    assert cleaned == {"type": "protocole", "study_id": ["OSD-48"], "organisms": ["Mus musculus"]}
+    assert clean_filters("osdr", {"type": "protocol"}) == {}
+    assert clean_filters("publications", {"date_from": "2015", "date_to": "2018", "PMC_code": "None"}) == \
+        {"date_from": "2015-01-01", "date_to": "2018-12-31"}
+
+
+def test_to_expression():
+    assert to_expression({}) is None
+    assert to_expression({"study_id": ["OSD-1", "OSD-2"], "type": "protocole"}) == \
+        'study_id in ["OSD-1", "OSD-2"] and type == "protocole"'
+    assert to_expression({"organisms": ["Mus", "Rattus"]}) == '(organisms like "%Mus%" or organisms like "%Rattus%")'
+    assert to_expression({"date_from": "2015-01-01"}) == 'date >= "2015-01-01" and date != "None"'
+    assert to_expression({"PMC_code": ['PMC"1']}) == 'PMC_code in ["PMC\\"1"]'
+
+
+@pytest.mark.parametrize("filters, row, expected", [
+    ({"type": "protocole"}, {"type": "protocole"}, True),
+    ({"type": "protocole"}, {"type": "description"}, False),
+    ({"study_id": ["OSD-1"]}, {"study_id": "OSD-2"}, False),
+    ({"organisms": ["Mus musculus"]}, {"organisms": "Homo sapiens,Mus musculus"}, True),
+    ({"date_from": "2015-01-01", "date_to": "2015-12-31"}, {"date": "2015-06-01"}, True),
+    ({"date_from": "2015-01-01"}, {"date": "2014-12-31"}, False),
+    ({"date_to": "2015-12-31"}, {"date": "None"}, False),
+    ({}, {}, True),
+])
+def test_matches(filters, row, expected):
+    assert matches(row, filters) is expected
+
+
+def test_partition_name():
+    assert partition_name("publications", {"date": "2014-08-12"}) == "year_2014"
+    assert partition_name("publications", {"date": "None"}) == "year_unknown"
+    assert partition_name("osdr", {"type": "protocole"}) == "type_protocole"
@@ -0,0 +1,78 @@
+import json
+import pytest
+pytest.importorskip("langchain_text_splitters")
+import ingest
+from vector_store import LocalStore
+
+
+def write_doc(folder, key, words):
+    doc = {"name": f"Paper {key}", "text": " ".join(words * 200), "authors": ["A"], "date": "2014 Aug 12", "doi": "x"}
+    with open(folder / f"{key}.json", "w", encoding="utf-8") as f:
+        json.dump(doc, f)
+
+
+@pytest.fixture
+def env(tmp_path, encoder):
+    source = tmp_path / "source"
+    source.mkdir()
+    for i, words in enumerate([["bone", "loss"], ["plant", "roots"], ["muscle", "atrophy"]]):
+        write_doc(source, f"PMC{i}", words)
+    store = LocalStore(str(tmp_path / "store"))
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+
+    def run(**kwargs):
+        return ingest.ingest("publications", str(source), store, encoder, batch_size=2, workers=1,
+                             checkpoint_path=checkpoint, **kwargs)
+
+    def live_rows():
+        collection = store.collection("publications")
+        collection.refresh()
+        return [(row["PMC_code"], row["content"]) for i, row in enumerate(collection.rows) if i not in collection.deleted]
+
+    return run, live_rows, checkpoint
+
+
+def test_ingest_inserts_every_chunk_once(env):
+    run, live_rows, _ = env
+    total = run(rebuild=True)
+    rows = live_rows()
+    assert total == len(rows) > 3
+    assert {code for code, _ in rows} == {"PMC0", "PMC1", "PMC2"}
+    assert run() == 0
+
+
+def test_kill_between_insert_and_checkpoint_leaves_no_duplicates(env, monkeypatch):
+    run, live_rows, checkpoint = env
+    total = run(rebuild=True)
+    expected = sorted(live_rows())
+
+    log = ingest.Checkpoint.log
+    calls = []
+
+    def killed_on_third_batch(self, chunks, done):
+        calls.append(chunks)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        log(self, chunks, done)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(ingest.Checkpoint, "log", killed_on_third_batch)
+        with pytest.raises(KeyboardInterrupt):
+            run(rebuild=True)
+
+    assert run() == total - 4
+    assert sorted(live_rows()) == expected
+
+
+def test_torn_checkpoint_line_is_cut(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    checkpoint = ingest.Checkpoint(str(path))
+    checkpoint.log({"PMC0": 2}, [])
+    checkpoint.log({"PMC0": 1}, ["PMC0"])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"chunks": {"PMC1"')
+
+    checkpoint = ingest.Checkpoint(str(path))
+    assert checkpoint.batches == 2 and checkpoint.done == {"PMC0"}
+    checkpoint.log({"PMC1": 1}, ["PMC1"])
+    assert ingest.Checkpoint(str(path)).done == {"PMC0", "PMC1"}
@@ -0,0 +1,21 @@
+from fake_llm import FakeClient, FakeResponse
+from llm import handle_answer, iter_text
+
+
+def test_streamed_answer_arrives_in_chunks_with_usage_last():
+    client = FakeClient("Microgravity weakens bones.", chunk_size=5)
+    chunks = list(handle_answer(client, messages=[], llm_model_name="gemini", system_instruction="x", stream=True))
+    assert "".join(iter_text(chunks)) == "Microgravity weakens bones."
+    assert len(chunks) > 1
+    assert chunks[-1].usage_metadata is not None and all(c.usage_metadata is None for c in chunks[:-1])
+    assert client.models.calls[-1]["stream"] is True
+
+
+def test_non_streamed_answer_is_one_response():
+    client = FakeClient("answer")
+    response = handle_answer(client, messages=[], llm_model_name="gemini", system_instruction="x")
+    assert response.text == "answer"
+
+
+def test_iter_text_skips_chunks_without_text():
+    assert list(iter_text([FakeResponse("a"), FakeResponse(""), FakeResponse("b")])) == ["a", "b"]
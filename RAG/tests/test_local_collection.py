@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from vector_store import LocalCollection
+
+
+def unit(*components, dim=4):
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[:len(components)] = components
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def collection(tmp_path):
+    collection = LocalCollection(str(tmp_path / "docs"), dim=4)
+    collection.insert([unit(1), unit(0, 1), unit(0, 0, 1)], [{"name": "a"}, {"name": "b"}, {"name": "c"}])
+    return collection
+
+
+def test_insert_and_search(collection):
+    ids, scores = collection.search(unit(0.1, 1), k=2)
+    assert list(ids) == [1, 0]
+    assert scores[0] == pytest.approx(float(unit(0.1, 1) @ unit(0, 1)))
+    assert collection.rows[ids[0]] == {"name": "b"}
+
+
+def test_search_within_row_ids(collection):
+    ids, _ = collection.search(unit(1), k=1, row_ids=[1, 2])
+    assert list(ids) in ([1], [2])
+
+
+def test_delete_masks_rows(collection):
+    collection.delete([1])
+    ids, _ = collection.search(unit(0, 1), k=3)
+    assert 1 not in list(ids)
+    assert LocalCollection(collection.folder_path).deleted == {1}
+
+
+def test_refresh_sees_other_writer_and_ignores_partial_line(collection):
+    reader = LocalCollection(collection.folder_path)
+    assert len(reader.rows) == 3
+    collection.insert([unit(1, 1)], [{"name": "d"}])
+    # another writer half way through appending its next row
+    with open(collection.rows_path, "a", encoding="utf-8") as f:
+        f.write('{"name": "e", "te')
+    # meta.json may be rewritten within the mtime resolution of the filesystem
+    reader._meta_mtime = None
+    reader.refresh()
+    assert [row["name"] for row in reader.rows] == ["a", "b", "c", "d"]
+    ids, _ = reader.search(unit(1, 1), k=1)
+    assert list(ids) == [3]
+    assert len(LocalCollection(collection.folder_path).rows) == 4
+
+
+@pytest.mark.parametrize("vector_dtype", ["float16", "int8"])
+def test_compressed_collection_keeps_ranking(tmp_path, vector_dtype):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, 16)).astype(np.float32)
+    collection = LocalCollection(str(tmp_path / vector_dtype), dim=16, vector_dtype=vector_dtype, keep_full=True)
+    collection.insert(vectors, [{"i": i} for i in range(50)])
+    ids, _ = collection.search(vectors[7], k=1, rerank=4)
+    assert list(ids) == [7]
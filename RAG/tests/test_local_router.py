@@ -0,0 +1,41 @@
+import json
+from local_router import LocalRouter, approved, evaluate, use_local_router
+
+
+def report(local_exact, llm_exact=None, answered=10):
+    result = {"local": {"answered": answered, "exact_accuracy": local_exact}}
+    if llm_exact is not None:
+        result["llm"] = {"answered": 30, "exact_accuracy": llm_exact}
+    return result
+
+
+def test_approval_needs_an_llm_comparison():
+    assert approved(report(0.95, 0.96))
+    assert not approved(report(0.90, 0.96))
+    assert not approved(report(1.0))
+    assert not approved(report(1.0, 0.9, answered=0))
+
+
+def test_router_choice(tmp_path, monkeypatch):
+    path = str(tmp_path / "router_report.json")
+    monkeypatch.delenv("ROUTER", raising=False)
+    assert not use_local_router(report_path=path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report(0.97, 0.97), f)
+    assert use_local_router(report_path=path)
+    monkeypatch.setenv("ROUTER", "llm")
+    assert not use_local_router(report_path=path)
+    assert use_local_router("local", report_path=str(tmp_path / "missing.json"))
+
+
+def test_evaluate_compares_both_routers(encoder):
+    prototypes = {"NO_RAG": ["hello there", "thanks a lot"],
+                  "NASA_Space_Biology": ["bone loss in mice papers", "muscle atrophy publications"],
+                  "Experiment_Collection": ["rodent research study protocols", "osdr experiment samples"]}
+    router = LocalRouter.from_model(encoder, prototypes, margin=0.0, collection_margin=0.0, top_n=1)
+    queries = [{"query": "hello", "needs_rag": False, "collections": []},
+               {"query": "bone loss publications", "needs_rag": True, "collections": ["NASA_Space_Biology"]}]
+    result = evaluate(router, encoder, queries,
+                      lambda query: {"NEEDS_RAG": "NO", "COLLECTIONS": []})
+    assert result["local"]["exact_accuracy"] == 1.0 and result["llm"]["exact_accuracy"] == 0.5
+    assert approved(result)
@@ -0,0 +1,98 @@
+import json
+from fake_llm import FakeClient
+from fake_store import FakeStore
+from load_test import fake_reply
+from pipeline import build_pipeline, new_conversation
+from prompts import ROUTING_SYSTEM_PROMPT
+from tracing import Tracer
+
+
+class SpyStore(FakeStore):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.searched = []
+
+    def search(self, collection_name, *args, **kwargs):
+        self.searched.append(collection_name)
+        return super().search(collection_name, *args, **kwargs)
+
+
+def make_pipeline(encoder, reply):
+    store = SpyStore({"publications": 200, "osdr": 100}, dim=encoder.dim)
+    client = FakeClient(reply, chunk_size=4)
+    pipeline = build_pipeline(encoder, client, store, "test-encoder", tracer=Tracer(enabled=False))
+    # every turn goes to the LLM router, the word encoder cannot route
+    pipeline.local_router = None
+    return pipeline, client, store
+
+
+def routed_to(collections):
+    base = fake_reply("grounded answer")
+
+    def reply(model, contents, config):
+        if getattr(config, "system_instruction", None) == ROUTING_SYSTEM_PROMPT:
+            return json.dumps({"NEEDS_RAG": "YES", "COLLECTIONS": collections, "REASON": "test"})
+        return base(model, contents, config)
+    return reply
+
+
+def test_rag_turn_answers_from_retrieved_docs(encoder):
+    pipeline, client, store = make_pipeline(encoder, fake_reply("grounded answer", rag_share=1.0))
+    conversation = new_conversation()
+    chunks = []
+
+    def render(stream):
+        chunks.extend(stream)
+        return "".join(chunks)
+
+    assert pipeline.turn(conversation, "bone loss in mice on the station", render=render) == "grounded answer"
+    assert len(chunks) > 1
+    assert [msg["role"] for msg in conversation.messages] == ["user", "model"]
+    assert sorted(set(store.searched)) == ["osdr", "publications"]
+    answer_call = [call for call in client.models.calls if call["stream"]][-1]
+    assert "Retrieved Space Biology Data: [" in answer_call["config"].system_instruction
+
+    # same question again is served from the answer cache
+    streamed = len([call for call in client.models.calls if call["stream"]])
+    assert pipeline.turn(conversation, "bone loss in mice on the station") == "grounded answer"
+    assert len([call for call in client.models.calls if call["stream"]]) == streamed
+
+
+def test_turn_without_rag_skips_search(encoder):
+    pipeline, client, store = make_pipeline(encoder, fake_reply("plain answer", rag_share=0.0))
+    conversation = new_conversation()
+    assert pipeline.turn(conversation, "what is a nebula?") == "plain answer"
+    assert store.searched == []
+    assert "Retrieved Space Biology Data: None" in client.models.calls[-1]["config"].system_instruction
+
+
+def test_route_collections_restrict_the_search(encoder):
+    pipeline, _, store = make_pipeline(encoder, routed_to(["Experiment Collection"]))
+    pipeline.turn(new_conversation(), "protocols of the rodent research missions")
+    assert set(store.searched) == {"osdr"}
+
+
+def test_search_timeout_skips_slow_collection(encoder):
+    pipeline, _, store = make_pipeline(encoder, fake_reply("answer"))
+    store.latency = 0.5
+    docs = pipeline.run_search({"NASA_Space_Biology": "bone", "Experiment_Collection": "bone"}, timeout=0.1)
+    assert docs == []
+
+
+def test_pipeline_looks_up_resources_on_every_use(encoder):
+    from resources import Resource
+    stores = []
+
+    def new_store():
+        stores.append(SpyStore({"publications": 50, "osdr": 50}, dim=encoder.dim))
+        return stores[-1]
+
+    store = Resource("vector_store", new_store)
+    pipeline = build_pipeline(encoder, FakeClient(fake_reply("answer", rag_share=1.0)), store, "test-encoder",
+                              tracer=Tracer(enabled=False))
+    pipeline.local_router = None
+    pipeline.turn(new_conversation(), "bone loss in mice")
+    # a failed health check drops the store, the next turn creates and searches a new one
+    store.reset()
+    pipeline.turn(new_conversation(), "plant roots in microgravity")
+    assert len(stores) == 2 and stores[0].searched and stores[1].searched
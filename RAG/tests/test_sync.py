@@ -0,0 +1,113 @@
+import json
+import os
+import pytest
+pytest.importorskip("langchain_text_splitters")
+import sync
+from vector_store import LocalStore
+
+
+def write_doc(folder, key, words):
+    doc = {"name": f"Paper {key}", "text": " ".join(words * 40), "authors": ["A"], "date": "2014 Aug 12", "doi": "x"}
+    with open(folder / f"{key}.json", "w", encoding="utf-8") as f:
+        json.dump(doc, f)
+
+
+@pytest.fixture
+def env(tmp_path, encoder):
+    source = tmp_path / "source"
+    source.mkdir()
+    store = LocalStore(str(tmp_path / "store"))
+    manifest = str(tmp_path / "manifest.json")
+
+    def run(**kwargs):
+        return sync.sync("publications", str(source), store, encoder, batch_size=2, workers=1,
+                         manifest_path=manifest, **kwargs)
+
+    def live():
+        collection = store.collection("publications")
+        collection.refresh()
+        return sorted({row["PMC_code"] for i, row in enumerate(collection.rows) if i not in collection.deleted})
+
+    def live_count():
+        collection = store.collection("publications")
+        return collection.count - len(collection.deleted)
+
+    return source, run, live, live_count, manifest
+
+
+def test_add_change_remove(env):
+    source, run, live, live_count, _ = env
+    write_doc(source, "PMC1", ["bone", "loss"])
+    write_doc(source, "PMC2", ["plant", "roots"])
+    stats = run(rebuild=True)
+    assert stats["changed_docs"] == 2 and stats["inserted_chunks"] > 0
+    assert live() == ["PMC1", "PMC2"]
+    count = live_count()
+
+    stats = run()
+    assert stats["unchanged_docs"] == 2 and stats["inserted_chunks"] == 0 and stats["deleted_chunks"] == 0
+
+    write_doc(source, "PMC1", ["muscle", "atrophy"])
+    stats = run()
+    assert stats["changed_docs"] == 1 and stats["deleted_chunks"] == stats["inserted_chunks"]
+    assert live_count() == count
+
+    (source / "PMC2.json").unlink()
+    stats = run()
+    assert stats["removed_docs"] == 1
+    assert live() == ["PMC1"]
+
+
+def test_interrupted_run_leaves_no_orphans(env, monkeypatch):
+    source, run, live, live_count, manifest = env
+    write_doc(source, "PMC1", ["bone", "loss"])
+    run(rebuild=True)
+    count = live_count()
+
+    write_doc(source, "PMC1", ["muscle", "atrophy"])
+    def crash(self):
+        raise KeyboardInterrupt
+    with monkeypatch.context() as patch:
+        patch.setattr(sync.Manifest, "save", crash)
+        with pytest.raises(KeyboardInterrupt):
+            run()
+
+    stats = run()
+    assert stats["deleted_orphans"] > 0
+    assert live_count() == count
+    with open(manifest, "r", encoding="utf-8") as f:
+        assert len(json.load(f)["PMC1"]["chunks"]) == count
+
+
+def test_metadata_change_reuses_stored_vectors(env):
+    source, run, live, live_count, _ = env
+    write_doc(source, "PMC1", ["bone", "loss"])
+    run(rebuild=True)
+    count = live_count()
+
+    with open(source / "PMC1.json", "r", encoding="utf-8") as f:
+        doc = json.load(f)
+    doc["name"] = "Renamed paper"
+    with open(source / "PMC1.json", "w", encoding="utf-8") as f:
+        json.dump(doc, f)
+    stats = run()
+    assert stats["rewritten_chunks"] == count and stats["embedded_chunks"] == 0
+    assert live_count() == count
+
+
+def test_existing_collection_without_manifest_is_adopted(env):
+    source, run, live, live_count, manifest = env
+    write_doc(source, "PMC1", ["bone", "loss"])
+    write_doc(source, "PMC2", ["plant", "roots"])
+    run(rebuild=True)
+    count = live_count()
+    os.remove(manifest)
+
+    write_doc(source, "PMC3", ["muscle", "atrophy"])
+    (source / "PMC2.json").unlink()
+    stats = run()
+    assert stats["adopted_chunks"] == count
+    assert stats["embedded_chunks"] == stats["inserted_chunks"] > 0
+    assert stats["removed_docs"] == 1
+    assert live() == ["PMC1", "PMC3"]
+    assert run()["unchanged_docs"] == 2
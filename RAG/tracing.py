@@ -0,0 +1,366 @@
+"""
+per stage tracing of a chat turn.
+
+A turn is a trace, every stage inside it (router, reformulation, embedding, search,
+answer, ...) a span with its duration and attributes such as Gemini token usage,
+hit counts, scores and cache hits. Finished traces are appended to a JSONL log and
+aggregated into Prometheus metrics, exposed as a textfile for node_exporter and/or
+an HTTP endpoint. With TRACING=0 every call is a no-op.
+
+Env: TRACING (1/0), TRACE_LOG (jsonl path), METRICS_TEXTFILE (path), METRICS_PORT (port)
+
+usage: python tracing.py ./data/traces.jsonl      # p50/p95/p99 per stage of a trace log
+"""
+from __future__ import annotations
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# histogram buckets in seconds, from a local router decision to a long streamed answer
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def usage_tokens(response) -> dict:
+    """prompt/output/total token counts from a gemini response's usage_metadata, {} if missing"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return {}
+    tokens = {"prompt_tokens": getattr(usage, "prompt_token_count", None),
+              "output_tokens": getattr(usage, "candidates_token_count", None),
+              "total_tokens": getattr(usage, "total_token_count", None)}
+    return {key: value for key, value in tokens.items() if value is not None}
+
+
+class Span:
+    """one timed stage of a trace, attributes are set with set()"""
+
+    def __init__(self, trace:"Trace|None", name:str, attrs:dict):
+        self.trace = trace
+        self.name = name
+        self.attrs = dict(attrs)
+        self.start = time.perf_counter()
+        self.offset_ms = (time.time() - trace.start_time) * 1000 if trace else 0.0
+        self.duration_ms = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self, error:BaseException|None=None):
+        """close the span, used directly for spans that outlive a with block, e.g. a stream"""
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = (time.perf_counter() - self.start) * 1000
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self.trace is not None:
+            self.trace.add(self)
+
+    def to_dict(self) -> dict:
+        span = {"name": self.name, "offset_ms": self.offset_ms, "duration_ms": self.duration_ms, **self.attrs}
+        if self.error:
+            span["error"] = self.error
+        return span
+
+
+class NoopSpan:
+    """span of a disabled tracer, every method does nothing"""
+    name = None
+    attrs = {}
+
+    def set(self, **attrs):
+        pass
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Trace:
+    """spans of one turn, finished spans may be added from several threads"""
+
+    def __init__(self, tracer:"Tracer", attrs:dict):
+        self.tracer = tracer
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.attrs = dict(attrs)
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span:Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self, duration_ms:float) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.offset_ms)
+        return {"trace_id": self.trace_id,
+                "start": self.start_time,
+                "duration_ms": duration_ms,
+                **self.attrs,
+                "spans": [span.to_dict() for span in spans]}
+
+
+class Metrics:
+    """Prometheus style histograms of stage durations and counters, rendered in the text format"""
+
+    def __init__(self, buckets:tuple=BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name:str, labels:dict, value:float):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def inc(self, name:str, labels:dict, value:float=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @staticmethod
+    def _labels(labels:tuple, extra:dict|None=None) -> str:
+        items = list(labels) + list((extra or {}).items())
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, group in itertools.groupby(sorted(self.histograms.items()), key=lambda item: item[0][0]):
+                lines.append(f"# TYPE {name} histogram")
+                for (_, labels), histogram in group:
+                    for bound, count in zip(self.buckets, histogram["counts"]):
+                        lines.append(f"{name}_bucket{self._labels(labels, {'le': bound})} {count}")
+                    lines.append(f"{name}_bucket{self._labels(labels, {'le': '+Inf'})} {histogram['count']}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {histogram['sum']}")
+                    lines.append(f"{name}_count{self._labels(labels)} {histogram['count']}")
+            for name, group in itertools.groupby(sorted(self.counters.items()), key=lambda item: item[0][0]):
+                lines.append(f"# TYPE {name} counter")
+                for (_, labels), value in group:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """
+    Records traces of turns and their spans.
+
+    Args:
+        trace_path: JSONL file every finished trace is appended to, None to skip
+        metrics_path: Prometheus textfile rewritten after every trace, None to skip
+        enabled: False makes turn() and span() no-ops
+    """
+
+    def __init__(self, trace_path:str|None=None, metrics_path:str|None=None, enabled:bool=True):
+        self.trace_path = trace_path
+        self.metrics_path = metrics_path
+        self.enabled = enabled
+        self.metrics = Metrics()
+        self._write_lock = threading.Lock()
+        self._server = None
+
+    @contextmanager
+    def turn(self, **attrs):
+        """trace of one chat turn, spans opened inside (also in propagated threads) belong to it"""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        trace = Trace(self, attrs)
+        token = _current_trace.set(trace)
+        error = None
+        try:
+            yield trace
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_trace.reset(token)
+            if error is not None:
+                trace.set(error=f"{type(error).__name__}: {error}")
+            self.finish(trace)
+
+    def start_span(self, name:str, **attrs):
+        """open a span in the current trace, close it with span.end()"""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(_current_trace.get(), name, attrs)
+
+    @contextmanager
+    def span(self, name:str, **attrs):
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        span = Span(_current_trace.get(), name, attrs)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(e)
+            raise
+        span.end()
+
+    def finish(self, trace:Trace):
+        """export a finished trace to the log and the metrics"""
+        duration_ms = (time.perf_counter() - trace.start) * 1000
+        record = trace.to_dict(duration_ms)
+        self.metrics.observe("rag_turn_duration_seconds", {}, duration_ms / 1000)
+        for span in record["spans"]:
+            labels = {"stage": span["name"]}
+            self.metrics.observe("rag_stage_duration_seconds", labels, span["duration_ms"] / 1000)
+            if "error" in span:
+                self.metrics.inc("rag_stage_errors_total", labels)
+            for kind in ("prompt_tokens", "output_tokens"):
+                if kind in span:
+                    self.metrics.inc("rag_llm_tokens_total", {**labels, "kind": kind}, span[kind])
+            if "cache" in span:
+                self.metrics.inc("rag_cache_events_total", {"cache": span["cache"], "result": span.get("cache_result")})
+            if "hits" in span and "collection" in span:
+                self.metrics.inc("rag_search_hits_total", {"collection": span["collection"]}, span["hits"])
+
+        with self._write_lock:
+            if self.trace_path:
+                os.makedirs(os.path.dirname(self.trace_path) or ".", exist_ok=True)
+                with open(self.trace_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+            if self.metrics_path:
+                self.write_textfile(self.metrics_path)
+
+    def write_textfile(self, path:str):
+        # write then rename, node_exporter must never read a partial file
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.metrics.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port:int):
+        """serve /metrics on a daemon thread, once per tracer"""
+        if self._server is not None or not self.enabled:
+            return
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        print(f"Serving metrics on :{port}/metrics")
+
+
+def propagate(fn):
+    """bind fn to the current trace, for work submitted to a thread pool"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def traced_stream(chunks, span):
+    """pass a gemini stream through, recording time to first chunk and usage of the last chunk, then end span"""
+    if not isinstance(span, Span):
+        yield from chunks
+        return
+    usage = None
+    first = True
+    try:
+        for chunk in chunks:
+            if first:
+                span.set(first_chunk_ms=(time.perf_counter() - span.start) * 1000)
+                first = False
+            if getattr(chunk, "usage_metadata", None) is not None:
+                usage = chunk
+            yield chunk
+    except BaseException as e:
+        span.end(e)
+        raise
+    if usage is not None:
+        span.set(**usage_tokens(usage))
+    span.end()
+
+
+def get_tracer() -> Tracer:
+    """process wide tracer configured from the environment"""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(trace_path=os.getenv("TRACE_LOG"),
+                         metrics_path=os.getenv("METRICS_TEXTFILE"),
+                         enabled=os.getenv("TRACING", "1") == "1")
+        if os.getenv("METRICS_PORT"):
+            _tracer.serve(int(os.getenv("METRICS_PORT")))
+    return _tracer
+
+_tracer = None
+
+
+def percentile(values:list, q:float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = (len(values) - 1) * q / 100
+    low = int(index)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (index - low)
+
+
+def summarize(trace_path:str) -> dict:
+    """count and p50/p95/p99 duration in ms per stage (and the whole turn) of a trace log"""
+    durations = {"turn": []}
+    with open(trace_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            durations["turn"].append(record["duration_ms"])
+            for span in record["spans"]:
+                durations.setdefault(span["name"], []).append(span["duration_ms"])
+    return {stage: {"count": len(values),
+                    "p50_ms": percentile(values, 50),
+                    "p95_ms": percentile(values, 95),
+                    "p99_ms": percentile(values, 99)}
+            for stage, values in durations.items()}
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="latency percentiles per stage from a trace log")
+    parser.add_argument("trace_log")
+    args = parser.parse_args()
+    for stage, stats in summarize(args.trace_log).items():
+        print(f"{stage:20} n={stats['count']:6} p50={stats['p50_ms']:9.1f}ms "
+              f"p95={stats['p95_ms']:9.1f}ms p99={stats['p99_ms']:9.1f}ms")
@@ -1,12 +1,9 @@
 from __future__ import annotations
 import json
+import os
 import re
 import ast
-from google.genai import types
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import threading
 
 def save_json(data, filename):
 
@@ -16,6 +13,9 @@ def save_json(data, filename):
     Args:
         data (dict or list): The Python object to save.
         filename (str): The path to the file (e.g., 'data.json').
+
+    Returns:
+        bool: True if the file was written.
     """
     if not filename.endswith('.json'):
         filename += '.json'
@@ -24,8 +24,10 @@ def save_json(data, filename):
         with open(filename, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=4)  # pretty print
         print(f"Data successfully saved to {filename}")
+        return True
     except Exception as e:
         print(f"Error saving JSON: {e}")
+        return False
 
 def load_json(filename: str) -> dict:
     """
@@ -45,8 +47,47 @@ def load_json(filename: str) -> dict:
         return {}
 
 
+class Ledger:
+    """
+    Append-only record of finished scrape jobs, {"key", "status", "error"} per line.
+    The last entry of a key wins, so failed keys are retried on the next run.
+
+    Args:
+        path: Ledger jsonl file
+        done_statuses: Statuses that count as finished
+    """
+
+    def __init__(self, path:str, done_statuses:tuple=("saved",)):
+        self.path = path
+        self.done_statuses = done_statuses
+        self.status = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.status[entry["key"]] = entry["status"]
+        self._lock = threading.Lock()
+
+    def is_done(self, key:str) -> bool:
+        return self.status.get(key) in self.done_statuses
+
+    def record(self, key:str, status:str, error:str|None=None):
+        with self._lock:
+            self.status[key] = status
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "status": status, "error": error}) + "\n")
+
+
 def find_elem(selector:str, wd:webdriver, selector_method:str="xpath"):
-    
+    # scraper only, selenium is not loaded by the app
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
     try:
         if selector_method == "xpath":
             # ✅ Wait until element is present AND visible (up to 10 seconds)
@@ -70,9 +111,8 @@ def find_elem(selector:str, wd:webdriver, selector_method:str="xpath"):
 
 
 def get_history(chat_history:list[dict]) -> list[Content]:
-    '''parse chat history messages as Content type from chat_history list'''
-    for msg in chat_history:
-        print(f"content: {msg['content']}")
+    '''parse chat history messages as Content type from chat_history list, see conversation.Conversation for the incremental version'''
+    from google.genai import types
     messages = [
         types.Content(
             role=msg["role"],
@@ -0,0 +1,830 @@
+"""vector store backends used by search_collection: Milvus server or an in-process local index"""
+from __future__ import annotations
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Iterator
+import numpy as np
+from filters import matches, partition_names, to_expression
+
+# Milvus connection args
+MILVUS_HOST = os.getenv("MILVUS_HOST", "127.0.0.1")
+MILVUS_PORT = os.getenv("MILVUS_PORT", "19530")
+
+# Global connection
+_connection = None
+
+def connect_to_milvus():
+    """Connect to Milvus server (singleton pattern)."""
+    global _connection
+    if _connection is None:
+        from pymilvus import connections
+        connections.connect(
+            alias="default",
+            host=MILVUS_HOST,
+            port=MILVUS_PORT
+        )
+        _connection = True
+
+
+def reset_milvus_connection():
+    """drop the connection so the next connect_to_milvus reconnects"""
+    global _connection
+    if _connection is not None:
+        from pymilvus import connections
+        try:
+            connections.disconnect("default")
+        except Exception as e:
+            print(f"Milvus disconnect note: {e}")
+        _connection = None
+
+
+@dataclass
+class LocalHit:
+    """search hit with the same .id/.score/.entity.get() surface as a Milvus hit"""
+    id: int
+    score: float
+    entity: dict = field(default_factory=dict)
+
+
+# index built on new Milvus collections
+DEFAULT_INDEX_PARAMS = {
+    "index_type": "IVF_FLAT",
+    "metric_type": "COSINE",
+    "params": {"nlist": 128}
+}
+DEFAULT_SEARCH_PARAMS = {"nprobe": 10}
+
+# index / search params locked in from benchmark_index.py results, per store kind and collection:
+# {"milvus": {collection: config}, "local": {collection: config}}
+INDEX_CONFIG_PATH = os.getenv("INDEX_CONFIG_PATH",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), "index_config.json"))
+
+
+def load_index_configs(path:str=INDEX_CONFIG_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def index_config(collection_name:str, kind:str="milvus", path:str=INDEX_CONFIG_PATH) -> tuple[dict, dict]:
+    """(index params, search params) of a collection in a store of this kind ("milvus" or "local"),
+    defaults if it has no locked config"""
+    config = load_index_configs(path).get(kind, {}).get(collection_name, {})
+    return config.get("index", DEFAULT_INDEX_PARAMS), config.get("search_params", DEFAULT_SEARCH_PARAMS)
+
+
+def milvus_rerank(collection, ids:list[int], embedding, k:int, timeout:float|None=None) -> list[tuple[int, float]]:
+    """exact (id, score) top k of candidate ids, scored with their stored full precision embeddings"""
+    if not ids:
+        return []
+    rows = collection.query(expr=f"id in {[int(i) for i in ids]}", output_fields=["embedding"], timeout=timeout)
+    query = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    vectors = np.asarray([row["embedding"] for row in rows], dtype=np.float32)
+    scores = vectors @ query / np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)
+    order = np.argsort(-scores)[:k]
+    return [(int(rows[i]["id"]), float(scores[i])) for i in order]
+
+
+# seconds partition names of a collection are reused by filtered searches
+PARTITION_CACHE_TTL = 60
+
+# two phase search: ids and scores of overfetch * k candidates, then fields of the k survivors
+TWO_PHASE_SEARCH = os.getenv("TWO_PHASE_SEARCH", "1") == "1"
+TWO_PHASE_OVERFETCH = 2
+HYDRATE_CACHE_SIZE = int(os.getenv("HYDRATE_CACHE_SIZE", "4096"))
+
+
+class RowCache:
+    """
+    LRU of hydrated rows keyed by (collection, primary key).
+
+    Primary keys are auto generated and never reused, updated chunks get new keys,
+    so cached rows never go stale, deleted ones are just no longer returned by searches.
+
+    Args:
+        max_size: Rows kept
+    """
+
+    def __init__(self, max_size:int=HYDRATE_CACHE_SIZE):
+        self.max_size = max_size
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, collection_name:str, ids:list[int], fields:list) -> tuple[dict, list[int]]:
+        """(id -> cached row with all fields, ids to fetch)"""
+        found, missing = {}, []
+        with self._lock:
+            for i in ids:
+                row = self._rows.get((collection_name, i))
+                if row is not None and all(name in row for name in fields):
+                    self._rows.move_to_end((collection_name, i))
+                    found[i] = row
+                else:
+                    missing.append(i)
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, collection_name:str, rows:dict):
+        with self._lock:
+            for i, row in rows.items():
+                cached = self._rows.get((collection_name, i))
+                self._rows[(collection_name, i)] = {**cached, **row} if cached else row
+                self._rows.move_to_end((collection_name, i))
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._rows)}
+
+
+def dedupe_candidates(hits, min_score:float|None=None) -> list[tuple[int, float]]:
+    """(id, score) of id/score-only hits by score, without repeated ids and candidates scoring below min_score"""
+    candidates = []
+    seen = set()
+    for hit in sorted(hits, key=lambda hit: hit.score, reverse=True):
+        if min_score is not None and hit.score < min_score:
+            break
+        if hit.id not in seen:
+            seen.add(hit.id)
+            candidates.append((hit.id, hit.score))
+    return candidates
+
+
+def two_phase_search(store, collection_name:str, embedding, output_fields:list, k:int=5,
+                     params:dict|None=None, timeout:float|None=None, filters:dict|None=None,
+                     cache:RowCache|None=None, overfetch:int=TWO_PHASE_OVERFETCH,
+                     min_score:float|None=None) -> tuple[list, dict]:
+    """
+    Search without fields, then hydrate only the best candidates. Rows with the same field
+    values as a better one (a chunk inserted twice) are dropped, and the next candidates
+    are hydrated in their place until there are k results or no candidates left.
+
+    Args:
+        store: Vector store with search() and hydrate()
+        collection_name, embedding, output_fields, k, params, timeout, filters: As in store.search
+        cache: Hydrated rows reused across searches, None to always fetch
+        overfetch: Candidates per result fetched in the id/score phase, so dropped duplicates
+            do not leave fewer than k results
+        min_score: Candidates scoring lower are dropped before hydration
+
+    Returns:
+        (hits with the .id/.score/.entity.get() surface, counts of candidates / cached / fetched / duplicate rows)
+    """
+    hits = store.search(collection_name, embedding, [], k=k * overfetch, params=params, timeout=timeout,
+                        filters=filters)
+    candidates = dedupe_candidates(hits, min_score)
+    counts = {"candidates": len(hits), "cached": 0, "fetched": 0, "duplicates": 0}
+    results, seen, start = [], set(), 0
+    while len(results) < k and start < len(candidates):
+        batch = candidates[start:start + k - len(results)]
+        start += len(batch)
+        ids = [i for i, _ in batch]
+        rows, missing = cache.get_many(collection_name, ids, output_fields) if cache is not None else ({}, ids)
+        fetched = store.hydrate(collection_name, missing, output_fields, timeout) if missing else {}
+        if cache is not None and fetched:
+            cache.put_many(collection_name, fetched)
+        rows.update(fetched)
+        counts["cached"] += len(ids) - len(missing)
+        counts["fetched"] += len(fetched)
+        for i, score in batch:
+            if i not in rows:
+                continue
+            entity = {name: rows[i].get(name) for name in output_fields}
+            content = tuple(entity.values())
+            if content in seen:
+                counts["duplicates"] += 1
+                continue
+            seen.add(content)
+            results.append(LocalHit(id=i, score=score, entity=entity))
+    return results, counts
+
+
+class MilvusStore:
+    """
+    vector store backed by the Milvus server from docker-compose.yml.
+
+    Collection handles are created and loaded once per store and reused by every
+    search, health_check() verifies the server and reloads released collections.
+    """
+    kind = "milvus"
+
+    def __init__(self):
+        self._collections = {}
+        self._loaded = set()
+        self._partitions = {}
+        self._lock = threading.Lock()
+
+    def collection(self, collection_name:str, load:bool=False):
+        """cached Collection handle, loaded into memory on first use if load is True"""
+        from pymilvus import Collection
+        handle = self._collections.get(collection_name)
+        if handle is None or (load and collection_name not in self._loaded):
+            with self._lock:
+                connect_to_milvus()
+                handle = self._collections.get(collection_name)
+                if handle is None:
+                    handle = self._collections[collection_name] = Collection(collection_name)
+                if load and collection_name not in self._loaded:
+                    handle.load()
+                    self._loaded.add(collection_name)
+        return handle
+
+    def partition_names(self, collection_name:str) -> list[str]:
+        cached = self._partitions.get(collection_name)
+        if cached is None or time.monotonic() - cached[0] > PARTITION_CACHE_TTL:
+            cached = (time.monotonic(), [p.name for p in self.collection(collection_name).partitions])
+            self._partitions[collection_name] = cached
+        return cached[1]
+
+    def forget(self, collection_name:str|None=None):
+        """drop cached handles of a collection, or all of them"""
+        with self._lock:
+            for name in ([collection_name] if collection_name else list(self._collections)):
+                self._collections.pop(name, None)
+                self._loaded.discard(name)
+                self._partitions.pop(name, None)
+
+    def health_check(self) -> dict:
+        """
+        Check the server connection and the load state of the collections in use.
+        On connection errors the connection and handles are dropped and the error is raised.
+
+        Returns:
+            Server version and load state per cached collection
+        """
+        from pymilvus import utility
+        try:
+            connect_to_milvus()
+            version = utility.get_server_version(timeout=5)
+        except Exception:
+            reset_milvus_connection()
+            self.forget()
+            raise
+        states = {}
+        for name in list(self._loaded):
+            state = str(utility.load_state(name))
+            if "Loaded" not in state:
+                # released or reloading on the server side, load again on next search
+                self._loaded.discard(name)
+            states[name] = state
+        return {"server_version": version, "collections": states}
+
+    def has_collection(self, collection_name:str) -> bool:
+        from pymilvus import utility
+        if collection_name in self._collections:
+            return True
+        connect_to_milvus()
+        return utility.has_collection(collection_name)
+
+    def create_collection(self, collection_name:str, dim:int, varchar_fields:dict, description:str=""):
+        """
+        Create collection with auto id, embedding and VARCHAR fields, if it does not exist.
+
+        Args:
+            collection_name: Name of the collection
+            dim: Embedding dimension
+            varchar_fields: Field name -> max_length, in schema order
+            description: Collection description
+        """
+        from pymilvus import Collection, CollectionSchema, DataType, FieldSchema
+        if self.has_collection(collection_name):
+            return
+        fields = [
+            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim, metric_type="COSINE"),
+        ]
+        fields += [FieldSchema(name=name, dtype=DataType.VARCHAR, max_length=max_length)
+                   for name, max_length in varchar_fields.items()]
+        collection = Collection(collection_name, CollectionSchema(fields, description=description))
+        collection.create_index(field_name="embedding", index_params=index_config(collection_name)[0])
+        self._collections[collection_name] = collection
+
+    def drop_collection(self, collection_name:str):
+        from pymilvus import utility
+        if self.has_collection(collection_name):
+            utility.drop_collection(collection_name)
+        self.forget(collection_name)
+
+    def insert(self, collection_name:str, vectors, rows:list[dict], partition_name:str|None=None) -> list[int]:
+        """insert rows with their embeddings, returns the auto generated primary keys"""
+        collection = self.collection(collection_name)
+        if partition_name and not collection.has_partition(partition_name):
+            collection.create_partition(partition_name)
+            self._partitions.pop(collection_name, None)
+        result = collection.insert(
+            [{"embedding": np.asarray(vector).tolist(), **row} for vector, row in zip(vectors, rows)],
+            partition_name=partition_name)
+        return list(result.primary_keys)
+
+    def delete(self, collection_name:str, ids:list[int]):
+        """delete rows by primary key, searches stop returning them right away"""
+        if ids:
+            self.collection(collection_name).delete(f"id in {[int(i) for i in ids]}")
+
+    def flush(self, collection_name:str):
+        self.collection(collection_name).flush()
+
+    def search(self, collection_name:str, embedding, output_fields:list, k:int=5,
+               params:dict|None=None, timeout:float|None=None, filters:dict|None=None):
+        """
+        COSINE search of one collection, filters are pushed down as partitions and a boolean expression.
+
+        Args:
+            collection_name: Name of the collection to search
+            embedding: Normalized query embedding
+            output_fields: List of field names to retrieve
+            k: Number of results to return
+            params: Index search params, e.g. {"nprobe": 10}, "rerank": n rescores k * n
+                candidates with the full precision embeddings (for IVF_SQ8 / IVF_PQ indexes)
+            timeout: Search timeout in seconds
+            filters: Cleaned filters from filters.clean_filters
+
+        Returns:
+            Milvus hits for the query
+        """
+        collection = self.collection(collection_name, load=True)
+
+        expr, partitions = None, None
+        if filters:
+            expr = to_expression(filters)
+            partitions = partition_names(collection_name, filters, self.partition_names(collection_name))
+            if partitions == []:
+                return []
+
+        params = dict(params or {})
+        rerank = params.pop("rerank", 0)
+        search_params = {
+            "metric_type": "COSINE",
+            "params": params
+        }
+        results = collection.search(
+            data=[np.asarray(embedding).tolist()],
+            anns_field="embedding",
+            param=search_params,
+            limit=k * rerank if rerank else k,
+            expr=expr,
+            partition_names=partitions,
+            output_fields=output_fields,
+            timeout=timeout
+        )
+        if not rerank:
+            return results[0]
+        hits = {hit.id: hit for hit in results[0]}
+        return [LocalHit(id=i, score=score, entity={name: hits[i].entity.get(name) for name in output_fields})
+                for i, score in milvus_rerank(collection, list(hits), embedding, k, timeout)]
+
+    def hydrate(self, collection_name:str, ids:list[int], output_fields:list,
+                timeout:float|None=None) -> dict[int, dict]:
+        """fields of rows by primary key in one query, for the second phase of two_phase_search"""
+        if not ids:
+            return {}
+        rows = self.collection(collection_name, load=True).query(
+            expr=f"id in {[int(i) for i in ids]}", output_fields=output_fields, timeout=timeout)
+        return {int(row["id"]): {name: row.get(name) for name in output_fields} for row in rows}
+
+    def iter_rows(self, collection_name:str, output_fields:list, batch_size:int=1000) -> Iterator[tuple[int, dict]]:
+        """(primary key, fields) of every row, read in batches with a query iterator"""
+        iterator = self.collection(collection_name, load=True).query_iterator(batch_size=batch_size,
+                                                                             output_fields=output_fields)
+        while True:
+            batch = iterator.next()
+            if not batch:
+                iterator.close()
+                break
+            for row in batch:
+                yield int(row["id"]), {name: row.get(name) for name in output_fields}
+
+    def fetch_vectors(self, collection_name:str, ids:list[int]) -> np.ndarray:
+        """stored embeddings of rows by primary key, in the order of ids"""
+        if not ids:
+            return np.zeros((0, 0), dtype=np.float32)
+        rows = self.collection(collection_name, load=True).query(
+            expr=f"id in {[int(i) for i in ids]}", output_fields=["embedding"])
+        vectors = {int(row["id"]): row["embedding"] for row in rows}
+        return np.asarray([vectors[int(i)] for i in ids], dtype=np.float32)
+
+
+# on disk dtypes of local collections, vectors are normalized so all components lie in [-1, 1]
+VECTOR_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+VECTOR_FILES = {"float32": "vectors.f32", "float16": "vectors.f16", "int8": "vectors.i8"}
+# rows dequantized at a time by a full scan of a compressed collection
+SCORE_BLOCK_SIZE = 65536
+
+
+def quantize(vectors:np.ndarray, vector_dtype:str) -> tuple[np.ndarray, np.ndarray | None]:
+    """(codes, per vector scales) of normalized float32 vectors, scales only for int8"""
+    if vector_dtype == "int8":
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return vectors.astype(VECTOR_DTYPES[vector_dtype]), None
+
+
+class LocalCollection:
+    """
+    One collection on disk: vectors in a memory-mapped file, scalar fields in a JSONL
+    file with one row per vector, and an optional IVF index.
+
+    Vectors are stored normalized, so inner product equals COSINE similarity. They
+    are kept as float32, float16 or int8 (with one scale per vector). Compressed
+    collections can also keep the float32 vectors on disk to rerank candidates
+    exactly; only the rows being reranked are read from that file.
+    Deleted rows stay in the files and are masked out of search results.
+
+    Args:
+        folder_path: Directory of the collection
+        dim: Embedding dimension, read from meta.json for existing collections
+        vector_dtype: "float32", "float16" or "int8", for new collections
+        keep_full: Also store float32 vectors for reranking, for new compressed collections
+    """
+
+    def __init__(self, folder_path:str, dim:int|None=None, vector_dtype:str="float32", keep_full:bool=False):
+        self.folder_path = folder_path
+        self.full_path = os.path.join(folder_path, "vectors.f32")
+        self.scales_path = os.path.join(folder_path, "scales.f32")
+        self.rows_path = os.path.join(folder_path, "rows.jsonl")
+        self.meta_path = os.path.join(folder_path, "meta.json")
+        self.ivf_path = os.path.join(folder_path, "ivf.npz")
+        os.makedirs(folder_path, exist_ok=True)
+
+        self._vectors = None
+        self._scales = None
+        self._full_vectors = None
+        self._rows = None
+        self._ivf = None
+        self._meta_mtime = None
+        # search threads refresh and read rows while this process may insert
+        self._lock = threading.RLock()
+        if os.path.exists(self.meta_path):
+            self._read_meta()
+        else:
+            if dim is None:
+                raise ValueError(f"New collection at '{folder_path}' needs dim")
+            if vector_dtype not in VECTOR_DTYPES:
+                raise ValueError(f"Unknown vector dtype '{vector_dtype}', use one of {sorted(VECTOR_DTYPES)}")
+            self.dim = dim
+            self.vector_dtype = vector_dtype
+            self.keep_full = keep_full and vector_dtype != "float32"
+            self.count = 0
+            self.deleted = set()
+            self._write_meta()
+        self.vectors_path = os.path.join(folder_path, VECTOR_FILES[self.vector_dtype])
+
+    def _read_meta(self):
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.vector_dtype = meta.get("vector_dtype", "float32")
+        self.keep_full = meta.get("keep_full", False)
+        self.count = meta["count"]
+        self.deleted = set(meta.get("deleted", []))
+        self._meta_mtime = os.stat(self.meta_path).st_mtime_ns
+
+    def _write_meta(self):
+        # write then rename so readers in other processes never see a partial file
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "vector_dtype": self.vector_dtype, "keep_full": self.keep_full,
+                       "count": self.count, "deleted": sorted(self.deleted)}, f)
+        os.replace(tmp_path, self.meta_path)
+        self._meta_mtime = os.stat(self.meta_path).st_mtime_ns
+
+    def refresh(self):
+        """pick up rows inserted or deleted by another process, e.g. a running sync"""
+        with self._lock:
+            if os.stat(self.meta_path).st_mtime_ns == self._meta_mtime:
+                return
+            count = self.count
+            self._read_meta()
+            if self.count < count:
+                self._rows = None
+            elif self._rows is not None and self.count > len(self._rows):
+                self._rows.extend(self._read_rows(len(self._rows), self.count))
+            self._ivf = None
+
+    def _read_rows(self, start:int, stop:int) -> list:
+        """
+        rows start..stop of rows.jsonl. Only lines below count are parsed: a writer appends
+        rows before it raises count in meta.json, so lines past it may be partly written.
+        """
+        if not os.path.exists(self.rows_path):
+            return []
+        with open(self.rows_path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in itertools.islice(f, start, stop)]
+
+    def _memmap(self, path:str, dtype, shape:tuple) -> np.ndarray:
+        if self.count == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """stored vectors in the collection dtype, int8 codes still need scales"""
+        if self._vectors is None or self._vectors.shape[0] != self.count:
+            self._vectors = self._memmap(self.vectors_path, VECTOR_DTYPES[self.vector_dtype], (self.count, self.dim))
+        return self._vectors
+
+    @property
+    def scales(self) -> np.ndarray | None:
+        if self.vector_dtype != "int8":
+            return None
+        if self._scales is None or self._scales.shape[0] != self.count:
+            self._scales = self._memmap(self.scales_path, np.float32, (self.count,))
+        return self._scales
+
+    @property
+    def full_vectors(self) -> np.ndarray | None:
+        """float32 vectors for exact reranking, None if the collection does not keep them"""
+        if self.vector_dtype == "float32":
+            return self.vectors
+        if not self.keep_full:
+            return None
+        if self._full_vectors is None or self._full_vectors.shape[0] != self.count:
+            self._full_vectors = self._memmap(self.full_path, np.float32, (self.count, self.dim))
+        return self._full_vectors
+
+    @property
+    def rows(self) -> list:
+        with self._lock:
+            if self._rows is None:
+                self._rows = self._read_rows(0, self.count)
+            return self._rows
+
+    @property
+    def ivf(self):
+        if self._ivf is None and os.path.exists(self.ivf_path):
+            data = np.load(self.ivf_path)
+            # index built before later inserts is stale, fall back to flat search
+            if int(data["count"]) == self.count:
+                self._ivf = (data["centroids"], data["order"], data["offsets"])
+        return self._ivf
+
+    def get_vectors(self, ids=None) -> np.ndarray:
+        """float32 (dequantized) vectors of row ids, all rows if None"""
+        ids = slice(None) if ids is None else ids
+        vectors = np.asarray(self.vectors[ids], dtype=np.float32)
+        if self.vector_dtype == "int8":
+            vectors *= self.scales[ids][:, None]
+        return vectors
+
+    def memory_bytes(self) -> int:
+        """bytes a full scan keeps in memory: stored vectors, scales and the IVF index"""
+        size = self.vectors.nbytes
+        if self.scales is not None:
+            size += self.scales.nbytes
+        if self.ivf is not None:
+            size += sum(array.nbytes for array in self.ivf)
+        return int(size)
+
+    def _scores(self, query:np.ndarray, candidates=None) -> np.ndarray:
+        if self.vector_dtype == "float32":
+            return (self.vectors if candidates is None else self.vectors[candidates]) @ query
+        if candidates is not None:
+            return self.get_vectors(candidates) @ query
+        scores = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, SCORE_BLOCK_SIZE):
+            block = slice(start, start + SCORE_BLOCK_SIZE)
+            scores[block] = self.get_vectors(block) @ query
+        return scores
+
+    def insert(self, vectors, rows:list[dict]) -> list[int]:
+        """append normalized vectors and their scalar fields, returns the new row ids"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) != len(rows):
+            raise ValueError("vectors and rows must have the same length")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        codes, scales = quantize(vectors, self.vector_dtype)
+        with open(self.vectors_path, "ab") as f:
+            f.write(codes.tobytes())
+        if scales is not None:
+            with open(self.scales_path, "ab") as f:
+                f.write(scales.tobytes())
+        if self.keep_full:
+            with open(self.full_path, "ab") as f:
+                f.write(vectors.tobytes())
+        with open(self.rows_path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        with self._lock:
+            if self._rows is not None:
+                self._rows.extend(rows)
+            ids = list(range(self.count, self.count + len(rows)))
+            self.count += len(rows)
+            self._ivf = None
+            self._write_meta()
+        return ids
+
+    def delete(self, ids:list[int]):
+        with self._lock:
+            self.deleted.update(int(i) for i in ids)
+            self._write_meta()
+
+    def build_ivf(self, nlist:int=128, n_iter:int=20, seed:int=0):
+        """build an IVF index with spherical k-means over the stored vectors"""
+        vectors = self.get_vectors()
+        nlist = min(nlist, len(vectors))
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = np.argmax(vectors @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = vectors[assign == c]
+                if len(members):
+                    mean = members.sum(axis=0)
+                    centroids[c] = mean / max(np.linalg.norm(mean), 1e-12)
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.searchsorted(assign[order], np.arange(nlist + 1))
+        np.savez(self.ivf_path, centroids=centroids, order=order, offsets=offsets,
+                 count=np.int64(self.count))
+        self._ivf = (centroids, order, offsets)
+
+    def search(self, embedding, k:int=5, nprobe:int|None=None, row_ids=None, rerank:int=0):
+        """
+        return (row ids, scores) of the k most similar vectors, restricted to row_ids if given.
+        With rerank, k * rerank candidates are rescored with the float32 vectors.
+        """
+        query = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        ivf = self.ivf if nprobe and row_ids is None else None
+        if row_ids is not None:
+            candidates = np.asarray(row_ids, dtype=np.int64)
+            scores = self._scores(query, candidates)
+        elif ivf is not None:
+            centroids, order, offsets = ivf
+            probes = np.argsort(centroids @ query)[::-1][:nprobe]
+            candidates = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probes])
+            scores = self._scores(query, candidates)
+        else:
+            candidates = None
+            scores = self._scores(query)
+        if self.deleted:
+            deleted = np.fromiter(self.deleted, dtype=np.int64)
+            if candidates is not None:
+                scores[np.isin(candidates, deleted)] = -np.inf
+            else:
+                scores[deleted] = -np.inf
+
+        full_vectors = self.full_vectors if rerank and self.vector_dtype != "float32" else None
+        n = min(k * rerank if full_vectors is not None else k, len(scores))
+        if n == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        top = top[np.isfinite(scores[top])]
+        ids = candidates[top] if candidates is not None else top
+        scores = scores[top]
+        if full_vectors is not None and len(ids):
+            scores = full_vectors[ids] @ query
+            order = np.argsort(-scores)[:k]
+            ids, scores = ids[order], scores[order]
+        return ids, scores
+
+
+class LocalStore:
+    """
+    In-process vector store, one LocalCollection per sub directory of folder_path.
+    Drop-in for MilvusStore when no Milvus server is available.
+
+    Args:
+        folder_path: Directory of the store
+        vector_dtype: Vector dtype of collections created by this store
+        keep_full: Keep float32 vectors of new compressed collections for reranking
+    """
+    kind = "local"
+
+    def __init__(self, folder_path:str, vector_dtype:str="float32", keep_full:bool=False):
+        self.folder_path = folder_path
+        self.vector_dtype = vector_dtype
+        self.keep_full = keep_full
+        self._collections = {}
+
+    def has_collection(self, collection_name:str) -> bool:
+        return os.path.exists(os.path.join(self.folder_path, collection_name, "meta.json"))
+
+    def create_collection(self, collection_name:str, dim:int, varchar_fields:dict|None=None, description:str=""):
+        """create collection if it does not exist, fields are schemaless here"""
+        self.collection(collection_name, dim)
+
+    def drop_collection(self, collection_name:str):
+        import shutil
+        self._collections.pop(collection_name, None)
+        shutil.rmtree(os.path.join(self.folder_path, collection_name), ignore_errors=True)
+
+    def insert(self, collection_name:str, vectors, rows:list[dict], partition_name:str|None=None) -> list[int]:
+        """partitions are not materialized locally, filters scan the scalar fields"""
+        return self.collection(collection_name).insert(vectors, rows)
+
+    def delete(self, collection_name:str, ids:list[int]):
+        self.collection(collection_name).delete(ids)
+
+    def flush(self, collection_name:str):
+        pass
+
+    def health_check(self) -> dict:
+        """row counts of the opened collections, raises if a collection folder is gone"""
+        counts = {}
+        for name, collection in list(self._collections.items()):
+            collection.refresh()
+            counts[name] = collection.count - len(collection.deleted)
+        return {"collections": counts}
+
+    def collection(self, collection_name:str, dim:int|None=None) -> LocalCollection:
+        if collection_name not in self._collections:
+            self._collections[collection_name] = LocalCollection(
+                os.path.join(self.folder_path, collection_name), dim, self.vector_dtype, self.keep_full)
+        return self._collections[collection_name]
+
+    def search(self, collection_name:str, embedding, output_fields:list, k:int=5,
+               params:dict|None=None, timeout:float|None=None, filters:dict|None=None):
+        """same contract as MilvusStore.search, nprobe in params selects the IVF index if built
+        and rerank rescores k * rerank candidates of a compressed collection exactly"""
+        collection = self.collection(collection_name)
+        collection.refresh()
+        row_ids = None
+        if filters:
+            row_ids = [i for i, row in enumerate(collection.rows) if matches(row, filters)]
+        params = params or {}
+        ids, scores = collection.search(embedding, k, params.get("nprobe"), row_ids, params.get("rerank", 0))
+        rows = collection.rows
+        return [LocalHit(id=int(i), score=float(s),
+                         entity={name: rows[i].get(name) for name in output_fields})
+                for i, s in zip(ids, scores)]
+
+    def hydrate(self, collection_name:str, ids:list[int], output_fields:list,
+                timeout:float|None=None) -> dict[int, dict]:
+        """fields of rows by id, for the second phase of two_phase_search"""
+        rows = self.collection(collection_name).rows
+        return {int(i): {name: rows[i].get(name) for name in output_fields} for i in ids}
+
+    def iter_rows(self, collection_name:str, output_fields:list, batch_size:int=1000) -> Iterator[tuple[int, dict]]:
+        """(row id, fields) of every row that is not deleted"""
+        collection = self.collection(collection_name)
+        collection.refresh()
+        deleted = set(collection.deleted)
+        for i, row in enumerate(collection.rows):
+            if i not in deleted:
+                yield i, {name: row.get(name) for name in output_fields}
+
+    def fetch_vectors(self, collection_name:str, ids:list[int]) -> np.ndarray:
+        """stored vectors of rows by id, float32 ones if the collection keeps them"""
+        collection = self.collection(collection_name)
+        ids = [int(i) for i in ids]
+        full = collection.full_vectors
+        return np.array(full[ids], dtype=np.float32) if full is not None else collection.get_vectors(ids)
+
+
+def copy_from_milvus(collection_name:str, store:LocalStore, batch_size:int=1000, nlist:int|None=None):
+    """copy all rows and embeddings of a Milvus collection into a local store"""
+    from pymilvus import Collection
+    connect_to_milvus()
+    source = Collection(collection_name)
+    source.load()
+    fields = [f.name for f in source.schema.fields if f.name not in ("id", "embedding")]
+    dim = next(f.params["dim"] for f in source.schema.fields if f.name == "embedding")
+
+    target = store.collection(collection_name, dim)
+    iterator = source.query_iterator(batch_size=batch_size, output_fields=fields + ["embedding"])
+    while True:
+        batch = iterator.next()
+        if not batch:
+            iterator.close()
+            break
+        target.insert([row["embedding"] for row in batch],
+                      [{name: row.get(name) for name in fields} for row in batch])
+    if nlist:
+        target.build_ivf(nlist)
+    print(f"Copied {target.count} rows of '{collection_name}' to {target.folder_path}")
+
+
+def get_vector_store():
+    """vector store selected by VECTOR_STORE (milvus or local), LOCAL_STORE_DIR and LOCAL_VECTOR_DTYPE"""
+    if os.getenv("VECTOR_STORE", "milvus") == "local":
+        return LocalStore(os.getenv("LOCAL_STORE_DIR", "./data/vector_store"),
+                          vector_dtype=os.getenv("LOCAL_VECTOR_DTYPE", "float32"),
+                          keep_full=os.getenv("LOCAL_KEEP_FULL", "0") == "1")
+    return MilvusStore()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="copy Milvus collections into the local vector store")
+    parser.add_argument("collections", nargs="+")
+    parser.add_argument("--folder", default=os.getenv("LOCAL_STORE_DIR", "./data/vector_store"))
+    parser.add_argument("--nlist", type=int, default=None, help="also build an IVF index with nlist lists")
+    parser.add_argument("--vector-dtype", choices=sorted(VECTOR_DTYPES), default="float32")
+    parser.add_argument("--keep-full", action="store_true", help="keep float32 vectors of compressed collections for reranking")
+    args = parser.parse_args()
+    local_store = LocalStore(args.folder, vector_dtype=args.vector_dtype, keep_full=args.keep_full)
+    for name in args.collections:
+        copy_from_milvus(name, local_store, nlist=args.nlist)